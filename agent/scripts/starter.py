@@ -3,7 +3,6 @@ import os
 import requests
 import tweepy
 import inquirer
-import time
 
 from src.db import SQLiteDB
 from src.client.rag import RAGClient
@@ -19,7 +18,9 @@ from typing import Callable
 from src.agent.marketing import MarketingAgent, MarketingPromptGenerator
 from src.agent.trading import TradingAgent, TradingPromptGenerator
 from src.datatypes import StrategyData
-from src.container import ContainerManager
+from src.code_archive import CodeArchive
+from src.container import ContainerManager, ContainerPool, ExecutionResultCache
+from src.scheduler import SessionScheduler
 from src.helper import (
 	get_ether_address_from_txn_service,
 	services_to_envs,
@@ -27,8 +28,9 @@ from src.helper import (
 )
 from src.genner import get_genner
 from src.genner.Base import Genner
-from src.client.openrouter import OpenRouter
-from src.summarizer import get_summarizer
+from src.genner.Cached import CachedGenner, ResponseCache
+from src.client.openrouter import AsyncOpenRouter, OpenRouter
+from src.summarizer import get_async_summarizer, get_summarizer
 from anthropic import Anthropic
 import docker
 from functools import partial
@@ -43,8 +45,73 @@ from src.twitter import TweepyTwitterClient
 
 load_dotenv()
 
+_container_pool: ContainerPool | None = None
+_code_archive: CodeArchive | None = None
 
-def start_marketing_agent(
+
+def get_container_pool() -> ContainerPool | None:
+	"""
+	Get the process-wide pool of executor containers, starting it on first use.
+
+	The pool is enabled by setting `AGENT_EXECUTOR_POOL_SIZE` to a positive number
+	of containers, and its containers are recycled every `AGENT_EXECUTOR_POOL_MAX_RUNS` runs.
+
+	Returns:
+		ContainerPool | None: The pool, or None if pooling is disabled
+	"""
+	global _container_pool
+
+	pool_size = int(os.getenv("AGENT_EXECUTOR_POOL_SIZE", "0"))
+	if _container_pool is None and pool_size > 0:
+		_container_pool = ContainerPool(
+			docker.from_env(),
+			size=pool_size,
+			max_runs=int(os.getenv("AGENT_EXECUTOR_POOL_MAX_RUNS", "50")),
+		)
+
+	return _container_pool
+
+
+def get_code_archive() -> CodeArchive:
+	"""
+	Get the process-wide archive of the code run in the executor.
+
+	It is bounded by `AGENT_CODE_ARCHIVE_MAX_MB` and `AGENT_CODE_ARCHIVE_MAX_AGE_DAYS`,
+	and `AGENT_CODE_ARCHIVE_COMPRESS` controls whether the scripts are gzipped.
+
+	Returns:
+		CodeArchive: The archive, in `./code/archive`
+	"""
+	global _code_archive
+
+	if _code_archive is None:
+		_code_archive = CodeArchive(
+			"./code/archive",
+			max_bytes=int(os.getenv("AGENT_CODE_ARCHIVE_MAX_MB", "256")) * 1024 * 1024,
+			max_age_seconds=float(os.getenv("AGENT_CODE_ARCHIVE_MAX_AGE_DAYS", "7"))
+			* 24
+			* 3600,
+			compress=os.getenv("AGENT_CODE_ARCHIVE_COMPRESS", "true").lower() == "true",
+		)
+
+	return _code_archive
+
+
+def get_result_cache() -> ExecutionResultCache | None:
+	"""
+	Get a cache of research code outputs, if `AGENT_EXECUTOR_RESULT_CACHE_TTL` is set to a positive number of seconds.
+
+	Returns:
+		ExecutionResultCache | None: The cache, or None if caching is disabled
+	"""
+	ttl_seconds = int(os.getenv("AGENT_EXECUTOR_RESULT_CACHE_TTL", "0"))
+	if ttl_seconds <= 0:
+		return None
+
+	return ExecutionResultCache(ttl_seconds=ttl_seconds)
+
+
+def setup_marketing_agent(
 	agent_type: str,
 	session_id: str,
 	agent_id: str,
@@ -54,7 +121,13 @@ def start_marketing_agent(
 	sensor: MarketingSensorInterface,
 	db: DBInterface,
 	stream_fn: Callable[[str], None] = lambda x: print(x, flush=True, end=""),
-):
+) -> Callable[[], None]:
+	"""
+	Build a marketing agent and sync its strategies to the RAG once.
+
+	Returns:
+	    Callable[[], None]: Runs one cycle of the agent, reusing the same agent and container manager
+	"""
 	role = fe_data["role"]
 	time_ = fe_data["time"]
 	metric_name = fe_data["metric_name"]
@@ -74,6 +147,10 @@ def start_marketing_agent(
 		"superioragents/agent-executor:latest",
 		"./code",
 		in_con_env=in_con_env,
+		pool=get_container_pool(),
+		debug=os.getenv("AGENT_EXECUTOR_DEBUG", "false").lower() == "true",
+		result_cache=get_result_cache(),
+		code_archive=get_code_archive(),
 	)
 
 	summarizer = get_summarizer(genner)
@@ -100,9 +177,12 @@ def start_marketing_agent(
 		apis=apis,
 		metric_name=metric_name,
 		summarizer=summarizer,
+		candidates=int(os.getenv("AGENT_SPECULATIVE_CANDIDATES", "1")),
+		async_summarizer=get_async_summarizer(genner),
 	)
 
-	run_cycle(
+	return partial(
+		run_cycle,
 		agent,
 		notif_sources,
 		flow_func,
@@ -113,7 +193,7 @@ def start_marketing_agent(
 	)
 
 
-def start_trading_agent(
+def setup_trading_agent(
 	agent_type: str,
 	session_id: str,
 	agent_id: str,
@@ -124,7 +204,13 @@ def start_trading_agent(
 	db: DBInterface,
 	txn_service_url: str,
 	stream_fn: Callable[[str], None] = lambda x: print(x, flush=True, end=""),
-):
+) -> Callable[[], None]:
+	"""
+	Build a trading agent and sync its strategies to the RAG once.
+
+	Returns:
+	    Callable[[], None]: Runs one cycle of the agent, reusing the same agent and container manager
+	"""
 	role = fe_data["role"]
 	network = fe_data["network"]
 	services_used = fe_data["research_tools"]
@@ -145,6 +231,10 @@ def start_trading_agent(
 		"agent-executor",
 		"./code",
 		in_con_env=in_con_env,
+		pool=get_container_pool(),
+		debug=os.getenv("AGENT_EXECUTOR_DEBUG", "false").lower() == "true",
+		result_cache=get_result_cache(),
+		code_archive=get_code_archive(),
 	)
 
 	summarizer = get_summarizer(genner)
@@ -174,9 +264,11 @@ def start_trading_agent(
 		metric_name=metric_name,
 		txn_service_url=txn_service_url,
 		summarizer=summarizer,
+		candidates=int(os.getenv("AGENT_SPECULATIVE_CANDIDATES", "1")),
 	)
 
-	run_cycle(
+	return partial(
+		run_cycle,
 		agent,
 		notif_sources,
 		flow_func,
@@ -187,6 +279,37 @@ def start_trading_agent(
 	)
 
 
+def with_response_cache(genner: Genner) -> Genner:
+	"""
+	Wrap the genner in a `CachedGenner` when AGENT_LLM_CACHE_TTL or AGENT_LLM_REPLAY is set.
+
+	Returns:
+	    Genner: The cached genner, or the genner itself when the response cache is disabled
+	"""
+	ttl_seconds = int(os.getenv("AGENT_LLM_CACHE_TTL", "0"))
+	replay_only = os.getenv("AGENT_LLM_REPLAY", "false").lower() == "true"
+	if ttl_seconds <= 0 and not replay_only:
+		return genner
+
+	cache = ResponseCache(
+		os.getenv("AGENT_LLM_CACHE_PATH", "./code/llm_cache.sqlite3"),
+		ttl_seconds=ttl_seconds if ttl_seconds > 0 else None,
+		max_entries=int(os.getenv("AGENT_LLM_CACHE_MAX_ENTRIES", "10000")),
+	)
+
+	return CachedGenner(genner, cache, replay_only=replay_only)
+
+
+def start_marketing_agent(*args, **kwargs):
+	"""Build a marketing agent with `setup_marketing_agent` and run a single cycle of it."""
+	setup_marketing_agent(*args, **kwargs)()
+
+
+def start_trading_agent(*args, **kwargs):
+	"""Build a trading agent with `setup_trading_agent` and run a single cycle of it."""
+	setup_trading_agent(*args, **kwargs)()
+
+
 def run_cycle(
 	agent: TradingAgent | MarketingAgent,
 	notif_sources: list[str],
@@ -504,6 +627,16 @@ def starter_prompt():
 		else None
 	)
 
+	async_or_client = (
+		AsyncOpenRouter(
+			base_url="https://openrouter.ai/api/v1",
+			api_key=os.getenv("OPENROUTER_API_KEY"),
+			include_reasoning=True,
+		)
+		if os.getenv("OPENROUTER_API_KEY") is not None
+		else None
+	)
+
 	anthropic_client = (
 		Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
 		if os.getenv("ANTHROPIC_API_KEY") is not None
@@ -514,51 +647,62 @@ def starter_prompt():
 		backend=fe_data["model"],
 		# deepseek_deepseek_client=deepseek_deepseek_client,
 		or_client=or_client,
+		async_or_client=async_or_client,
 		anthropic_client=anthropic_client,
 		stream_fn=lambda token: print(token, end="", flush=True),
 	)
-	# modify this if you want to run this forever
-	for x in range(3):
-		if answers["agent_type"] == "marketing":
-			start_marketing_agent(
-				agent_type=answers["agent_type"],
-				session_id="default_marketing"
-				if answers["agent_type"] == "marketing"
-				else "default_trading",
-				agent_id="default_marketing"
-				if answers["agent_type"] == "marketing"
-				else "default_trading",
-				fe_data=fe_data,
-				genner=genner,
-				db=SQLiteDB(
-					db_path=os.getenv("SQLITE_PATH", "../db/superior-agents.db")
-				),
-				rag=rag_client,
-				sensor=sensor,
-			)
-		elif answers["agent_type"] == "trading":
-			start_trading_agent(
-				agent_type=answers["agent_type"],
-				session_id="default_marketing"
-				if answers["agent_type"] == "marketing"
-				else "default_trading",
-				agent_id="default_marketing"
-				if answers["agent_type"] == "marketing"
-				else "default_trading",
-				fe_data=fe_data,
-				genner=genner,
-				db=SQLiteDB(
-					db_path=os.getenv("SQLITE_PATH", "../db/superior-agents.db")
-				),
-				rag=rag_client,
-				sensor=sensor,
-				txn_service_url=os.getenv("TXN_SERVICE_URL"),
-			)
-		session_interval = 15
-		logger.info(
-			f"Waiting for {session_interval} seconds before starting a new cycle..."
+	genner = with_response_cache(genner)
+	session_id = (
+		"default_marketing"
+		if answers["agent_type"] == "marketing"
+		else "default_trading"
+	)
+	agent_id = session_id
+	db = SQLiteDB(db_path=os.getenv("SQLITE_PATH", "../db/superior-agents.db"))
+
+	if answers["agent_type"] == "marketing":
+		cycle = setup_marketing_agent(
+			agent_type=answers["agent_type"],
+			session_id=session_id,
+			agent_id=agent_id,
+			fe_data=fe_data,
+			genner=genner,
+			db=db,
+			rag=rag_client,
+			sensor=sensor,
+		)
+	else:
+		cycle = setup_trading_agent(
+			agent_type=answers["agent_type"],
+			session_id=session_id,
+			agent_id=agent_id,
+			fe_data=fe_data,
+			genner=genner,
+			db=db,
+			rag=rag_client,
+			sensor=sensor,
+			txn_service_url=os.getenv("TXN_SERVICE_URL"),
 		)
-		time.sleep(session_interval)
+
+	# The interval defaults to the `session_interval` of the session in the database,
+	# or to 900 seconds without one (cycles used to be 15 seconds apart)
+	session_interval = os.getenv("AGENT_SESSION_INTERVAL")
+	# modify AGENT_MAX_CYCLES (0 for no limit) if you want to run this forever
+	max_cycles = int(os.getenv("AGENT_MAX_CYCLES", "3"))
+
+	scheduler = SessionScheduler(
+		max_workers=int(os.getenv("AGENT_SCHEDULER_WORKERS", "4"))
+	)
+	scheduler.add_session(
+		session_id=session_id,
+		agent_id=agent_id,
+		cycle=cycle,
+		db=db,
+		interval_seconds=float(session_interval) if session_interval else None,
+		max_cycles=max_cycles or None,
+	)
+	scheduler.install_signal_handlers()
+	scheduler.run()
 
 
 if __name__ == "__main__":
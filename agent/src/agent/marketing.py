@@ -1,3 +1,4 @@
+import copy
 from datetime import datetime
 import re
 from textwrap import dedent
@@ -423,6 +424,25 @@ class MarketingAgent:
 		"""
 		self.chat_history = ChatHistory()
 
+	def with_genner(self, genner: Genner) -> "MarketingAgent":
+		"""
+		Get a copy of the agent generating with another generator.
+
+		The copy shares every other component and the chat history of the agent,
+		which is what lets candidates be generated concurrently, e.g. with
+		`Genner.variant`.
+
+		Args:
+		        genner (Genner): Generator used by the copy
+
+		Returns:
+		        MarketingAgent: The copy of the agent
+		"""
+		agent = copy.copy(self)
+		agent.genner = genner
+
+		return agent
+
 	def prepare_system(self, role: str, time: str, metric_name: str, metric_state: str):
 		"""
 		Prepare the system prompt for the agent.
@@ -1,3 +1,4 @@
+import copy
 import re
 from textwrap import dedent
 from typing import Dict, List, Set, Tuple
@@ -842,6 +843,25 @@ class TradingAgent:
 		"""
 		self.chat_history = ChatHistory()
 
+	def with_genner(self, genner: Genner) -> "TradingAgent":
+		"""
+		Get a copy of the agent generating with another generator.
+
+		The copy shares every other component and the chat history of the agent,
+		which is what lets candidates be generated concurrently, e.g. with
+		`Genner.variant`.
+
+		Args:
+		    genner (Genner): Generator used by the copy
+
+		Returns:
+		    TradingAgent: The copy of the agent
+		"""
+		agent = copy.copy(self)
+		agent.genner = genner
+
+		return agent
+
 	def prepare_system(
 		self, role: str, time: str, metric_name: str, metric_state: str, network: str
 	) -> ChatHistory:
@@ -1,8 +1,28 @@
+import asyncio
 import httpx
+import importlib.util
 import json
-from typing import Optional, Dict, Generator, List, Any, Tuple
+import random
+import weakref
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import (
+	AsyncGenerator,
+	Callable,
+	Optional,
+	Dict,
+	Generator,
+	List,
+	Any,
+	Tuple,
+)
 from dataclasses import dataclass
 
+from loguru import logger
+
+# Status codes worth retrying: rate limits and transient server errors
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
 
 @dataclass
 class Message:
@@ -89,16 +109,15 @@ class OpenRouter:
 
 		payload = {
 			"messages": processed_messages,
-			"provider": {"order": self.providers},
+			"provider": {"order": providers or self.providers},
 			"max_tokens": max_tokens,
 			"include_reasoning": include_reasoning,
 			"model": model,
 			"stream": stream,
+			# Report the token usage, including the prompt tokens read from the cache
+			"usage": {"include": True},
 		}
 
-		if not providers:
-			payload["provider"] = {"order": self.providers}
-
 		if temperature is not None:
 			payload["temperature"] = temperature
 
@@ -121,6 +140,7 @@ class OpenRouter:
 		model: Optional[str] = None,
 		include_reasoning: Optional[bool] = None,
 		max_tokens: Optional[int] = None,
+		on_usage: Optional[Callable[[Dict[str, Any]], None]] = None,
 	) -> str:
 		"""
 		Create a non-streaming chat completion.
@@ -130,6 +150,7 @@ class OpenRouter:
 		    model: The model to use (e.g., "openai/gpt-4o", "deepseek/deepseek-r1")
 		    temperature: Sampling temperature (0-2)
 		    max_tokens: Maximum tokens to generate
+		    on_usage: Called with the `usage` object of the response, if any
 		    **kwargs: Additional parameters to pass to the API
 
 		Returns:
@@ -148,6 +169,9 @@ class OpenRouter:
 		endpoint = f"{self.base_url}/chat/completions"
 		response = self._send_request(endpoint, payload)
 
+		if on_usage is not None and response.get("usage"):
+			on_usage(response["usage"])
+
 		try:
 			content = response["choices"][0]["message"]["content"]
 			if not isinstance(content, str):
@@ -205,6 +229,7 @@ class OpenRouter:
 		model: Optional[str] = None,
 		include_reasoning: Optional[bool] = None,
 		max_tokens: Optional[int] = None,
+		on_usage: Optional[Callable[[Dict[str, Any]], None]] = None,
 	) -> Generator[Tuple[str, str], None, None]:
 		"""
 		Create a streaming chat completion with support for reasoning models.
@@ -214,6 +239,7 @@ class OpenRouter:
 		    model: The model to use (e.g., "openai/gpt-4o", "deepseek/deepseek-r1")
 		    temperature: Sampling temperature (0-2)
 		    max_tokens: Maximum tokens to generate
+		    on_usage: Called with the `usage` object sent in the last chunk of the stream, if the stream is read to its end
 		    **kwargs: Additional parameters to pass to the API
 
 		Returns:
@@ -230,10 +256,13 @@ class OpenRouter:
 		)
 
 		endpoint = f"{self.base_url}/chat/completions"
-		return self._stream_response(endpoint, payload)
+		return self._stream_response(endpoint, payload, on_usage)
 
 	def _stream_response(
-		self, endpoint: str, payload: Dict
+		self,
+		endpoint: str,
+		payload: Dict,
+		on_usage: Optional[Callable[[Dict[str, Any]], None]] = None,
 	) -> Generator[Tuple[str, str], None, None]:
 		"""
 		Stream the response from the API, handling both content and reasoning tokens.
@@ -246,6 +275,7 @@ class OpenRouter:
 		Args:
 		    endpoint (str): API endpoint URL
 		    payload (Dict): Request payload
+		    on_usage (Optional[Callable[[Dict[str, Any]], None]], optional): Called with the `usage` object of the last chunk. Defaults to None.
 
 		Returns:
 		    Generator[Tuple[str, str], None, None]: Generator yielding tuples of
@@ -268,48 +298,421 @@ class OpenRouter:
 						f"HTTP error {response.status_code}: {error_text}"
 					)
 				buffer = ""
-				in_reasoning_phase = False
 				for chunk in response.iter_raw():
 					buffer += chunk.decode("utf-8")
 					while "\n" in buffer:
 						line_end = buffer.find("\n")
 						line = buffer[:line_end].strip()
 						buffer = buffer[line_end + 1 :]
-						if line.startswith(": OPENROUTER PROCESSING"):
-							continue
-						if line.startswith("data: "):
-							data = line[6:]
-							if data == "[DONE]":
-								return
-							try:
-								data_obj = json.loads(data)
-								if "choices" in data_obj and data_obj["choices"]:
-									delta = data_obj["choices"][0].get("delta", {})
-									content = delta.get("content")
-									reasoning = delta.get("reasoning")
-
-									# Process tokens but DON'T emit the <think> tags
-									if reasoning is not None and self.include_reasoning:
-										# Clean various tokens that might appear
-										reasoning = (
-											reasoning.replace("</s>", "")
-											.replace("<response>", "")
-											.replace("</thinking>", "")
-										)
-										# Track phase but don't emit tag
-										in_reasoning_phase = True
-										# Just yield the reasoning content
-										yield (reasoning, "reasoning")
-									elif content is not None:
-										# Track phase change but don't emit closing tag
-										if in_reasoning_phase:
-											in_reasoning_phase = False
-
-										# Yield main content without checking for </think>
-										yield (content, "main")
-							except json.JSONDecodeError:
-								pass
+						done, token = self._parse_stream_line(line, on_usage)
+						if done:
+							return
+						if token is not None:
+							yield token
 		except httpx.HTTPError as e:
 			raise OpenRouterError(f"HTTP error occurred during streaming: {str(e)}")
 		except Exception as e:
 			raise OpenRouterError(f"Error occurred during streaming: {str(e)}")
+
+	def _parse_stream_line(
+		self,
+		line: str,
+		on_usage: Optional[Callable[[Dict[str, Any]], None]] = None,
+	) -> Tuple[bool, Optional[Tuple[str, str]]]:
+		"""
+		Parse one line of a streamed response.
+
+		Args:
+		    line (str): The line, stripped
+		    on_usage (Optional[Callable[[Dict[str, Any]], None]], optional): Called with the `usage` object of the chunk, if any. Defaults to None.
+
+		Returns:
+		    Tuple[bool, Optional[Tuple[str, str]]]:
+		        - Whether the stream is done
+		        - The (content, type) token of the line, type being "reasoning" or "main", or None if the line has none
+		"""
+		if line.startswith(": OPENROUTER PROCESSING") or not line.startswith("data: "):
+			return False, None
+
+		data = line[6:]
+		if data == "[DONE]":
+			return True, None
+
+		try:
+			data_obj = json.loads(data)
+		except json.JSONDecodeError:
+			return False, None
+
+		if on_usage is not None and data_obj.get("usage"):
+			on_usage(data_obj["usage"])
+		if "choices" not in data_obj or not data_obj["choices"]:
+			return False, None
+
+		delta = data_obj["choices"][0].get("delta", {})
+		content = delta.get("content")
+		reasoning = delta.get("reasoning")
+
+		# Process tokens but DON'T emit the <think> tags
+		if reasoning is not None and self.include_reasoning:
+			# Clean various tokens that might appear
+			reasoning = (
+				reasoning.replace("</s>", "")
+				.replace("<response>", "")
+				.replace("</thinking>", "")
+			)
+			return False, (reasoning, "reasoning")
+		elif content is not None:
+			return False, (content, "main")
+
+		return False, None
+
+
+def retry_delay(
+	attempt: int,
+	retry_after: Optional[str] = None,
+	base_seconds: float = 1.0,
+	max_seconds: float = 30.0,
+) -> float:
+	"""
+	Compute the time to wait before retrying a request.
+
+	The `Retry-After` header of the response is honoured when it is present,
+	otherwise the delay is drawn uniformly up to an exponentially growing cap
+	("full jitter"), so clients retrying at the same time spread out.
+
+	Args:
+	    attempt (int): Number of the retry, starting at 0
+	    retry_after (Optional[str], optional): `Retry-After` header of the response, in seconds or as an HTTP date. Defaults to None.
+	    base_seconds (float, optional): Cap of the first retry. Defaults to 1.0.
+	    max_seconds (float, optional): Maximum delay. Defaults to 30.0.
+
+	Returns:
+	    float: The delay in seconds
+	"""
+	if retry_after:
+		try:
+			return min(max_seconds, max(0.0, float(retry_after)))
+		except ValueError:
+			pass
+		try:
+			retry_at = parsedate_to_datetime(retry_after)
+			delay = (retry_at - datetime.now(timezone.utc)).total_seconds()
+			return min(max_seconds, max(0.0, delay))
+		except (TypeError, ValueError):
+			pass
+
+	return random.uniform(0, min(max_seconds, base_seconds * 2**attempt))
+
+
+class AsyncOpenRouter(OpenRouter):
+	"""
+	Asynchronous OpenRouter client sharing warm connections between instances.
+
+	All the instances used on an event loop send their requests through one
+	`httpx.AsyncClient`, using HTTP/2 when the `h2` package is installed and
+	keeping idle connections alive, so many agents in one process neither
+	open a connection per request nor per client. Requests failing with 429 or
+	5xx statuses, or with transport errors, are retried with jittered
+	exponential backoff, and the number of requests in flight is bounded per
+	preferred provider.
+
+	    >>> client = AsyncOpenRouter(api_key=os.getenv("OPENROUTER_API_KEY"))
+	    >>> content = await client.create_chat_completion(messages)
+	"""
+
+	# Shared clients and semaphores are bound to the event loop they were created on
+	_shared_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+	_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]" = weakref.WeakKeyDictionary()
+
+	def __init__(
+		self,
+		api_key: str,
+		base_url: str = "https://openrouter.ai/api/v1",
+		providers: List[str] = [
+			"DeepSeek",
+			"Nebius",
+			"Together",
+			"Fireworks",
+		],
+		timeout: int = 60,
+		model: str = "deepseek/deepseek-r1",
+		include_reasoning: bool = True,
+		max_retries: int = 4,
+		max_concurrency_per_provider: int = 8,
+		limits: httpx.Limits = httpx.Limits(
+			max_connections=100,
+			max_keepalive_connections=20,
+			keepalive_expiry=120,
+		),
+	):
+		"""
+		Initialize the asynchronous OpenRouter client.
+
+		Args:
+		    api_key: Your OpenRouter API key
+		    base_url: The base URL for OpenRouter API
+		    timeout: Request timeout in seconds
+		    include_reasoning: Whether to include reasoning tokens in streaming responses
+		    max_retries: Number of retries of a request failing with a retryable status or a transport error
+		    max_concurrency_per_provider: Maximum number of requests in flight per preferred provider
+		    limits: Connection pool limits of the shared client, used by the first client of an event loop
+		"""
+		self.api_key = api_key
+		self.base_url = base_url.rstrip("/")
+		self.providers = providers
+		self.timeout = timeout
+		self.include_reasoning = include_reasoning
+		self.model = model
+		self.max_retries = max_retries
+		self.max_concurrency_per_provider = max_concurrency_per_provider
+		self.limits = limits
+
+		self.headers = {
+			"Authorization": f"Bearer {api_key}",
+			"Content-Type": "application/json",
+		}
+
+	@property
+	def http_client(self) -> httpx.AsyncClient:
+		"""
+		The client shared by all the instances on the running event loop.
+		"""
+		loop = asyncio.get_running_loop()
+		client = self._shared_clients.get(loop)
+		if client is None or client.is_closed:
+			http2 = importlib.util.find_spec("h2") is not None
+			if not http2:
+				logger.warning(
+					"Package h2 is not installed, AsyncOpenRouter falls back to HTTP/1.1"
+				)
+			client = httpx.AsyncClient(
+				http2=http2,
+				limits=self.limits,
+				timeout=httpx.Timeout(self.timeout, connect=10),
+			)
+			self._shared_clients[loop] = client
+
+		return client
+
+	@classmethod
+	async def aclose(cls):
+		"""
+		Close the client shared on the running event loop, if any.
+		"""
+		client = cls._shared_clients.pop(asyncio.get_running_loop(), None)
+		if client is not None:
+			await client.aclose()
+
+	def _semaphore(self, payload: Dict) -> asyncio.Semaphore:
+		# Bounds the requests in flight to the preferred provider of the payload,
+		# i.e. the first of the `providers` of the request or of the client
+		order = payload.get("provider", {}).get("order") or ["default"]
+		semaphores = self._semaphores.setdefault(asyncio.get_running_loop(), {})
+		if order[0] not in semaphores:
+			semaphores[order[0]] = asyncio.Semaphore(self.max_concurrency_per_provider)
+
+		return semaphores[order[0]]
+
+	async def _open(self, endpoint: str, payload: Dict) -> httpx.Response:
+		"""
+		Send a request and open its response, retrying on retryable statuses and transport errors.
+
+		Args:
+		    endpoint (str): API endpoint URL
+		    payload (Dict): Request payload
+
+		Returns:
+		    httpx.Response: The open response, with a 200 status. Must be closed by the caller.
+
+		Raises:
+		    OpenRouterError: If the request still fails after the retries
+		"""
+		for attempt in range(self.max_retries + 1):
+			retry_after = None
+			try:
+				request = self.http_client.build_request(
+					"POST",
+					endpoint,
+					headers=self.headers,
+					content=json.dumps(payload),
+					timeout=self.timeout,
+				)
+				response = await self.http_client.send(request, stream=True)
+			except httpx.TransportError as e:
+				error = f"HTTP error occurred: {str(e)}"
+			else:
+				if response.status_code == 200:
+					return response
+
+				error_text = (await response.aread()).decode("utf-8")
+				await response.aclose()
+				error = f"HTTP error {response.status_code}: {error_text}"
+				if response.status_code not in RETRY_STATUS_CODES:
+					raise OpenRouterError(error)
+				retry_after = response.headers.get("Retry-After")
+
+			if attempt == self.max_retries:
+				raise OpenRouterError(error)
+
+			delay = retry_delay(attempt, retry_after)
+			logger.warning(
+				f"OpenRouter request failed, retrying in {delay:.1f} seconds ({attempt + 1}/{self.max_retries}), err: \n{error}"
+			)
+			await asyncio.sleep(delay)
+
+		raise OpenRouterError("Unreachable")
+
+	async def create_chat_completion(
+		self,
+		messages: List[Dict],
+		providers: List[str] = [],
+		temperature: Optional[float] = None,
+		model: Optional[str] = None,
+		include_reasoning: Optional[bool] = None,
+		max_tokens: Optional[int] = None,
+		on_usage: Optional[Callable[[Dict[str, Any]], None]] = None,
+	) -> str:
+		"""
+		Create a non-streaming chat completion.
+
+		Args:
+		    messages: List of message dictionaries or Message objects
+		    providers: Preferred providers of the request, in order. Defaults to the providers of the client.
+		    model: The model to use (e.g., "openai/gpt-4o", "deepseek/deepseek-r1")
+		    temperature: Sampling temperature (0-2)
+		    max_tokens: Maximum tokens to generate
+		    on_usage: Called with the `usage` object of the response, if any
+
+		Returns:
+		    The generated text response as a string
+		"""
+		payload = self._prepare_payload(
+			messages=messages,
+			temperature=temperature,
+			providers=providers,
+			model=model,
+			max_tokens=max_tokens,
+			include_reasoning=include_reasoning,
+			stream=False,
+		)
+
+		endpoint = f"{self.base_url}/chat/completions"
+		response = await self._send_request(endpoint, payload)
+
+		if on_usage is not None and response.get("usage"):
+			on_usage(response["usage"])
+
+		try:
+			content = response["choices"][0]["message"]["content"]
+			if not isinstance(content, str):
+				raise OpenRouterError(
+					"Unexpected response format: content is not a string"
+				)
+			return content
+		except (KeyError, IndexError) as e:
+			raise OpenRouterError(f"Unexpected response format: {str(e)}")
+
+	async def _send_request(self, endpoint: str, payload: Dict) -> Dict:  # type: ignore[override]
+		"""
+		Send a regular (non-streaming) request to the API.
+
+		Args:
+		    endpoint (str): API endpoint URL
+		    payload (Dict): Request payload
+
+		Returns:
+		    Dict: JSON response from the API
+
+		Raises:
+		    OpenRouterError: If an HTTP error or other exception occurs
+		"""
+		async with self._semaphore(payload):
+			response = await self._open(endpoint, payload)
+			try:
+				return json.loads(await response.aread())
+			except httpx.HTTPError as e:
+				raise OpenRouterError(f"HTTP error occurred: {str(e)}")
+			except json.JSONDecodeError as e:
+				raise OpenRouterError(f"Error occurred: {str(e)}")
+			finally:
+				await response.aclose()
+
+	def create_chat_completion_stream(  # type: ignore[override]
+		self,
+		messages: List[Dict],
+		providers: List[str] = [],
+		temperature: Optional[float] = 1.0,
+		model: Optional[str] = None,
+		include_reasoning: Optional[bool] = None,
+		max_tokens: Optional[int] = None,
+		on_usage: Optional[Callable[[Dict[str, Any]], None]] = None,
+	) -> AsyncGenerator[Tuple[str, str], None]:
+		"""
+		Create a streaming chat completion.
+
+		Args:
+		    messages: List of message dictionaries or Message objects
+		    providers: Preferred providers of the request, in order. Defaults to the providers of the client.
+		    model: The model to use (e.g., "openai/gpt-4o", "deepseek/deepseek-r1")
+		    temperature: Sampling temperature (0-2)
+		    max_tokens: Maximum tokens to generate
+		    on_usage: Called with the `usage` object sent in the last chunk of the stream, if the stream is read to its end
+
+		Returns:
+		    Async generator yielding tuples of (content, type) where type is "reasoning" or "main"
+		"""
+		payload = self._prepare_payload(
+			messages=messages,
+			temperature=temperature,
+			providers=providers,
+			model=model,
+			include_reasoning=include_reasoning,
+			max_tokens=max_tokens,
+			stream=True,
+		)
+
+		endpoint = f"{self.base_url}/chat/completions"
+		return self._stream_response(endpoint, payload, on_usage)
+
+	async def _stream_response(  # type: ignore[override]
+		self,
+		endpoint: str,
+		payload: Dict,
+		on_usage: Optional[Callable[[Dict[str, Any]], None]] = None,
+	) -> AsyncGenerator[Tuple[str, str], None]:
+		"""
+		Stream the response from the API, handling both content and reasoning tokens.
+
+		Only opening the response is retried, a stream failing midway raises.
+
+		Args:
+		    endpoint (str): API endpoint URL
+		    payload (Dict): Request payload
+		    on_usage (Optional[Callable[[Dict[str, Any]], None]], optional): Called with the `usage` object of the last chunk. Defaults to None.
+
+		Returns:
+		    AsyncGenerator[Tuple[str, str], None]: Async generator yielding tuples of
+		        (content, type) where type is "reasoning" or "main"
+
+		Raises:
+		    OpenRouterError: If an HTTP error or other exception occurs during streaming
+		"""
+		async with self._semaphore(payload):
+			response = await self._open(endpoint, payload)
+			try:
+				buffer = ""
+				async for chunk in response.aiter_raw():
+					buffer += chunk.decode("utf-8")
+					while "\n" in buffer:
+						line_end = buffer.find("\n")
+						line = buffer[:line_end].strip()
+						buffer = buffer[line_end + 1 :]
+						done, token = self._parse_stream_line(line, on_usage)
+						if done:
+							return
+						if token is not None:
+							yield token
+			except httpx.HTTPError as e:
+				raise OpenRouterError(f"HTTP error occurred during streaming: {str(e)}")
+			finally:
+				await response.aclose()
@@ -416,3 +416,68 @@ class RAGClient:
 			)
 
 			return []
+
+	def relevant_strategy_raw_v4_batch(
+		self, queries: List[str], top_k: int = 1
+	) -> List[List[Tuple[StrategyData, float]]]:
+		"""
+		Retrieve strategies relevant to each of the given queries in a single request.
+
+		This method sends every query to the batched v4 endpoint, which embeds
+		them together and searches the agent's knowledge base once for all of
+		them. It returns one list of (StrategyData, distance) tuples per query,
+		in the same order as the queries.
+
+		Args:
+		    queries (List[str]): The search queries to find relevant strategies for
+		    top_k (int): Number of strategies to retrieve per query
+
+		Returns:
+		    List[List[Tuple[StrategyData, float]]]: Relevant strategy data objects and their distances, per query
+		"""
+		results: List[List[Tuple[StrategyData, float]]] = [[] for _ in queries]
+
+		# Blank queries are answered locally, like in `relevant_strategy_raw_v4`
+		positions = [i for i, query in enumerate(queries) if query.strip()]
+		if not positions:
+			return results
+
+		url = f"{self.base_url}/relevant_strategy_raw_v4/batch"
+
+		payload = [
+			{
+				"query": queries[i],
+				"agent_id": self.agent_id,
+				"session_id": self.session_id,
+				"top_k": top_k,
+			}
+			for i in positions
+		]
+
+		response = requests.post(url, json=payload)
+
+		try:
+			response.raise_for_status()
+
+			r: StrategyResponse = response.json()
+
+			for i, subdatas in zip(positions, r["data"]):
+				for subdata in subdatas:
+					strategy_data = json.loads(subdata["metadata"]["strategy_data"])
+					strategy_data["created_at"] = strategy_data.get(
+						"created_at", subdata["metadata"]["created_at"]
+					)
+
+					strategy_data_obj = StrategyData(**strategy_data)
+					similarity_score = subdata["metadata"]["distance"]
+					results[i].append((strategy_data_obj, similarity_score))
+
+			return results
+		except Exception as e:
+			logger.error(
+				"Error on `/relevant_strategy_raw_v4/batch`, \n"
+				f"`queries`: \n{queries}\n"
+				f"`e`: \n{e}\n"
+			)
+
+			return [[] for _ in queries]
@@ -0,0 +1,271 @@
+import gzip
+import hashlib
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import List
+
+from loguru import logger
+
+from src.helper import nanoid
+
+
+@dataclass
+class ArchivedCode:
+	"""
+	Entry of the code archive.
+
+	Attributes:
+	    code_id (str): Unique identifier of the code, also its file name
+	    postfix (str): The type identifier of the run, e.g. "trader_research_code"
+	    created_at (float): Unix timestamp at which the code was archived
+	    path (str): Path of the archived file, relative to the archive folder
+	    size (int): Size of the archived file in bytes
+	    sha256 (str): Hash of the code, to find identical code across runs
+	"""
+
+	code_id: str
+	postfix: str
+	created_at: float
+	path: str
+	size: int
+	sha256: str
+
+
+class CodeArchive:
+	"""
+	Bounded archive of the code run in the executor, kept on the host for debugging.
+
+	Every script gets a unique id and is stored under `{folder}/{postfix}/{YYYYMMDD}/`,
+	optionally gzip compressed, and is recorded in a SQLite index so the code of
+	a given run can be found by id, postfix, time or hash. The oldest scripts are
+	deleted once the archive is over `max_bytes` or they are older than `max_age_seconds`,
+	along with the day folders they leave empty. The total size of the archive is
+	kept in memory, so adding a script only touches the index when rotating is due.
+	"""
+
+	def __init__(
+		self,
+		folder: Path | str,
+		max_bytes: int = 256 * 1024 * 1024,
+		max_age_seconds: float = 7 * 24 * 3600,
+		compress: bool = True,
+	):
+		"""
+		Initialize the archive, creating its folder and index if needed.
+
+		Args:
+		    folder (Path | str): Folder holding the archive
+		    max_bytes (int, optional): Maximum total size of the archived files. Defaults to 256 MiB.
+		    max_age_seconds (float, optional): Maximum age of an archived file. Defaults to 7 days.
+		    compress (bool, optional): Whether to gzip the archived files. Defaults to True.
+		"""
+		self.folder = Path(folder)
+		self.max_bytes = max_bytes
+		self.max_age_seconds = max_age_seconds
+		self.compress = compress
+
+		self.folder.mkdir(parents=True, exist_ok=True)
+		self.db_path = self.folder / "index.sqlite3"
+		self._lock = threading.Lock()
+
+		# A single connection, used under `_lock` from whichever thread runs code
+		self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+		with self._conn as conn:
+			conn.executescript(
+				"""
+				PRAGMA journal_mode=WAL;
+				CREATE TABLE IF NOT EXISTS codes (
+					code_id TEXT PRIMARY KEY,
+					postfix TEXT NOT NULL,
+					created_at REAL NOT NULL,
+					path TEXT NOT NULL,
+					size INTEGER NOT NULL,
+					sha256 TEXT NOT NULL
+				);
+				CREATE INDEX IF NOT EXISTS codes_created_at ON codes (created_at);
+				CREATE INDEX IF NOT EXISTS codes_postfix ON codes (postfix, created_at);
+				CREATE INDEX IF NOT EXISTS codes_sha256 ON codes (sha256);
+				"""
+			)
+			total_bytes, oldest_at = conn.execute(
+				"SELECT COALESCE(SUM(size), 0), MIN(created_at) FROM codes"
+			).fetchone()
+
+		self._total_bytes: int = total_bytes
+		self._oldest_at: float | None = oldest_at
+
+	def close(self):
+		"""
+		Close the connection to the index of the archive.
+		"""
+		with self._lock:
+			self._conn.close()
+
+	def add(self, code: str, postfix: str) -> ArchivedCode:
+		"""
+		Archive a script, then rotate the archive if it is over budget or holds expired scripts.
+
+		Args:
+		    code (str): The code to archive
+		    postfix (str): The type identifier of the run, e.g. "trader_research_code"
+
+		Returns:
+		    ArchivedCode: The archive entry of the script
+		"""
+		created_at = time.time()
+		code_id = f"{datetime.fromtimestamp(created_at).strftime('%Y%m%d_%H%M%S')}_{nanoid(8)}"
+
+		data = code.encode("utf-8")
+		sha256 = hashlib.sha256(data).hexdigest()
+		if self.compress:
+			data = gzip.compress(data)
+
+		day = datetime.fromtimestamp(created_at).strftime("%Y%m%d")
+		relative_path = (
+			Path(postfix) / day / f"{code_id}.py{'.gz' if self.compress else ''}"
+		)
+		path = self.folder / relative_path
+		path.parent.mkdir(parents=True, exist_ok=True)
+		path.write_bytes(data)
+
+		entry = ArchivedCode(
+			code_id=code_id,
+			postfix=postfix,
+			created_at=created_at,
+			path=str(relative_path),
+			size=len(data),
+			sha256=sha256,
+		)
+
+		with self._lock, self._conn as conn:
+			conn.execute(
+				"INSERT INTO codes (code_id, postfix, created_at, path, size, sha256) VALUES (?, ?, ?, ?, ?, ?)",
+				(
+					entry.code_id,
+					entry.postfix,
+					entry.created_at,
+					entry.path,
+					entry.size,
+					entry.sha256,
+				),
+			)
+			self._total_bytes += entry.size
+			if self._oldest_at is None:
+				self._oldest_at = entry.created_at
+
+			cutoff = created_at - self.max_age_seconds
+			if self._total_bytes > self.max_bytes or self._oldest_at < cutoff:
+				self._rotate(conn, cutoff, entry.code_id)
+
+		return entry
+
+	def _rotate(self, conn: sqlite3.Connection, cutoff: float, latest_code_id: str):
+		# Delete the oldest scripts until the rest are recent and fit in the budget,
+		# always keeping the latest one
+		removed = []
+		total_bytes = self._total_bytes
+		for code_id, path, size, created_at in conn.execute(
+			"SELECT code_id, path, size, created_at FROM codes ORDER BY created_at"
+		):
+			if code_id == latest_code_id or (
+				created_at >= cutoff and total_bytes <= self.max_bytes
+			):
+				break
+			removed.append((code_id, path))
+			total_bytes -= size
+
+		conn.executemany(
+			"DELETE FROM codes WHERE code_id = ?",
+			[(code_id,) for code_id, _ in removed],
+		)
+		self._total_bytes = total_bytes
+		self._oldest_at = conn.execute("SELECT MIN(created_at) FROM codes").fetchone()[
+			0
+		]
+
+		day_folders = set()
+		for _, path in removed:
+			(self.folder / path).unlink(missing_ok=True)
+			day_folders.add((self.folder / path).parent)
+
+		for day_folder in day_folders:
+			try:
+				day_folder.rmdir()
+			except OSError:
+				# Scripts of the day are still archived
+				pass
+
+		if removed:
+			logger.info(f"Rotated {len(removed)} script(s) out of the code archive")
+
+	def read(self, code_id: str) -> str | None:
+		"""
+		Read an archived script.
+
+		Args:
+		    code_id (str): Identifier of the script
+
+		Returns:
+		    str | None: The code, or None if it is not (or no longer) archived
+		"""
+		with self._lock:
+			row = self._conn.execute(
+				"SELECT path FROM codes WHERE code_id = ?", (code_id,)
+			).fetchone()
+
+		if row is None or not (self.folder / row[0]).exists():
+			return None
+
+		data = (self.folder / row[0]).read_bytes()
+		if row[0].endswith(".gz"):
+			data = gzip.decompress(data)
+
+		return data.decode("utf-8")
+
+	def find(
+		self,
+		postfix: str | None = None,
+		since: float | None = None,
+		until: float | None = None,
+		sha256: str | None = None,
+		limit: int = 100,
+	) -> List[ArchivedCode]:
+		"""
+		Find archived scripts, most recent first.
+
+		Args:
+		    postfix (str | None, optional): Only scripts of this type of run. Defaults to None.
+		    since (float | None, optional): Only scripts archived at or after this Unix timestamp. Defaults to None.
+		    until (float | None, optional): Only scripts archived before this Unix timestamp. Defaults to None.
+		    sha256 (str | None, optional): Only scripts with this hash. Defaults to None.
+		    limit (int, optional): Maximum number of entries returned. Defaults to 100.
+
+		Returns:
+		    List[ArchivedCode]: The matching entries
+		"""
+		conditions = []
+		params: list = []
+		for condition, value in [
+			("postfix = ?", postfix),
+			("created_at >= ?", since),
+			("created_at < ?", until),
+			("sha256 = ?", sha256),
+		]:
+			if value is not None:
+				conditions.append(condition)
+				params.append(value)
+
+		where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+		with self._lock:
+			rows = self._conn.execute(
+				"SELECT code_id, postfix, created_at, path, size, sha256 FROM codes "
+				f"{where} ORDER BY created_at DESC LIMIT ?",
+				(*params, limit),
+			).fetchall()
+
+		return [ArchivedCode(*row) for row in rows]
@@ -1,8 +1,18 @@
+import codecs
+import hashlib
 import io
+import json
+import queue
+import re
 import tarfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Tuple, cast
+from typing import Callable, Dict, Iterator, List, Set, Tuple, cast
 
 import docker
 import docker.errors
@@ -11,7 +21,350 @@ from docker.models.containers import Container
 from loguru import logger
 from result import Err, Ok, Result
 
-from src.helper import timeout
+from src.code_archive import CodeArchive
+from src.helper import nanoid
+from src.preflight import LIST_MODULES_SCRIPT, PreflightError, check_code
+
+EXECUTOR_IMAGE = "superioragents/agent-executor:latest"
+
+# Postfixes of the runs that only read data, whose output can be reused for
+# identical code; trading code (`trader_trading_code`) must always run
+CACHEABLE_POSTFIXES = {"trader_research_code", "trader_address_research"}
+
+# Seconds to wait before listing the executor modules again after a failed listing
+MODULES_RETRY_SECONDS = 300.0
+
+
+def create_executor_container(
+	client: DockerClient, name: str, image: str = EXECUTOR_IMAGE
+) -> Container:
+	"""
+	Create and start an executor container.
+
+	Args:
+	    client (DockerClient): Docker client instance for container operations
+	    name (str): Name and hostname of the container
+	    image (str, optional): Image of the container. Defaults to the agent executor image.
+
+	Raises:
+	    docker.errors.APIError: If the container cannot be created or started
+
+	Returns:
+	    Container: The started container
+	"""
+	container = client.containers.create(
+		image=image,
+		name=name,
+		hostname=name,
+		environment={"PYTHONUNBUFFERED": "1"},
+		network_mode="host",
+		detach=True,
+		restart_policy={"Name": "unless-stopped"},  # type: ignore
+	)
+	container.start()
+
+	return container
+
+
+class ContainerPool:
+	"""
+	Pool of pre-started executor containers that are leased out one run at a time.
+
+	Every container is used by at most one code execution at a time, so runs in
+	different containers can go on concurrently without interfering with each
+	other. Containers are health-checked when checked out and are replaced by a
+	fresh one after `max_runs` executions or after a run that did not finish
+	cleanly, i.e. one that timed out or failed with a container error.
+
+	The containers are named `{name_prefix}-{i}` and are removed and re-created
+	when the pool starts, so two processes must not share a `name_prefix`.
+	"""
+
+	def __init__(
+		self,
+		client: DockerClient,
+		size: int,
+		max_runs: int = 50,
+		name_prefix: str = "agent-executor-pool",
+		image: str = EXECUTOR_IMAGE,
+	):
+		"""
+		Initialize the pool and start its containers.
+
+		Args:
+		    client (DockerClient): Docker client instance for container operations
+		    size (int): Number of containers to keep warm
+		    max_runs (int, optional): Number of runs after which a container is recycled. Defaults to 50.
+		    name_prefix (str, optional): Prefix of the container names. Defaults to "agent-executor-pool".
+		    image (str, optional): Image of the containers. Defaults to the agent executor image.
+
+		Raises:
+		    ValueError: If `size` is not positive
+		"""
+		if size < 1:
+			raise ValueError("ContainerPool needs at least one container")
+
+		self.client = client
+		self.size = size
+		self.max_runs = max_runs
+		self.image = image
+
+		self._lock = threading.Lock()
+		self._runs: Dict[str, int] = {}
+		# Idle slots, as `(name, container)`; the container is None when it
+		# still has to be (re)started, e.g. after a failed recycle
+		self._idle: queue.Queue[Tuple[str, Container | None]] = queue.Queue()
+
+		for i in range(size):
+			name = f"{name_prefix}-{i}"
+			self._idle.put((name, self._start(name)))
+
+		logger.info(f"Started a pool of {size} executor containers")
+
+	def _start(self, name: str) -> Container:
+		self._remove(name)
+		container = create_executor_container(self.client, name, self.image)
+
+		with self._lock:
+			self._runs[name] = 0
+
+		return container
+
+	def _remove(self, name: str):
+		try:
+			self.client.containers.get(name).remove(force=True)
+		except docker.errors.NotFound:
+			pass
+
+	@staticmethod
+	def _is_healthy(container: Container) -> bool:
+		try:
+			container.reload()
+			if container.status != "running":
+				return False
+
+			return container.exec_run(cmd=["true"]).exit_code == 0
+		except docker.errors.DockerException:
+			return False
+
+	def checkout(self, timeout: float | None = None) -> Container:
+		"""
+		Take an idle, healthy container out of the pool, waiting for one if all are busy.
+
+		Args:
+		    timeout (float | None, optional): Maximum seconds to wait for an idle container. Defaults to waiting forever.
+
+		Raises:
+		    TimeoutError: If no container became idle in time
+		    docker.errors.APIError: If an unhealthy container could not be replaced
+
+		Returns:
+		    Container: The container, to be given back with `release`
+		"""
+		try:
+			name, container = self._idle.get(timeout=timeout)
+		except queue.Empty:
+			raise TimeoutError(
+				f"No executor container became idle in {timeout} seconds"
+			)
+
+		if container is not None and self._is_healthy(container):
+			return container
+
+		logger.warning(f"Executor container {name} is unhealthy, replacing it")
+		try:
+			return self._start(name)
+		except Exception:
+			self._idle.put((name, None))
+			raise
+
+	def release(self, container: Container, recycle: bool = False):
+		"""
+		Give a container back to the pool.
+
+		Args:
+		    container (Container): A container obtained with `checkout`
+		    recycle (bool, optional): Whether the container must be replaced because its last run failed to finish cleanly. Defaults to False.
+		"""
+		name = cast(str, container.name)
+
+		with self._lock:
+			self._runs[name] = self._runs.get(name, 0) + 1
+			recycle = recycle or self._runs[name] >= self.max_runs
+
+		if not recycle:
+			self._idle.put((name, container))
+			return
+
+		logger.info(f"Recycling executor container {name}")
+		try:
+			self._idle.put((name, self._start(name)))
+		except Exception as e:
+			logger.error(f"Failed to recycle executor container {name}, error: \n{e}")
+			self._idle.put((name, None))
+
+	@contextmanager
+	def lease(self, timeout: float | None = None) -> Iterator[Container]:
+		"""
+		Context manager around `checkout` and `release`, recycling the container if the block raises.
+
+		Args:
+		    timeout (float | None, optional): Maximum seconds to wait for an idle container. Defaults to waiting forever.
+		"""
+		container = self.checkout(timeout)
+		recycle = True
+		try:
+			yield container
+			recycle = False
+		finally:
+			self.release(container, recycle=recycle)
+
+	def close(self):
+		"""
+		Remove the idle containers of the pool.
+		"""
+		names: List[str] = []
+		while True:
+			try:
+				names.append(self._idle.get_nowait()[0])
+			except queue.Empty:
+				break
+
+		for name in names:
+			try:
+				self._remove(name)
+			except docker.errors.APIError as e:
+				logger.error(
+					f"Failed to remove executor container {name}, error: \n{e}"
+				)
+
+
+@dataclass
+class ExecutionStats:
+	"""
+	Elapsed time and resource usage of one code run in a container.
+
+	Attributes:
+	    elapsed_seconds (float): Wall-clock duration of the run, including copying the code
+	    user_cpu_seconds (float): CPU time spent in user mode by the code and its child processes
+	    system_cpu_seconds (float): CPU time spent in kernel mode by the code and its child processes
+	    output_bytes (int): Total bytes of output, including what was truncated
+	    exit_code (int | None): Exit code of the run, None if it could not be read
+	    timed_out (bool): Whether the run was killed for exceeding the timeout
+	    cached (bool): Whether the output was reused from an identical earlier run instead of running the code
+	    code_id (str | None): Identifier of the script in the code archive, None if it did not run
+	"""
+
+	elapsed_seconds: float = 0.0
+	user_cpu_seconds: float = 0.0
+	system_cpu_seconds: float = 0.0
+	output_bytes: int = 0
+	exit_code: int | None = None
+	timed_out: bool = False
+	cached: bool = False
+	code_id: str | None = None
+
+
+class ExecutionResultCache:
+	"""
+	In-memory cache of the output of successful runs, keyed by a hash of the code, its environment and its postfix.
+
+	Entries expire `ttl_seconds` after the run and the least recently used ones
+	are evicted past `max_entries`. Only runs whose postfix is in
+	`CACHEABLE_POSTFIXES` are ever cached.
+	"""
+
+	def __init__(self, ttl_seconds: float, max_entries: int = 256):
+		"""
+		Initialize an empty cache.
+
+		Args:
+		    ttl_seconds (float): Number of seconds an output can be reused for
+		    max_entries (int, optional): Maximum number of outputs kept. Defaults to 256.
+		"""
+		self.ttl_seconds = ttl_seconds
+		self.max_entries = max_entries
+
+		self._lock = threading.Lock()
+		self._entries: OrderedDict[str, Tuple[float, str]] = OrderedDict()
+
+	@staticmethod
+	def key(code: str, env: Dict[str, str], postfix: str) -> str:
+		payload = json.dumps([code, sorted(env.items()), postfix])
+		return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+	def get(self, key: str) -> str | None:
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is None:
+				return None
+
+			stored_at, output = entry
+			if time.monotonic() - stored_at > self.ttl_seconds:
+				del self._entries[key]
+				return None
+
+			self._entries.move_to_end(key)
+			return output
+
+	def put(self, key: str, output: str):
+		with self._lock:
+			self._entries[key] = (time.monotonic(), output)
+			self._entries.move_to_end(key)
+
+			while len(self._entries) > self.max_entries:
+				self._entries.popitem(last=False)
+
+
+class OutputBuffer:
+	"""
+	Bounded buffer of the output of a run, keeping its beginning and its end.
+
+	The first `head_bytes` bytes are kept as they arrive and the last `tail_bytes`
+	bytes are kept in a ring, so a chatty script cannot grow the memory of the
+	agent; what falls in between is replaced by a truncation marker.
+	"""
+
+	def __init__(self, head_bytes: int, tail_bytes: int):
+		"""
+		Initialize an empty buffer.
+
+		Args:
+		    head_bytes (int): Number of bytes kept from the beginning of the output
+		    tail_bytes (int): Number of bytes kept from the end of the output
+		"""
+		self.head_bytes = head_bytes
+		self.tail_bytes = tail_bytes
+		self.total_bytes = 0
+
+		self._head = bytearray()
+		self._tail = bytearray()
+
+	def write(self, data: bytes):
+		self.total_bytes += len(data)
+
+		room = self.head_bytes - len(self._head)
+		if room > 0:
+			self._head += data[:room]
+			data = data[room:]
+
+		self._tail += data
+		# Trim only once the ring has doubled, so trimming stays amortized O(1) per byte
+		if len(self._tail) > 2 * self.tail_bytes:
+			del self._tail[: len(self._tail) - self.tail_bytes]
+
+	def getvalue(self) -> str:
+		tail = self._tail[-self.tail_bytes :] if self.tail_bytes else bytearray()
+		truncated_bytes = self.total_bytes - len(self._head) - len(tail)
+
+		if truncated_bytes == 0:
+			return (self._head + tail).decode("utf-8", errors="replace")
+
+		return (
+			self._head.decode("utf-8", errors="replace")
+			+ f"\n... [{truncated_bytes} bytes of output truncated] ...\n"
+			+ tail.decode("utf-8", errors="replace")
+		)
 
 
 class ContainerManager:
@@ -21,6 +374,9 @@ class ContainerManager:
 	This class provides functionality to create, access, and interact with Docker containers.
 	It handles container creation if the specified container doesn't exist, and provides
 	methods to write and execute code within the container.
+
+	When given a `ContainerPool`, every run leases its own container from the pool
+	instead of using the single container, so concurrent runs do not interfere.
 	"""
 
 	def __init__(
@@ -29,6 +385,15 @@ class ContainerManager:
 		container_identifier: str,
 		host_cache_folder: Path | str,
 		in_con_env: Dict[str, str],
+		pool: ContainerPool | None = None,
+		debug: bool = False,
+		stream_fn: Callable[[str], None] | None = None,
+		fatal_patterns: List[str] | None = None,
+		max_output_bytes: int = 256 * 1024,
+		timeout_seconds: int = 600,
+		preflight: bool = True,
+		result_cache: ExecutionResultCache | None = None,
+		code_archive: CodeArchive | None = None,
 	):
 		"""
 		Initialize the ContainerManager with Docker client and container settings.
@@ -38,12 +403,41 @@ class ContainerManager:
 		    container_identifier (str): Name or ID of the container to use
 		    host_cache_folder (Path | str): Path to the folder on the host machine for caching files
 		    in_con_env (Dict[str, str]): Environment variables to set in the container
+		    pool (ContainerPool | None, optional): Pool to lease a container from for every run. Defaults to None, which runs everything in the single container.
+		    debug (bool, optional): Whether to verify every script in the container before running it and leave it there afterwards. Defaults to False.
+		    stream_fn (Callable[[str], None] | None, optional): Function receiving the output of the code as it arrives. Defaults to None, which logs it line by line.
+		    fatal_patterns (List[str] | None, optional): Regexes that stop a run as soon as its output matches one of them. Defaults to None.
+		    max_output_bytes (int, optional): Maximum bytes of output kept per run, half from its beginning and half from its end. Defaults to 256 KiB.
+		    timeout_seconds (int, optional): Maximum duration of a run, after which its process group is killed. Defaults to 600.
+		    preflight (bool, optional): Whether to statically check the code before running it, see `check_code`. Defaults to True.
+		    result_cache (ExecutionResultCache | None, optional): Cache to reuse the output of identical research code from. Defaults to None, which always runs the code.
+		    code_archive (CodeArchive | None, optional): Archive keeping a host copy of every script that is run. Defaults to an archive in `{host_cache_folder}/archive`.
 
 		Raises:
 		    ValueError: If the container cannot be found or created, or if the retrieved object is not a Container
 		"""
 		self.client = client
 		self.host_cache_folder = Path(host_cache_folder)
+		self.in_con_env = in_con_env
+		self.pool = pool
+		self.debug = debug
+		self.stream_fn = stream_fn
+		self.fatal_patterns = [re.compile(pattern) for pattern in fatal_patterns or []]
+		self.max_output_bytes = max_output_bytes
+		self.timeout_seconds = timeout_seconds
+		self.preflight = preflight
+		self.result_cache = result_cache
+		self.code_archive = (
+			code_archive
+			if code_archive is not None
+			else CodeArchive(self.host_cache_folder / "archive")
+		)
+		self._installed_modules: Set[str] | None = None
+		self._modules_retry_at = 0.0
+		self.container: Container | None = None
+
+		if pool is not None:
+			return
 
 		try:
 			_container = client.containers.get(container_identifier)
@@ -58,16 +452,7 @@ class ContainerManager:
 					f"Container not found: {container_identifier}, attempting to create it"
 				)
 				try:
-					_container = client.containers.create(
-						image="superioragents/agent-executor:latest",
-						name=container_identifier,
-						hostname=container_identifier,
-						environment={"PYTHONUNBUFFERED": "1"},
-						network_mode="host",
-						detach=True,
-						restart_policy={"Name": "unless-stopped"},  # type: ignore
-					)
-					_container.start()
+					_container = create_executor_container(client, container_identifier)
 					logger.info(
 						f"Successfully created and started container: {container_identifier}"
 					)
@@ -83,61 +468,11 @@ class ContainerManager:
 			raise ValueError("Retrieved object is not a Container")
 
 		self.container = _container
-		self.in_con_env = in_con_env
-
-	def write_code_in_con(
-		self, code: str, postfix: str, in_container_path: str = "/"
-	) -> Tuple[str, str]:
-		"""Write code into a temporary file in the host machine first then to the container.
-
-		Algorithm:
-		- Write code into a temporary file in the host machine
-		- Create a tar archive containing the file
-		- Copy the tar archive to the container's root directory
-		- Check if the file exists in the container
-
-		Args:
-		    code (str): The code to write into the container
-		    postfix (str): The type identifier for the agent, used in the file path
-		    in_container_path (str, optional): The base path in the container to write the code to. Defaults to "/".
-
-		Raises:
-		    Exception: If the file cannot be written to the container or if verification fails
-
-		Returns:
-		    Tuple[str, str]:
-		        - The path to the temporary file in the container
-		        - The reflected code (content of the file as read from the container)
-		"""
-		# Create temp file name with timestamp
-		current_time = datetime.now().strftime("%Y%m%d_%H%M%S")
-		temp_file_name = f"temp_script_{current_time}.py"
-		temp_file_path = f"{in_container_path}/{temp_file_name}"
-
-		# Create host file path and ensure directory exists
-		# logger.info(f"Writing file {temp_file_name} into host machine")
-		host_path = self.host_cache_folder / f"temp_codes_{postfix}/{temp_file_name}"
-		host_path.parent.mkdir(parents=True, exist_ok=True)
-		host_path.write_text(code)
-
-		# Create a tar archive in memory
-		tar_stream = io.BytesIO()
-		with tarfile.open(fileobj=tar_stream, mode="w") as tar:
-			tar.add(host_path, arcname=temp_file_name)
-		tar_stream.seek(0)
-
-		# Copy the file to the container's root directory
-		# logger.info(f"Writing file {temp_file_name} into container")
-		succeed = self.container.put_archive(
-			path=in_container_path, data=tar_stream.read()
-		)
-
-		if not succeed:
-			raise Exception("Failed to write code into the container")
 
+	def _reflect_code_in_con(self, container: Container, temp_file_path: str) -> str:
 		# Check if file exists in container
 		check_exist_command = f"test -f {temp_file_path} && echo 'File exists' || echo 'File does not exist'"
-		check_exist_result = self.container.exec_run(
+		check_exist_result = container.exec_run(
 			cmd=["/bin/sh", "-c", check_exist_command]
 		)
 
@@ -150,22 +485,122 @@ class ContainerManager:
 			)
 
 		# Read the file content
-		reflected_code = self.container.exec_run(
-			cmd=["cat", temp_file_path]
-		).output.decode("utf-8")
+		reflected_code = container.exec_run(cmd=["cat", temp_file_path]).output.decode(
+			"utf-8"
+		)
 		assert isinstance(reflected_code, str)
 
-		return temp_file_path, reflected_code
+		return reflected_code
+
+	def installed_modules(self) -> Set[str] | None:
+		"""
+		Get the top-level modules importable in the executor, listing them once with a single exec.
+
+		A failed listing is not retried before `MODULES_RETRY_SECONDS`, so that an
+		unreachable executor does not cost an exec on every check.
+
+		Returns:
+		    Set[str] | None: The module names, or None if they could not be listed
+		"""
+		if self._installed_modules is not None:
+			return self._installed_modules
+		if time.monotonic() < self._modules_retry_at:
+			return None
+
+		try:
+			if self.pool is None:
+				assert self.container is not None
+				exit_code, output = self.container.exec_run(
+					cmd=["python", "-c", LIST_MODULES_SCRIPT]
+				)
+			else:
+				with self.pool.lease() as container:
+					exit_code, output = container.exec_run(
+						cmd=["python", "-c", LIST_MODULES_SCRIPT]
+					)
+
+			if exit_code != 0:
+				raise ValueError(output.decode("utf-8", errors="replace"))
+
+			self._installed_modules = set(json.loads(output))
+		except Exception as e:
+			self._modules_retry_at = time.monotonic() + MODULES_RETRY_SECONDS
+			logger.warning(
+				f"Could not list the modules installed in the executor, skipping the import check for {MODULES_RETRY_SECONDS:.0f} seconds, error: \n{e}"
+			)
+
+		return self._installed_modules
+
+	def check_code(self, code: str) -> List[PreflightError]:
+		"""
+		Statically check code before running it, without running anything in the container.
+
+		The code is parsed, its imports are resolved against the modules installed
+		in the executor (listed once and then cached) and its calls are scanned for
+		functions that would hang or break the executor.
+
+		Args:
+		    code (str): The Python code to check
+
+		Returns:
+		    List[PreflightError]: The problems found, empty if the code looks runnable
+		"""
+		return check_code(code, installed_modules=self.installed_modules())
+
+	def put_code_in_con(
+		self,
+		code: str,
+		container: Container,
+		in_container_path: str = "/tmp",
+		file_name: str | None = None,
+	) -> str:
+		"""Write code into the container with a single API call.
+
+		The tar archive is built in memory, so nothing is written on the host,
+		and the file is not read back from the container.
+
+		Args:
+		    code (str): The code to write into the container
+		    container (Container): The container to write to
+		    in_container_path (str, optional): The folder in the container to write the code to. Defaults to "/tmp".
+		    file_name (str | None, optional): Name of the file in the container. Defaults to a unique timestamped name.
+
+		Raises:
+		    Exception: If the file cannot be written to the container
+
+		Returns:
+		    str: The path to the file in the container
+		"""
+		if file_name is None:
+			current_time = datetime.now().strftime("%Y%m%d_%H%M%S")
+			file_name = f"temp_script_{current_time}_{nanoid(8)}.py"
+		data = code.encode("utf-8")
+
+		tar_stream = io.BytesIO()
+		with tarfile.open(fileobj=tar_stream, mode="w") as tar:
+			tar_info = tarfile.TarInfo(name=file_name)
+			tar_info.size = len(data)
+			tar_info.mtime = int(time.time())
+			tar.addfile(tar_info, io.BytesIO(data))
+
+		if not container.put_archive(
+			path=in_container_path, data=tar_stream.getvalue()
+		):
+			raise Exception("Failed to write code into the container")
+
+		return f"{in_container_path}/{file_name}"
 
 	def run_code_in_con(self, code: str, postfix: str) -> Result[Tuple[str, str], str]:
 		"""Run code in container and return the exit code, execution output, and reflected code.
 
 		Algorithm:
-		- Write code into a temporary file in the host machine
-		- Create a tar archive containing the file
-		- Copy the tar archive to the container's root directory
-		- Check if the file exists in the container
-		- Run the code in the container
+		- Check the code with `check_code`, failing right away without touching the container if it has problems
+		- With a result cache, return the output of an identical recent research run instead of running the code
+		- Add the code to the code archive of the host machine
+		- Copy the code into the container as an in-memory tar archive
+		  (in debug mode, the file is also verified, read back and left in the container)
+		- Run the code in the container in its own process group, then kill what is left of that group
+		- Stream the output as it arrives to `stream_fn` or the logger, stopping the run early if it matches a fatal pattern
 		- Return the exit code, execution output, and reflected code
 
 		Args:
@@ -178,46 +613,253 @@ class ContainerManager:
 		        - Err: An error message describing what went wrong
 
 		Note:
-		    - The execution has a timeout of 150 seconds
-		    - After execution, any remaining Python processes are killed
+		    - The execution has a timeout of `timeout_seconds`, enforced from a watchdog thread
+		    - After execution, any remaining process started by the code is killed
+		    - The output is truncated in the middle past `max_output_bytes`
+		    - With a pool, the run first waits for an idle container
 		"""
-		temp_file_path, reflected_code = self.write_code_in_con(code, postfix)
+		result, stats = self.run_code_in_con_with_stats(code, postfix)
+		if stats.cached:
+			logger.info(
+				f"Reused the output of an identical earlier run of {postfix} code"
+			)
+			return result
+		if stats.exit_code is None:
+			# The code never ran, e.g. it failed the pre-flight check
+			return result
+
+		logger.info(
+			f"Ran {postfix} code {stats.code_id} in {stats.elapsed_seconds:.2f}s "
+			f"(cpu {stats.user_cpu_seconds:.2f}s user, {stats.system_cpu_seconds:.2f}s system, "
+			f"{stats.output_bytes} bytes of output, exit code {stats.exit_code}"
+			f"{', timed out' if stats.timed_out else ''})"
+		)
+
+		return result
+
+	def run_code_in_con_with_stats(
+		self, code: str, postfix: str
+	) -> Tuple[Result[Tuple[str, str], str], ExecutionStats]:
+		"""Run code in container like `run_code_in_con`, also returning the statistics of the run.
 
-		# Fix command to use shell redirection properly
-		command_str = f"python -u {temp_file_path} 2>&1"  # Use shell syntax
+		Args:
+		    code (str): The Python code to run in the container
+		    postfix (str): The type identifier for the agent, used in the file path
+
+		Returns:
+		    Tuple[Result[Tuple[str, str], str], ExecutionStats]:
+		        - The result, as returned by `run_code_in_con`
+		        - The elapsed time and resource usage of the run
+		"""
+		if self.preflight:
+			errors = self.check_code(code)
+			if errors:
+				errors_str = "\n".join(str(error) for error in errors)
+				return Err(
+					f"ContainerManager.run_code_in_con: Code failed the pre-flight check, errors: \n{errors_str}"
+				), ExecutionStats()
+
+		cache_key = None
+		if self.result_cache is not None and postfix in CACHEABLE_POSTFIXES:
+			cache_key = ExecutionResultCache.key(code, self.in_con_env, postfix)
+			cached_output = self.result_cache.get(cache_key)
+			if cached_output is not None:
+				return Ok((cached_output, code)), ExecutionStats(
+					exit_code=0, cached=True
+				)
+
+		if self.pool is None:
+			assert self.container is not None
+			result, stats, _ = self._run_code(self.container, code, postfix)
+		else:
+			try:
+				container = self.pool.checkout()
+			except (TimeoutError, docker.errors.APIError) as e:
+				return Err(
+					f"ContainerManager.run_code_in_con: No executor container available, error: \n{e}"
+				), ExecutionStats()
+			recycle = True
+			try:
+				result, stats, clean = self._run_code(container, code, postfix)
+				recycle = not clean
+			finally:
+				self.pool.release(container, recycle=recycle)
+
+		if cache_key is not None and isinstance(result, Ok):
+			assert self.result_cache is not None
+			self.result_cache.put(cache_key, result.unwrap()[0])
+
+		return result, stats
+
+	def _kill_run(self, container: Container, pid_file_path: str):
+		# Kills the process group of one run only, whatever thread it is called from
+		container.exec_run(
+			cmd=["/bin/sh", "-c", f"kill -9 -$(cat {pid_file_path}) 2>/dev/null"]
+		)
+
+	def _run_code(
+		self, container: Container, code: str, postfix: str
+	) -> Tuple[Result[Tuple[str, str], str], ExecutionStats, bool]:
+		"""Run code in the given container.
+
+		Returns:
+		    Tuple[Result[Tuple[str, str], str], ExecutionStats, bool]:
+		        - The result, as returned by `run_code_in_con`
+		        - The elapsed time and resource usage of the run
+		        - Whether the run finished cleanly, False if the container may be left in an unknown state
+		"""
+		started_at = time.monotonic()
+		stats = ExecutionStats()
+
+		archived = self.code_archive.add(code, postfix)
+		stats.code_id = archived.code_id
+
+		temp_file_path = self.put_code_in_con(
+			code, container, file_name=f"temp_script_{archived.code_id}.py"
+		)
+		if self.debug:
+			reflected_code = self._reflect_code_in_con(container, temp_file_path)
+			cleanup_str = ""
+		else:
+			reflected_code = code
+			cleanup_str = f"rm -f {temp_file_path}; "
+
+		# `setsid` makes the script the leader of a new process group, so that
+		# whatever it leaves behind can be killed without touching other runs.
+		# Its pid is written next to the script to be able to stop it early, and
+		# the CPU time of the run is reported on stderr by the `times` builtin.
+		pid_file_path = f"{temp_file_path}.pid"
+		command_str = (
+			f"setsid python -u {temp_file_path} 2>&1 & pid=$!; echo $pid > {pid_file_path}; "
+			f"wait $pid; status=$?; times >&2; kill -9 -$pid 2>/dev/null; "
+			f"rm -f {pid_file_path}; {cleanup_str}exit $status"
+		)
 		cmd = ["/bin/sh", "-c", command_str]  # Execute via shell
 
+		output = OutputBuffer(
+			head_bytes=self.max_output_bytes // 2,
+			tail_bytes=self.max_output_bytes - self.max_output_bytes // 2,
+		)
+		shell_stderr = b""
+		fatal_match: str | None = None
+
+		# The watchdog kills the process group of this run only, which ends the
+		# output stream; unlike SIGALRM it works from any thread.
+		def on_timeout():
+			stats.timed_out = True
+			logger.warning(
+				f"Stopping the run of {temp_file_path} after {self.timeout_seconds} seconds"
+			)
+			self._kill_run(container, pid_file_path)
+
+		watchdog = threading.Timer(self.timeout_seconds, on_timeout)
+		watchdog.daemon = True
+
 		try:
-			with timeout(seconds=600):
-				python_exit_code, python_output = cast(
-					Tuple[int, bytes],
-					self.container.exec_run(
-						cmd=cmd,
-						environment=self.in_con_env,
-						demux=False,  # Combine stdout and stderr
-						stream=False,  # Wait for the command to finish and return all output at once
-					),
-				)
-				python_output_str = python_output.decode("utf-8", errors="replace")
-		except TimeoutError as e:
-			return Err(
-				f"ContainerManager.run_code_in_con: Code ran too long, error: \n{e}"
+			api = container.client.api
+			exec_id = api.exec_create(container.id, cmd, environment=self.in_con_env)[
+				"Id"
+			]
+
+			watchdog.start()
+
+			decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+			window = ""
+			pending_line = ""
+			for chunk, stderr_chunk in api.exec_start(exec_id, stream=True, demux=True):
+				if stderr_chunk:
+					shell_stderr += stderr_chunk
+				if not chunk:
+					continue
+
+				output.write(chunk)
+				text = decoder.decode(chunk)
+
+				if self.stream_fn is not None:
+					self.stream_fn(text)
+				else:
+					*lines, pending_line = (pending_line + text).split("\n")
+					for line in lines:
+						logger.debug(f"[{postfix}] {line}")
+
+				if fatal_match is None and self.fatal_patterns:
+					# Keep the end of the previous chunks so that a match split across chunks is found
+					window = window[-1024:] + text
+					for pattern in self.fatal_patterns:
+						match = pattern.search(window)
+						if match is not None:
+							fatal_match = match.group(0)
+							logger.warning(
+								f"Stopping the run of {temp_file_path} on fatal output: {fatal_match}"
+							)
+							# Keep reading until the stream ends, which it does once the group is killed
+							self._kill_run(container, pid_file_path)
+							break
+
+			if self.stream_fn is None and pending_line:
+				logger.debug(f"[{postfix}] {pending_line}")
+
+			python_exit_code = api.exec_inspect(exec_id)["ExitCode"]
+			python_output_str = output.getvalue()
+		except (docker.errors.ContainerError, docker.errors.APIError) as e:
+			stats.elapsed_seconds = time.monotonic() - started_at
+			return (
+				Err(f"ContainerManager.run_code_in_con: Container error, error: \n{e}"),
+				stats,
+				False,
 			)
-		except docker.errors.ContainerError as e:
-			return Err(
-				f"ContainerManager.run_code_in_con: Container error, error: \n{e}"
+		finally:
+			watchdog.cancel()
+
+		stats.elapsed_seconds = time.monotonic() - started_at
+		stats.exit_code = python_exit_code
+		stats.output_bytes = output.total_bytes
+
+		# `times` prints the CPU time of the shell, then of its children, as `<user> <system>` lines
+		cpu_times = re.findall(
+			r"(\d+)m([\d.]+)s", shell_stderr.decode("utf-8", errors="replace")
+		)
+		if len(cpu_times) >= 4:
+			stats.user_cpu_seconds = int(cpu_times[2][0]) * 60 + float(cpu_times[2][1])
+			stats.system_cpu_seconds = int(cpu_times[3][0]) * 60 + float(
+				cpu_times[3][1]
 			)
 
-		self.container.exec_run(cmd="kill -9 $(pidof python)")
+		if stats.timed_out:
+			# Whatever the run was doing when it was killed, e.g. writing files, is left half done
+			return (
+				Err(
+					f"ContainerManager.run_code_in_con: Code ran too long, error: \nExecution timed out after {self.timeout_seconds} seconds, program output: \n{python_output_str}"
+				),
+				stats,
+				False,
+			)
 
-		if python_exit_code != 0:
-			return Err(
-				f"ContainerManager.run_code_in_con: Code that has been run failed, program output: \n{python_output_str}"
+		if fatal_match is not None:
+			return (
+				Err(
+					f"ContainerManager.run_code_in_con: Code was stopped on fatal output `{fatal_match}`, program output: \n{python_output_str}"
+				),
+				stats,
+				True,
 			)
 
-		return Ok(
-			(
-				python_output_str,
-				reflected_code,
+		if python_exit_code != 0:
+			return (
+				Err(
+					f"ContainerManager.run_code_in_con: Code that has been run failed, program output: \n{python_output_str}"
+				),
+				stats,
+				True,
 			)
+
+		return (
+			Ok(
+				(
+					python_output_str,
+					reflected_code,
+				)
+			),
+			stats,
+			True,
 		)
@@ -193,7 +193,7 @@ class SQLiteDB(DBInterface):
 		with sqlite3.connect(self.db_path) as conn:
 			cursor = conn.cursor()
 			cursor.execute(
-				"""SELECT agent_id, started_at, status, cycle_count, fe_data, will_end_at 
+				"""SELECT agent_id, started_at, status, cycle_count, fe_data, will_end_at, session_interval
                    FROM sup_agent_sessions 
                    WHERE session_id = ?""",
 				(session_id,),
@@ -208,6 +208,7 @@ class SQLiteDB(DBInterface):
 					"cycle_count": row[3],
 					"fe_data": row[4],
 					"will_end_at": row[5],
+					"session_interval": row[6],
 				}
 			return None
 
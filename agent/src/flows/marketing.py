@@ -1,9 +1,14 @@
-from typing import Callable, List
+import dataclasses
+from functools import partial
+from typing import Awaitable, Callable, List, Tuple
 
 from loguru import logger
-from result import UnwrapError
+from result import Err, Ok, Result, UnwrapError
 from src.agent.marketing import MarketingAgent
 from src.datatypes import StrategyData, StrategyInsertData
+from src.flows.speculative import run_candidates
+from src.genner.Base import Genner, run_concurrently
+from src.types import ChatHistory
 
 
 def unassisted_flow(
@@ -16,6 +21,8 @@ def unassisted_flow(
 	prev_strat: StrategyData | None,
 	notif_str: str | None,
 	summarizer: Callable[[List[str]], str],
+	candidates: int = 1,
+	async_summarizer: Callable[[List[str]], Awaitable[str]] | None = None,
 ):
 	"""
 	Execute an unassisted marketing workflow with the marketing agent.
@@ -34,10 +41,13 @@ def unassisted_flow(
 	    prev_strat (StrategyData | None): Previous strategy, if any
 	    notif_str (str | None): Notification string to process
 	    summarizer (Callable[[List[str]], str]): Function to summarize text
+	    candidates (int, optional): Number of research codes generated and run in parallel per attempt, the first to succeed being kept. Defaults to 1.
+	    async_summarizer (Callable[[List[str]], Awaitable[str]] | None, optional): Asynchronous counterpart of `summarizer`, used to generate the summaries of the cycle concurrently. Defaults to None, which generates them one after the other with `summarizer`.
 
 	Returns:
 	    None: This function doesn't return a value but logs its progress
 	"""
+	usage_before = dataclasses.replace(agent.genner.usage)
 	agent.reset()
 	logger.info("Reset agent")
 	logger.info("Starting on assisted trading flow")
@@ -75,6 +85,29 @@ def unassisted_flow(
 	)
 	logger.info("Initialized system prompt")
 
+	def generate_research_code(
+		genner: Genner,
+	) -> Tuple[Result[str, str], ChatHistory]:
+		candidate_agent = agent.with_genner(genner)
+		if regen:
+			gen_result = candidate_agent.gen_better_code(research_code, err_acc)
+		elif not prev_strat:
+			gen_result = candidate_agent.gen_research_code_on_first(apis)
+		else:
+			gen_result = candidate_agent.gen_research_code(
+				notifications_str=notif_str if notif_str else "Fresh",
+				prev_strategy=prev_strat.summarized_desc if prev_strat else "",
+				rag_summary=rag_summary,
+				before_metric_state=rag_before_metric_state,
+				after_metric_state=rag_after_metric_state,
+			)
+
+		if err := gen_result.err():
+			return Err(err), ChatHistory()
+
+		code, ch = gen_result.unwrap()
+		return Ok(code), ch
+
 	logger.info("Attempt to generate research code...")
 	research_code = ""
 	research_code_output = ""
@@ -82,47 +115,49 @@ def unassisted_flow(
 	err_acc = ""
 	regen = False
 	for i in range(3):
-		try:
-			if regen:
-				research_code, new_ch = agent.gen_better_code(
-					research_code, err_acc
-				).unwrap()
-			else:
-				if not prev_strat:
-					research_code, new_ch = agent.gen_research_code_on_first(
-						apis
-					).unwrap()
-				else:
-					research_code, new_ch = agent.gen_research_code(
-						notifications_str=notif_str if notif_str else "Fresh",
-						prev_strategy=prev_strat.summarized_desc if prev_strat else "",
-						rag_summary=rag_summary,
-						before_metric_state=rag_before_metric_state,
-						after_metric_state=rag_after_metric_state,
-					).unwrap()
+		logger.info("Generating and running the research code in conatiner...")
+		winner, failed = run_candidates(
+			agent.genner,
+			generate_research_code,
+			partial(
+				agent.container_manager.run_code_in_con, postfix="trader_research_code"
+			),
+			candidates=candidates,
+		)
 
-			logger.info(f"Response: {new_ch.get_latest_response()}")
+		for candidate in [*failed, *([winner] if winner is not None else [])]:
+			if not candidate.code:
+				continue
+
+			logger.info(f"Response: {candidate.chat_history.get_latest_response()}")
 
 			# Temporarily avoid new chat to reduce cost
 			# agent.chat_history += new_ch
-			agent.db.insert_chat_history(session_id, new_ch)
+			agent.db.insert_chat_history(session_id, candidate.chat_history)
 
-			logger.info("Running the research code in conatiner...")
-			code_execution_result = agent.container_manager.run_code_in_con(
-				research_code, "trader_research_code"
-			)
-			research_code_output, _ = code_execution_result.unwrap()
+		for candidate in failed:
+			if regen:
+				logger.error(
+					f"Regen failed on research code generation..., err: \n{candidate.result.err()}"
+				)
+			else:
+				logger.error(
+					f"Failed on first research code generation..., err: \n{candidate.result.err()}"
+				)
+
+		if winner is not None:
+			research_code = winner.code
+			research_code_output, _ = winner.result.unwrap()
 
 			research_code_success = True
 			break
-		except UnwrapError as e:
-			e = e.result.err()
-			if regen:
-				logger.error(f"Regen failed on research code generation..., err: \n{e}")
-			else:
-				logger.error(f"Failed on first research code generation..., err: \n{e}")
-			regen = True
-			err_acc += f"\n{str(e)}"
+
+		# Fix the code of a candidate that was generated, if any
+		retried = next((c for c in failed if c.code), failed[-1])
+		if retried.code:
+			research_code = retried.code
+		regen = True
+		err_acc += f"\n{str(retried.result.err())}"
 
 	if not research_code_success:
 		logger.info(
@@ -223,29 +258,35 @@ def unassisted_flow(
 		logger.info(f"Output: \n{marketing_code_output}")
 
 	end_metric_state = str(agent.sensor.get_metric_fn(metric_name)())
-	summarized_state_change = summarizer(
+	to_summarize = [
 		[
 			f"This is the start state {start_metric_state}",
 			f"This is the end state {end_metric_state}",
 			"Summarize the state changes of the above",
-		]
-	)
-	logger.info("Summarizing state change...")
-	logger.info(f"Summarized state change: \n{summarized_state_change}")
-	summarized_code = summarizer(
+		],
 		[
 			marketing_code_output,
 			"Summarize the code",
+		],
+		[strategy_output],
+	]
+	logger.info("Summarizing state change, code and strategy...")
+	if async_summarizer is not None:
+		summarized_state_change, summarized_code, summarized_desc = run_concurrently(
+			*[async_summarizer(points) for points in to_summarize]
+		)
+	else:
+		summarized_state_change, summarized_code, summarized_desc = [
+			summarizer(points) for points in to_summarize
 		]
-	)
-	logger.info("Summarizing code...")
+	logger.info(f"Summarized state change: \n{summarized_state_change}")
 	logger.info(f"Summarized code: \n{summarized_code}")
 
 	logger.info("Saving strategy and its result...")
 	agent.db.insert_strategy_and_result(
 		agent_id=agent.agent_id,
 		strategy_result=StrategyInsertData(
-			summarized_desc=summarizer([strategy_output]),
+			summarized_desc=summarized_desc,
 			full_desc=strategy_output,
 			parameters={
 				"apis": apis,
@@ -261,4 +302,5 @@ def unassisted_flow(
 			strategy_result="failed" if not strategy_success else "success",
 		),
 	)
+	logger.info(f"Token usage of the cycle: {agent.genner.usage - usage_before}")
 	logger.info("Saved, quitting and preparing for next run...")
@@ -0,0 +1,134 @@
+import copy
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable, List, Tuple
+
+from loguru import logger
+from result import Err, Ok, Result
+
+from src.genner.Base import Genner
+from src.types import ChatHistory
+
+# Temperatures of the extra candidates, the first candidate always uses the configured genner
+CANDIDATE_TEMPERATURES = [0.7, 1.0, 0.3, 1.2]
+
+
+@dataclass
+class Candidate:
+	"""
+	One generated and executed piece of code.
+
+	Attributes:
+	    index (int): Index of the candidate, 0 being the one from the configured genner
+	    code (str): The generated code, empty if the generation failed
+	    chat_history (ChatHistory): Chat history of the generation
+	    result (Result[Tuple[str, str], str]): Result of running the code, as returned by `ContainerManager.run_code_in_con`, or the generation error
+	"""
+
+	index: int
+	code: str
+	chat_history: ChatHistory
+	result: Result[Tuple[str, str], str]
+
+
+def run_candidates(
+	genner: Genner,
+	generate: Callable[[Genner], Tuple[Result[str, str], ChatHistory]],
+	execute: Callable[[str], Result[Tuple[str, str], str]],
+	candidates: int = 1,
+) -> Tuple[Candidate | None, List[Candidate]]:
+	"""
+	Generate several candidate codes concurrently, run them in parallel and keep the first that succeeds.
+
+	The first candidate is generated with `genner` itself and the others with
+	`genner.variant` at the temperatures of `CANDIDATE_TEMPERATURES`. With a
+	single candidate everything happens on the current thread, exactly like a
+	plain generate-then-run attempt. Once a candidate succeeds, the generations
+	still streaming are stopped through the `cancel` event of their genner and
+	the candidates that have not started running are not run; the ones already
+	running are left to finish in the background, so this must only be used for
+	code without side effects.
+
+	Args:
+	    genner (Genner): The genner of the agent
+	    generate (Callable[[Genner], Tuple[Result[str, str], ChatHistory]]): Generates the code of a candidate with the given genner, e.g. `lambda g: agent.with_genner(g).gen_account_research_code(...)`
+	    execute (Callable[[str], Result[Tuple[str, str], str]]): Runs the code of a candidate, e.g. `ContainerManager.run_code_in_con`
+	    candidates (int, optional): Number of candidates. Defaults to 1.
+
+	Returns:
+	    Tuple[Candidate | None, List[Candidate]]:
+	        - The first candidate that ran successfully, or None if none did
+	        - The candidates that failed before it, in the order they finished
+	"""
+	decided = threading.Event()
+
+	def attempt(index: int, candidate_genner: Genner) -> Candidate:
+		code_result, chat_history = generate(candidate_genner)
+		if err := code_result.err():
+			return Candidate(index, "", chat_history, Err(err))
+
+		code = code_result.unwrap()
+		if decided.is_set():
+			return Candidate(
+				index, code, chat_history, Err("Another candidate already succeeded")
+			)
+
+		return Candidate(index, code, chat_history, execute(code))
+
+	if candidates <= 1:
+		candidate = attempt(0, genner)
+		if isinstance(candidate.result, Ok):
+			return candidate, []
+
+		return None, [candidate]
+
+	# The first candidate keeps streaming to the configured `stream_fn`
+	first_genner = copy.copy(genner)
+	first_genner.cancel = decided
+	genners = [first_genner] + [
+		genner.variant(
+			temperature=CANDIDATE_TEMPERATURES[(i - 1) % len(CANDIDATE_TEMPERATURES)],
+			cancel=decided,
+		)
+		for i in range(1, candidates)
+	]
+
+	executor = ThreadPoolExecutor(
+		max_workers=candidates, thread_name_prefix="flow-candidate"
+	)
+	indexes = {
+		executor.submit(attempt, i, candidate_genner): i
+		for i, candidate_genner in enumerate(genners)
+	}
+	pending = set(indexes)
+	failed: List[Candidate] = []
+	try:
+		while pending:
+			done, pending = wait(pending, return_when=FIRST_COMPLETED)
+			for future in done:
+				error = future.exception()
+				if error is not None:
+					failed.append(
+						Candidate(
+							indexes[future],
+							"",
+							ChatHistory(),
+							Err(f"run_candidates: Candidate crashed, err: \n{error}"),
+						)
+					)
+					continue
+
+				candidate = future.result()
+				if isinstance(candidate.result, Ok):
+					decided.set()
+					logger.info(
+						f"Candidate {candidate.index + 1}/{candidates} succeeded first"
+					)
+					return candidate, failed
+
+				failed.append(candidate)
+	finally:
+		executor.shutdown(wait=False, cancel_futures=True)
+
+	return None, failed
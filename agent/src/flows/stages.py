@@ -0,0 +1,107 @@
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple, TypeVar
+
+from loguru import logger
+
+T = TypeVar("T")
+
+
+class StageRunner:
+	"""
+	Runs the independent stages of a flow concurrently on a small thread pool.
+
+	Every stage is named and timed. Stages whose result is never asked for
+	(e.g. database writes) are waited for when the runner is closed, and their
+	errors are logged there. Use it as a context manager:
+
+	    >>> with StageRunner() as stages:
+	    ...     snapshot = stages.submit("metric", metric_fn)
+	    ...     strategies = stages.run("rag", rag.relevant_strategy_raw_v4, notif_str)
+	    ...     print(snapshot.result())
+	"""
+
+	def __init__(self, max_workers: int = 4):
+		"""
+		Initialize the runner.
+
+		Args:
+		    max_workers (int, optional): Maximum number of stages running at once. Defaults to 4.
+		"""
+		self.executor = ThreadPoolExecutor(
+			max_workers=max_workers, thread_name_prefix="flow-stage"
+		)
+		self.timings: Dict[str, float] = {}
+		self._futures: List[Tuple[str, Future]] = []
+		self._last_mark = time.monotonic()
+
+	def _timed(self, name: str, fn: Callable[..., T], *args, **kwargs) -> T:
+		started_at = time.monotonic()
+		try:
+			return fn(*args, **kwargs)
+		finally:
+			self.timings[name] = time.monotonic() - started_at
+
+	def submit(self, name: str, fn: Callable[..., T], *args, **kwargs) -> "Future[T]":
+		"""
+		Start a stage in the background.
+
+		Args:
+		    name (str): Name of the stage, used for its timing
+		    fn (Callable[..., T]): The stage, called with `args` and `kwargs`
+
+		Returns:
+		    Future[T]: The future result of the stage
+		"""
+		future = self.executor.submit(self._timed, name, fn, *args, **kwargs)
+		self._futures.append((name, future))
+
+		return future
+
+	def run(self, name: str, fn: Callable[..., T], *args, **kwargs) -> T:
+		"""
+		Run a stage on the current thread, timing it like the background ones.
+
+		Args:
+		    name (str): Name of the stage, used for its timing
+		    fn (Callable[..., T]): The stage, called with `args` and `kwargs`
+
+		Returns:
+		    T: The result of the stage
+		"""
+		return self._timed(name, fn, *args, **kwargs)
+
+	def mark(self, name: str):
+		"""
+		Record the time spent on the current thread since the previous mark, or since the runner was created, as a stage.
+
+		This times the sequential parts of a flow without wrapping them in a function.
+
+		Args:
+		    name (str): Name of the stage that just ended
+		"""
+		now = time.monotonic()
+		self.timings[name] = now - self._last_mark
+		self._last_mark = now
+
+	def close(self):
+		"""
+		Wait for every background stage, log the errors of the failed ones and the timing of all of them.
+		"""
+		self.executor.shutdown(wait=True)
+
+		for name, future in self._futures:
+			error = future.exception()
+			if error is not None:
+				logger.error(f"Stage `{name}` failed, err: \n{error}")
+
+		timings_str = ", ".join(
+			f"{name}: {seconds:.2f}s" for name, seconds in self.timings.items()
+		)
+		logger.info(f"Stage timings: {timings_str}")
+
+	def __enter__(self) -> "StageRunner":
+		return self
+
+	def __exit__(self, *exc_info: Any):
+		self.close()
@@ -1,10 +1,12 @@
+import dataclasses
 import json
 from datetime import timedelta
 from textwrap import dedent
-from typing import Callable, List
+from functools import partial
+from typing import Callable, List, Tuple
 
 from loguru import logger
-from result import UnwrapError
+from result import Result, UnwrapError
 from dateutil import parser
 from src.agent.trading import TradingAgent
 from src.datatypes import (
@@ -13,6 +15,9 @@ from src.datatypes import (
 	StrategyInsertData,
 	WalletStats,
 )
+from src.flows.speculative import run_candidates
+from src.flows.stages import StageRunner
+from src.genner.Base import Genner
 from src.helper import nanoid
 from src.types import ChatHistory
 
@@ -30,6 +35,7 @@ def assisted_flow(
 	notif_str: str,
 	txn_service_url: str,
 	summarizer: Callable[[List[str]], str],
+	candidates: int = 1,
 ):
 	"""
 	Execute an assisted trading workflow with the trading agent.
@@ -51,10 +57,54 @@ def assisted_flow(
 	    notif_str (str | None): Notification string to process
 	    txn_service_url (str): URL of the transaction service
 	    summarizer (Callable[[List[str]], str]): Function to summarize text
+	    candidates (int, optional): Number of research and address research codes generated and run in parallel per attempt, the first to succeed being kept. Defaults to 1.
 
 	Returns:
 	    None: This function doesn't return a value but logs its progress
+
+	Note:
+	    Independent stages (the wallet snapshots, the RAG lookup, the database
+	    writes and the final summaries) run concurrently, and the duration of
+	    every stage is logged at the end of the cycle, along with the cached
+	    and uncached prompt tokens of the cycle.
 	"""
+	usage_before = dataclasses.replace(agent.genner.usage)
+	with StageRunner() as stages:
+		_assisted_flow(
+			stages=stages,
+			agent=agent,
+			session_id=session_id,
+			role=role,
+			network=network,
+			time=time,
+			apis=apis,
+			trading_instruments=trading_instruments,
+			metric_name=metric_name,
+			prev_strat=prev_strat,
+			notif_str=notif_str,
+			txn_service_url=txn_service_url,
+			summarizer=summarizer,
+			candidates=candidates,
+		)
+	logger.info(f"Token usage of the cycle: {agent.genner.usage - usage_before}")
+
+
+def _assisted_flow(
+	stages: StageRunner,
+	agent: TradingAgent,
+	session_id: str,
+	role: str,
+	network: str,
+	time: str,
+	apis: List[str],
+	trading_instruments: List[str],
+	metric_name: str,
+	prev_strat: StrategyData | None,
+	notif_str: str,
+	txn_service_url: str,
+	summarizer: Callable[[List[str]], str],
+	candidates: int = 1,
+):
 	agent.reset()
 
 	for_training_chat_history = ChatHistory()
@@ -63,10 +113,17 @@ def assisted_flow(
 	logger.info("Starting on assisted trading flow")
 
 	metric_fn = agent.sensor.get_metric_fn(metric_name)
-	start_metric_state = metric_fn()
+
+	# The RAG lookup does not depend on the wallet, so both are fetched at once
+	related_strategies_future = stages.submit(
+		"rag_lookup", agent.rag.relevant_strategy_raw_v4, notif_str
+	)
+	start_metric_state = stages.run("start_metric_state", metric_fn)
 
 	if metric_name == "wallet":
-		agent.db.insert_wallet_snapshot(
+		stages.submit(
+			"insert_start_wallet_snapshot",
+			agent.db.insert_wallet_snapshot,
 			snapshot_id=f"{nanoid(4)}-{session_id}-{start_metric_state['wallet_address']}",
 			agent_id=agent.agent_id,
 			total_value_usd=start_metric_state["total_value_usd"],
@@ -86,7 +143,7 @@ def assisted_flow(
 			"Getting relevant RAG strategies with `query`: notif_str is empty string."
 		)
 
-	related_strategies = agent.rag.relevant_strategy_raw_v4(notif_str)
+	related_strategies = related_strategies_future.result()
 
 	rag_result = {
 		"summary": "RAG cannot be found",
@@ -207,65 +264,80 @@ def assisted_flow(
 	for_training_chat_history += new_ch
 
 	logger.info("Initialized system prompt")
+	stages.mark("prepare")
+
+	def generate_research_code(
+		genner: Genner,
+	) -> Tuple[Result[str, str], ChatHistory]:
+		candidate_agent = agent.with_genner(genner)
+		if regen:
+			return candidate_agent.gen_better_code(
+				research_code=new_ch.get_latest_response(),
+				errors=err_acc,
+			)
+		if not prev_strat:
+			return candidate_agent.gen_research_code_on_first(
+				apis=apis, network=network
+			)
+		return candidate_agent.gen_research_code(
+			notifications_str=notif_str if notif_str else "Fresh",
+			prev_strategy=prev_strat.summarized_desc if prev_strat else "",
+			apis=apis,
+			rag_summary=rag_summary,
+			before_metric_state=str(rag_start_metric_state) or "",
+			after_metric_state=str(rag_end_metric_state) or "",
+		)
 
 	logger.info("Attempt to generate research code...")
-	research_code = ""
 	err_acc = ""
 	regen = False
 	success = False
 	for i in range(3):
-		try:
-			if regen:
-				logger.info("Attempt to regenerate research code...")
-
-				if new_ch.get_latest_instruction() == "":
-					logger.warning("No instruction found on chat history")
-				if new_ch.get_latest_response() == "":
-					logger.warning("No response found on chat history")
+		if regen:
+			logger.info("Attempt to regenerate research code...")
+
+			if new_ch.get_latest_instruction() == "":
+				logger.warning("No instruction found on chat history")
+			if new_ch.get_latest_response() == "":
+				logger.warning("No response found on chat history")
+
+		logger.info("Generating and running research code in conatiner...")
+		winner, failed = run_candidates(
+			agent.genner,
+			generate_research_code,
+			partial(
+				agent.container_manager.run_code_in_con, postfix="trader_research_code"
+			),
+			candidates=candidates,
+		)
 
-				research_code_result, new_ch = agent.gen_better_code(
-					research_code=new_ch.get_latest_response(),
-					errors=err_acc,
+		# Temporarily avoid new chat to reduce cost
+		# agent.chat_history += new_ch
+		for candidate in failed:
+			if candidate.code:
+				for_training_chat_history += candidate.chat_history
+			if regen:
+				logger.error(
+					f"Regen failed on research code generation..., err: \n{candidate.result.err()}"
 				)
-				research_code = research_code_result.unwrap()
 			else:
-				if not prev_strat:
-					research_code_result, new_ch = agent.gen_research_code_on_first(
-						apis=apis, network=network
-					)
-					research_code = research_code_result.unwrap()
-				else:
-					research_code_result, new_ch = agent.gen_research_code(
-						notifications_str=notif_str if notif_str else "Fresh",
-						prev_strategy=prev_strat.summarized_desc if prev_strat else "",
-						apis=apis,
-						rag_summary=rag_summary,
-						before_metric_state=str(rag_start_metric_state) or "",
-						after_metric_state=str(rag_end_metric_state) or "",
-					)
-					research_code = research_code_result.unwrap()
+				logger.error(
+					f"Failed on first research code generation..., err: \n{candidate.result.err()}"
+				)
 
-			# logger.info(f"Response: {new_ch.get_latest_response()}")
-			# Temporarily avoid new chat to reduce cost
-			# agent.chat_history += new_ch
+		if winner is not None:
+			new_ch = winner.chat_history
 			for_training_chat_history += new_ch
-
-			logger.info("Running the resulting research code in conatiner...")
-			code_execution_result = agent.container_manager.run_code_in_con(
-				research_code, "trader_research_code"
-			)
-			research_code_output, _ = code_execution_result.unwrap()
+			research_code_output, _ = winner.result.unwrap()
 
 			success = True
 			break
-		except UnwrapError as e:
-			e = e.result.err()
-			if regen:
-				logger.error(f"Regen failed on research code generation..., err: \n{e}")
-			else:
-				logger.error(f"Failed on first research code generation..., err: \n{e}")
-			regen = True
-			err_acc += f"\n{str(e)}"
+
+		# Fix the code of a candidate that was generated, if any
+		retried = next((c for c in failed if c.code), failed[-1])
+		new_ch = retried.chat_history
+		regen = True
+		err_acc += f"\n{str(retried.result.err())}"
 
 	if not success:
 		logger.info(
@@ -273,6 +345,7 @@ def assisted_flow(
 		)
 		return
 	logger.info("Succeeded in generating research...")
+	stages.mark("research")
 	logger.info(f"Research :\n{research_code_output}")
 
 	logger.info("Attempt to generate strategy...")
@@ -316,52 +389,71 @@ def assisted_flow(
 		logger.info("Succeeded generating strategy")
 		logger.info(f"Strategy :\n{strategy_output}")
 
+	stages.mark("strategy")
+
+	def generate_address_research_code(
+		genner: Genner,
+	) -> Tuple[Result[str, str], ChatHistory]:
+		candidate_agent = agent.with_genner(genner)
+		if regen:
+			return candidate_agent.gen_better_code(
+				research_code=new_ch.get_latest_response(),
+				errors=err_acc,
+			)
+		return candidate_agent.gen_account_research_code(
+			strategy_output=strategy_output
+		)
+
 	logger.info("Generating address research code...")
-	address_research_code = ""
 	err_acc = ""
 	regen = False
 	success = False
 	for i in range(10):
-		try:
-			if regen:
-				logger.info("Regenning on address research...")
-
-				if new_ch.get_latest_instruction() == "":
-					logger.warning("No instruction found on chat history")
-				if new_ch.get_latest_response() == "":
-					logger.warning("No response found on chat history")
+		if regen:
+			logger.info("Regenning on address research...")
+
+			if new_ch.get_latest_instruction() == "":
+				logger.warning("No instruction found on chat history")
+			if new_ch.get_latest_response() == "":
+				logger.warning("No response found on chat history")
+
+		logger.info("Generating and running address research code in conatiner...")
+		winner, failed = run_candidates(
+			agent.genner,
+			generate_address_research_code,
+			partial(
+				agent.container_manager.run_code_in_con,
+				postfix="trader_address_research",
+			),
+			candidates=candidates,
+		)
 
-				address_research_code_result, new_ch = agent.gen_better_code(
-					research_code=new_ch.get_latest_response(),
-					errors=err_acc,
+		# Temporarily avoid new chat to reduce cost
+		# agent.chat_history += new_ch
+		for candidate in failed:
+			if candidate.code:
+				for_training_chat_history += candidate.chat_history
+			if regen:
+				logger.error(
+					f"Regen failed on address research, err: \n{candidate.result.err()}"
 				)
-				address_research_code = address_research_code_result.unwrap()
 			else:
-				address_research_code_result, new_ch = agent.gen_account_research_code(
-					strategy_output=strategy_output
+				logger.error(
+					f"Failed on first address research code, err: \n{candidate.result.err()}"
 				)
-				address_research_code = address_research_code_result.unwrap()
 
-			# logger.info(f"Response: {new_ch.get_latest_response()}")
-			# Temporarily avoid new chat to reduce cost
-			# agent.chat_history += new_ch
+		if winner is not None:
+			new_ch = winner.chat_history
 			for_training_chat_history += new_ch
-
-			logger.info("Running the resulting address research code in conatiner...")
-			code_execution_result = agent.container_manager.run_code_in_con(
-				address_research_code, "trader_address_research"
-			)
-			address_research_output, _ = code_execution_result.unwrap()
+			address_research_output, _ = winner.result.unwrap()
 			success = True
 			break
-		except UnwrapError as e:
-			e = e.result.err()
-			if regen:
-				logger.error(f"Regen failed on address research, err: \n{e}")
-			else:
-				logger.error(f"Failed on first address research code, err: \n{e}")
-			regen = True
-			err_acc += f"\n{str(e)}"
+
+		# Fix the code of a candidate that was generated, if any
+		retried = next((c for c in failed if c.code), failed[-1])
+		new_ch = retried.chat_history
+		regen = True
+		err_acc += f"\n{str(retried.result.err())}"
 
 	if not success:
 		logger.info(
@@ -370,6 +462,7 @@ def assisted_flow(
 		return
 
 	logger.info("Succeeded address research")
+	stages.mark("address_research")
 	logger.info(f"Address research: \n{address_research_output}")
 
 	logger.info("Generating some trading code")
@@ -426,16 +519,39 @@ def assisted_flow(
 			regen = True
 			err_acc += f"\n{str(e)}"
 
+	stages.mark("trading")
+
 	if not success:
 		logger.info("Failed generating output of trading code after 3 times...")
 	else:
 		logger.info("Succeeded generating output of trading code!")
 		logger.info(f"Output: \n{trading_code_output}")
 
-	agent.db.insert_chat_history(session_id, for_training_chat_history)
+	stages.submit(
+		"insert_chat_history",
+		agent.db.insert_chat_history,
+		session_id,
+		for_training_chat_history,
+	)
 
-	end_metric_state = metric_fn()
-	agent.db.insert_wallet_snapshot(
+	# The summaries only depend on the generated code and strategy, so they
+	# are generated while the end wallet snapshot is taken
+	summarized_code_future = stages.submit(
+		"summarize_code",
+		summarizer,
+		[
+			trading_code,
+			"Summarize the code above in points",
+		],
+	)
+	summarized_desc_future = stages.submit(
+		"summarize_strategy", summarizer, [strategy_output]
+	)
+
+	end_metric_state = stages.run("end_metric_state", metric_fn)
+	stages.submit(
+		"insert_end_wallet_snapshot",
+		agent.db.insert_wallet_snapshot,
 		snapshot_id=f"{nanoid(8)}-{session_id}-{start_metric_state['wallet_address']}",
 		agent_id=agent.agent_id,
 		total_value_usd=start_metric_state["total_value_usd"],
@@ -449,20 +565,17 @@ def assisted_flow(
         USD Value After: {end_metric_state["total_value_usd"]}
     """)
 
-	summarized_code = summarizer(
-		[
-			trading_code,
-			"Summarize the code above in points",
-		]
-	)
 	logger.info("Summarizing code...")
+	summarized_code = summarized_code_future.result()
 	logger.info(f"Summarized code: \n{summarized_code}")
 
 	logger.info("Saving strategy and its result...")
-	agent.db.insert_strategy_and_result(
+	stages.run(
+		"insert_strategy_and_result",
+		agent.db.insert_strategy_and_result,
 		agent_id=agent.agent_id,
 		strategy_result=StrategyInsertData(
-			summarized_desc=summarizer([strategy_output]),
+			summarized_desc=summarized_desc_future.result(),
 			full_desc=strategy_output,
 			parameters={
 				"apis": apis,
@@ -1,15 +1,287 @@
+import asyncio
+import atexit
+import copy
+import dataclasses
+import threading
 from abc import ABC, abstractmethod
-from typing import Callable, List, Tuple
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Tuple, TypeVar
 from ollama import ChatResponse, chat
 from result import Err, Ok, Result
 
+from src.client.openrouter import AsyncOpenRouter
 from src.config import (
 	OllamaConfig,
 )
 from src.types import ChatHistory
 
+_usage_lock = threading.Lock()
+
+# Event loop running in the background for `run_concurrently`, started on first use
+_loop: asyncio.AbstractEventLoop | None = None
+_loop_thread: threading.Thread | None = None
+_loop_lock = threading.Lock()
+
+T = TypeVar("T")
+
+
+@dataclass
+class TokenUsage:
+	"""
+	Token counts of the requests of a generator.
+
+	Attributes:
+		cached_input_tokens (int): Input tokens read from the prompt cache of the provider
+		uncached_input_tokens (int): Input tokens processed in full, including the ones written to the cache
+		output_tokens (int): Generated tokens
+		requests (int): Number of requests whose usage was reported
+	"""
+
+	cached_input_tokens: int = 0
+	uncached_input_tokens: int = 0
+	output_tokens: int = 0
+	requests: int = 0
+
+	def __add__(self, other: "TokenUsage") -> "TokenUsage":
+		return TokenUsage(
+			cached_input_tokens=self.cached_input_tokens + other.cached_input_tokens,
+			uncached_input_tokens=self.uncached_input_tokens
+			+ other.uncached_input_tokens,
+			output_tokens=self.output_tokens + other.output_tokens,
+			requests=self.requests + other.requests,
+		)
+
+	def __sub__(self, other: "TokenUsage") -> "TokenUsage":
+		return TokenUsage(
+			cached_input_tokens=self.cached_input_tokens - other.cached_input_tokens,
+			uncached_input_tokens=self.uncached_input_tokens
+			- other.uncached_input_tokens,
+			output_tokens=self.output_tokens - other.output_tokens,
+			requests=self.requests - other.requests,
+		)
+
+	def __str__(self) -> str:
+		return (
+			f"{self.cached_input_tokens} cached and {self.uncached_input_tokens} uncached "
+			f"input tokens, {self.output_tokens} output tokens over {self.requests} request(s)"
+		)
+
+	@staticmethod
+	def from_openai(usage: Dict[str, Any] | None) -> "TokenUsage":
+		"""
+		Read the usage reported by an OpenAI compatible API, e.g. OpenAI, OpenRouter or DeepSeek.
+
+		Args:
+			usage (Dict[str, Any] | None): The `usage` object of the response
+
+		Returns:
+			TokenUsage: The usage of the request, empty if none was reported
+		"""
+		if not usage:
+			return TokenUsage()
+
+		prompt_tokens = usage.get("prompt_tokens") or 0
+		if usage.get("prompt_cache_hit_tokens") is not None:
+			# DeepSeek reports its cache hits separately
+			cached_tokens = usage["prompt_cache_hit_tokens"]
+		else:
+			cached_tokens = (usage.get("prompt_tokens_details") or {}).get(
+				"cached_tokens"
+			) or 0
+
+		return TokenUsage(
+			cached_input_tokens=cached_tokens,
+			uncached_input_tokens=prompt_tokens - cached_tokens,
+			output_tokens=usage.get("completion_tokens") or 0,
+			requests=1,
+		)
+
+	@staticmethod
+	def from_anthropic(usage: Any) -> "TokenUsage":
+		"""
+		Read the usage reported by the Anthropic API.
+
+		Args:
+			usage (Any): The `usage` object of the message
+
+		Returns:
+			TokenUsage: The usage of the request, empty if none was reported
+		"""
+		if usage is None:
+			return TokenUsage()
+
+		return TokenUsage(
+			cached_input_tokens=getattr(usage, "cache_read_input_tokens", None) or 0,
+			uncached_input_tokens=(getattr(usage, "input_tokens", None) or 0)
+			+ (getattr(usage, "cache_creation_input_tokens", None) or 0),
+			output_tokens=getattr(usage, "output_tokens", None) or 0,
+			requests=1,
+		)
+
+
+def cacheable_messages(messages: ChatHistory) -> List[Dict[str, Any]]:
+	"""
+	Convert a chat history to native messages, marking its system prompt as a cacheable prefix.
+
+	The system prompt is sent as a text part with an ephemeral `cache_control`,
+	the format of Anthropic's prompt caching, which OpenRouter also accepts for
+	the providers that need explicit cache breakpoints.
+
+	Args:
+		messages (ChatHistory): Chat history containing the conversation context
+
+	Returns:
+		List[Dict[str, Any]]: The native messages
+	"""
+	native: List[Dict[str, Any]] = list(messages.as_native())
+	if native and native[0]["role"] == "system":
+		native[0] = {
+			"role": "system",
+			"content": [
+				{
+					"type": "text",
+					"text": native[0]["content"],
+					"cache_control": {"type": "ephemeral"},
+				}
+			],
+		}
+
+	return native
+
+
+class StreamingCodeExtractor:
+	"""
+	Watches the tokens of a streamed response for the code `generate_code` extracts.
+
+	Reasoning models keep writing prose after their code block. Feeding every
+	token of the main content to `feed` lets a backend stop the stream as soon
+	as the code is complete, i.e. as soon as the closing fence of the python
+	block (or the closing tag of the requested block) arrives, saving the time
+	and the output tokens of the rest of the response. Completeness is decided
+	with the `extract_code` of the backend itself, only on the tokens that can
+	close a fence or a tag, so the code is the one the full response would give.
+	With a `cancel` event, the stream is also stopped once the event is set.
+
+	    >>> watcher = StreamingCodeExtractor(self.extract_code, blocks)
+	    >>> completion_result = self.ch_completion(messages, until=watcher.feed)
+	"""
+
+	def __init__(
+		self,
+		extract_code: Callable[[str, List[str]], Result[List[str], str]],
+		blocks: List[str] = [""],
+		cancel: threading.Event | None = None,
+	):
+		"""
+		Initialize the extractor.
+
+		Args:
+			extract_code (Callable[[str, List[str]], Result[List[str], str]]): `extract_code` of the backend
+			blocks (List[str]): XML tag names to extract content from before processing into code
+			cancel (threading.Event | None): Event set when the response is no longer needed. Defaults to None.
+		"""
+		self.extract_code = extract_code
+		self.blocks = blocks
+		self.cancel = cancel
+		self.response = ""
+		self.code: List[str] | None = None
+
+	def feed(self, token: str) -> bool:
+		"""
+		Add a token of the main content of the response.
+
+		Args:
+			token (str): The token
+
+		Returns:
+			bool: Whether the code is complete or cancelled, in which case the stream can be stopped
+		"""
+		self.response += token
+		if self.code is None and ("`" in token or ">" in token):
+			extract_code_result = self.extract_code(self.response, self.blocks)
+			if isinstance(extract_code_result, Ok):
+				self.code = extract_code_result.unwrap()
+
+		return self.code is not None or (
+			self.cancel is not None and self.cancel.is_set()
+		)
+
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+	global _loop, _loop_thread
+
+	with _loop_lock:
+		if _loop is None:
+			_loop = asyncio.new_event_loop()
+			_loop_thread = threading.Thread(
+				target=_loop.run_forever, name="genner-event-loop", daemon=True
+			)
+			_loop_thread.start()
+
+		return _loop
+
+
+def shutdown_event_loop():
+	"""
+	Close the shared connections of `AsyncOpenRouter` on the background loop of `run_concurrently`, then stop the loop.
+
+	Called when the process exits. A later `run_concurrently` starts a new loop.
+	"""
+	global _loop, _loop_thread
+
+	with _loop_lock:
+		loop, thread = _loop, _loop_thread
+		_loop, _loop_thread = None, None
+
+	if loop is None or thread is None:
+		return
+
+	try:
+		asyncio.run_coroutine_threadsafe(AsyncOpenRouter.aclose(), loop).result(
+			timeout=10
+		)
+	finally:
+		loop.call_soon_threadsafe(loop.stop)
+		thread.join(timeout=10)
+		if not thread.is_alive():
+			loop.close()
+
+
+atexit.register(shutdown_event_loop)
+
+
+def run_concurrently(*awaitables: Awaitable[T]) -> List[T]:
+	"""
+	Run awaitables concurrently on a long-lived background event loop, from synchronous code.
+
+	This lets the synchronous flows overlap independent generations, e.g.
+	`run_concurrently(genner.ach_completion(a), genner.ach_completion(b))`.
+	Every call runs on the same loop, so the shared connections of
+	`AsyncOpenRouter` stay warm from one call to the next; they are closed by
+	`shutdown_event_loop`. Code already running on an event loop should await
+	`asyncio.gather` instead.
+
+	Args:
+		*awaitables (Awaitable[T]): The awaitables to run
+
+	Returns:
+		List[T]: Their results, in the order of the awaitables
+	"""
+
+	async def gather() -> List[T]:
+		return await asyncio.gather(*awaitables)
+
+	return asyncio.run_coroutine_threadsafe(gather(), _background_loop()).result()
+
+
+def _discard_token(token: str):
+	pass
+
 
 class Genner(ABC):
+	# Set when the responses of the generator are no longer needed, see `variant`
+	cancel: threading.Event | None = None
+
 	def __init__(self, identifier: str, do_stream: bool):
 		"""
 		Initialize the base generator class.
@@ -23,9 +295,27 @@ class Genner(ABC):
 		"""
 		self.identifier = identifier
 		self.do_stream = do_stream
+		self.usage = TokenUsage()
+
+	def record_usage(self, usage: TokenUsage):
+		"""
+		Add the usage of a request to the total usage of the generator.
+
+		The total is shared with the variants of the generator, see `variant`.
+
+		Args:
+			usage (TokenUsage): The usage of the request
+		"""
+		with _usage_lock:
+			self.usage.cached_input_tokens += usage.cached_input_tokens
+			self.usage.uncached_input_tokens += usage.uncached_input_tokens
+			self.usage.output_tokens += usage.output_tokens
+			self.usage.requests += usage.requests
 
 	@abstractmethod
-	def ch_completion(self, messages: ChatHistory) -> Result[str, str]:
+	def ch_completion(
+		self, messages: ChatHistory, until: Callable[[str], bool] | None = None
+	) -> Result[str, str]:
 		"""
 		Generate a single completion (strategy) based on the current chat history.
 
@@ -34,6 +324,8 @@ class Genner(ABC):
 
 		Args:
 			messages (ChatHistory): Chat history containing the conversation context
+			until (Callable[[str], bool] | None): Called with every token of the main content when streaming, the stream
+				being stopped as soon as it returns True, see `StreamingCodeExtractor`. Defaults to None.
 
 		Returns:
 			Result[str, str]:
@@ -53,6 +345,48 @@ class Genner(ABC):
 		"""
 		self.do_stream = final_state
 
+	def variant(
+		self, temperature: float | None = None, cancel: threading.Event | None = None
+	) -> "Genner":
+		"""
+		Get a copy of the generator to sample an alternative response with.
+
+		The copy shares the client and the token usage of the generator and does not
+		stream, so that several copies can generate concurrently without interleaving
+		their tokens. With `cancel`, the copy streams its tokens to nowhere instead,
+		so that its code generations stop at the next token once the event is set.
+
+		Args:
+			temperature (float | None): Sampling temperature of the copy, ignored by
+				backends without a configurable temperature. Defaults to None, which
+				keeps the configured one.
+			cancel (threading.Event | None): Event set when the responses of the copy
+				are no longer needed. Defaults to None.
+
+		Returns:
+			Genner: The copy of the generator
+		"""
+		genner = copy.copy(self)
+		genner.set_do_stream(False)
+		if cancel is not None:
+			genner.cancel = cancel
+			if hasattr(genner, "stream_fn"):
+				setattr(genner, "stream_fn", _discard_token)
+				genner.set_do_stream(True)
+
+		config = getattr(self, "config", None)
+		if (
+			temperature is not None
+			and dataclasses.is_dataclass(config)
+			and not isinstance(config, type)
+			and "temperature" in {field.name for field in dataclasses.fields(config)}
+		):
+			setattr(
+				genner, "config", dataclasses.replace(config, temperature=temperature)
+			)
+
+		return genner
+
 	@abstractmethod
 	def generate_code(
 		self, messages: ChatHistory, blocks: List[str] = [""]
@@ -101,6 +435,62 @@ class Genner(ABC):
 		"""
 		pass
 
+	async def ach_completion(self, messages: ChatHistory) -> Result[str, str]:
+		"""
+		Asynchronous `ch_completion`, to overlap independent generations.
+
+		Backends without an asynchronous client run `ch_completion` of a
+		non-streaming variant (see `variant`) on a worker thread, so concurrent
+		calls do not interleave their streamed tokens.
+
+		Args:
+			messages (ChatHistory): Chat history containing the conversation context
+
+		Returns:
+			Result[str, str]:
+				Ok(str): The raw response text if successful
+				Err(str): The error message if generation failed
+		"""
+		return await asyncio.to_thread(self.variant().ch_completion, messages)
+
+	async def agenerate_code(
+		self, messages: ChatHistory, blocks: List[str] = [""]
+	) -> Result[Tuple[List[str], str], str]:
+		"""
+		Asynchronous `generate_code`, see `ach_completion`.
+
+		Args:
+			messages (ChatHistory): Chat history containing the conversation context
+			blocks (List[str]): XML tag names to extract content from before processing into code
+
+		Returns:
+			Result[Tuple[List[str], str], str]:
+				Ok(Tuple[List[str], str]): Tuple containing:
+					- List[str]: Processed code blocks
+					- str: Raw response from the model
+				Err(str): Error message if generation failed
+		"""
+		return await asyncio.to_thread(self.variant().generate_code, messages, blocks)
+
+	async def agenerate_list(
+		self, messages: ChatHistory, blocks: List[str] = [""]
+	) -> Result[Tuple[List[List[str]], str], str]:
+		"""
+		Asynchronous `generate_list`, see `ach_completion`.
+
+		Args:
+			messages (ChatHistory): Chat history containing the conversation context
+			blocks (List[str]): XML tag names to extract content from before processing into lists
+
+		Returns:
+			Result[Tuple[List[List[str]], str], str]:
+				Ok(Tuple[List[List[str]], str]): Tuple containing:
+					- List[List[str]]: Processed lists of items
+					- str: Raw response from the model
+				Err(str): Error message if generation failed
+		"""
+		return await asyncio.to_thread(self.variant().generate_list, messages, blocks)
+
 	@abstractmethod
 	def extract_code(
 		self, response: str, blocks: List[str] = []
@@ -170,7 +560,9 @@ class OllamaGenner(Genner):
 		self.config = config
 		self.stream_fn = stream_fn
 
-	def ch_completion(self, messages: ChatHistory) -> Result[str, str]:
+	def ch_completion(
+		self, messages: ChatHistory, until: Callable[[str], bool] | None = None
+	) -> Result[str, str]:
 		"""
 		Generate a completion using the Ollama API.
 
@@ -179,6 +571,8 @@ class OllamaGenner(Genner):
 
 		Args:
 			messages (ChatHistory): Chat history containing the conversation context
+			until (Callable[[str], bool] | None): Called with every token of the main content when streaming, the stream
+				being stopped as soon as it returns True, see `StreamingCodeExtractor`. Defaults to None.
 
 		Returns:
 			Result[str, str]:
@@ -192,11 +586,16 @@ class OllamaGenner(Genner):
 			if self.do_stream:
 				assert self.stream_fn is not None
 
-				for chunk in chat(self.config.model, messages.as_native(), stream=True):
+				stream = chat(self.config.model, messages.as_native(), stream=True)
+				for chunk in stream:
 					if chunk["message"] and chunk["message"]["content"]:
 						token = chunk["message"]["content"]
 						self.stream_fn(token)
 						final_response += token
+
+						if until is not None and until(token):
+							stream.close()  # type: ignore
+							break
 			else:
 				response: ChatResponse = chat(self.config.model, messages.as_native())
 				assert response.message.content is not None, (
@@ -239,7 +638,10 @@ class OllamaGenner(Genner):
 		raw_response = ""
 
 		try:
-			completion_result = self.ch_completion(messages)
+			code_watcher = StreamingCodeExtractor(
+				self.extract_code, blocks, cancel=self.cancel
+			)
+			completion_result = self.ch_completion(messages, until=code_watcher.feed)
 
 			if err := completion_result.err():
 				return (
@@ -0,0 +1,338 @@
+import copy
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, List, Tuple
+
+from loguru import logger
+from result import Err, Ok, Result
+
+from src.types import ChatHistory
+
+from .Base import Genner, StreamingCodeExtractor
+
+
+class ResponseCache:
+	"""
+	On-disk store of LLM responses, bounded in age and number of entries.
+
+	Responses are kept in a SQLite database, the least recently used ones being
+	deleted once there are more than `max_entries` of them.
+	"""
+
+	def __init__(
+		self,
+		path: Path | str,
+		ttl_seconds: float | None = 7 * 24 * 3600,
+		max_entries: int = 10_000,
+	):
+		"""
+		Initialize the cache, creating its database if needed.
+
+		Args:
+			path (Path | str): Path of the SQLite database
+			ttl_seconds (float | None, optional): Age after which a response is not reused, None to reuse it forever. Defaults to 7 days.
+			max_entries (int, optional): Maximum number of responses kept. Defaults to 10000.
+		"""
+		self.path = Path(path)
+		self.ttl_seconds = ttl_seconds
+		self.max_entries = max_entries
+
+		self.path.parent.mkdir(parents=True, exist_ok=True)
+		self._lock = threading.Lock()
+
+		# A single connection, used under `_lock` from whichever thread generates
+		self._conn = sqlite3.connect(self.path, check_same_thread=False)
+		with self._conn as conn:
+			conn.executescript(
+				"""
+				PRAGMA journal_mode=WAL;
+				CREATE TABLE IF NOT EXISTS responses (
+					key TEXT PRIMARY KEY,
+					response TEXT NOT NULL,
+					created_at REAL NOT NULL,
+					used_at REAL NOT NULL
+				);
+				CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at);
+				"""
+			)
+
+	def close(self):
+		"""
+		Close the connection to the database of the cache.
+		"""
+		with self._lock:
+			self._conn.close()
+
+	@staticmethod
+	def key(
+		backend: str,
+		model: str | None,
+		temperature: float | None,
+		messages: ChatHistory,
+		stopped_early: bool = False,
+	) -> str:
+		"""
+		Compute the key of a request.
+
+		Args:
+			backend (str): Identifier of the genner
+			model (str | None): Model the request is sent to
+			temperature (float | None): Sampling temperature of the request
+			messages (ChatHistory): Messages of the request
+			stopped_early (bool, optional): Whether the response was cut off by the `until` of the request,
+				e.g. at the end of its code block. Defaults to False.
+
+		Returns:
+			str: The key of the request
+		"""
+		payload = json.dumps(
+			{
+				"backend": backend,
+				"model": model,
+				"temperature": temperature,
+				"messages": messages.as_native(),
+				"stopped_early": stopped_early,
+			},
+			sort_keys=True,
+		)
+
+		return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+	def get(self, key: str) -> str | None:
+		"""
+		Get the response of a request, if it is cached and not expired.
+
+		Args:
+			key (str): Key of the request, see `key`
+
+		Returns:
+			str | None: The response, or None on a cache miss
+		"""
+		now = time.time()
+		with self._lock, self._conn as conn:
+			row = conn.execute(
+				"SELECT response, created_at FROM responses WHERE key = ?", (key,)
+			).fetchone()
+			if row is None:
+				return None
+
+			response, created_at = row
+			if self.ttl_seconds is not None and now - created_at > self.ttl_seconds:
+				conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+				return None
+
+			conn.execute("UPDATE responses SET used_at = ? WHERE key = ?", (now, key))
+
+		return response
+
+	def put(self, key: str, response: str):
+		"""
+		Cache the response of a request, then evict the least recently used responses over the bound.
+
+		Args:
+			key (str): Key of the request, see `key`
+			response (str): The response
+		"""
+		now = time.time()
+		with self._lock, self._conn as conn:
+			conn.execute(
+				"INSERT OR REPLACE INTO responses (key, response, created_at, used_at) VALUES (?, ?, ?, ?)",
+				(key, response, now, now),
+			)
+			conn.execute(
+				"DELETE FROM responses WHERE key IN ("
+				"SELECT key FROM responses ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+				(self.max_entries,),
+			)
+
+
+class CachedGenner(Genner):
+	"""
+	Genner wrapping another one, reusing its responses to identical requests.
+
+	Requests are keyed by the identifier, model and temperature of the wrapped
+	genner and the messages sent. In replay mode the wrapped genner is never
+	called, a request that is not cached fails instead, which makes runs of
+	deterministic workloads such as tests, evaluations or back-tests
+	reproducible and free of LLM latency.
+
+	    >>> genner = CachedGenner(get_genner("gemini", ...), ResponseCache("./cache/llm.sqlite3"))
+	"""
+
+	def __init__(self, genner: Genner, cache: ResponseCache, replay_only: bool = False):
+		"""
+		Initialize the caching genner.
+
+		Args:
+			genner (Genner): The genner to cache the responses of
+			cache (ResponseCache): Store of the responses
+			replay_only (bool, optional): Whether to only answer from the cache, failing on a cache miss. Defaults to False.
+		"""
+		super().__init__(f"cached-{genner.identifier}", genner.do_stream)
+		self.genner = genner
+		self.cache = cache
+		self.replay_only = replay_only
+		# Report the usage of the requests that were actually sent
+		self.usage = genner.usage
+
+	def _key(self, messages: ChatHistory, stopped_early: bool = False) -> str:
+		config = getattr(self.genner, "config", None)
+		return ResponseCache.key(
+			backend=self.genner.identifier,
+			model=getattr(config, "model", None),
+			temperature=getattr(config, "temperature", None),
+			messages=messages,
+			stopped_early=stopped_early,
+		)
+
+	def set_do_stream(self, final_state: bool):
+		super().set_do_stream(final_state)
+		self.genner.set_do_stream(final_state)
+
+	def variant(
+		self, temperature: float | None = None, cancel: threading.Event | None = None
+	) -> "Genner":
+		genner = copy.copy(self)
+		genner.genner = self.genner.variant(temperature, cancel)
+		genner.do_stream = genner.genner.do_stream
+		if cancel is not None:
+			genner.cancel = cancel
+
+		return genner
+
+	def ch_completion(
+		self, messages: ChatHistory, until: Callable[[str], bool] | None = None
+	) -> Result[str, str]:
+		"""
+		Get the response to a request from the cache, or from the wrapped genner on a cache miss.
+
+		Args:
+			messages (ChatHistory): Chat history containing the conversation context
+			until (Callable[[str], bool] | None): Passed to the wrapped genner on a cache miss. Defaults to None.
+				A response it cuts off is cached apart, to only be reused by requests with an `until`.
+
+		Returns:
+			Result[str, str]:
+				Ok(str): The response, cached or generated
+				Err(str): Error message if generation failed, or if the request is not cached in replay mode
+		"""
+		key = self._key(messages)
+		keys = (
+			[key] if until is None else [self._key(messages, stopped_early=True), key]
+		)
+		for cached_key in keys:
+			cached_response = self.cache.get(cached_key)
+			if cached_response is not None:
+				break
+
+		if cached_response is not None:
+			logger.debug(f"Reused the cached response of request {cached_key[:12]}")
+			stream_fn = getattr(self.genner, "stream_fn", None)
+			if self.genner.do_stream and stream_fn is not None:
+				stream_fn(cached_response)
+			return Ok(cached_response)
+
+		if self.replay_only:
+			return Err(
+				f"CachedGenner.ch_completion: Request {key[:12]} is not cached and the genner is in replay mode"
+			)
+
+		stopped_early = False
+
+		def watch(token: str) -> bool:
+			nonlocal stopped_early
+			assert until is not None
+			stopped_early = until(token)
+			return stopped_early
+
+		completion_result = self.genner.ch_completion(
+			messages, until=None if until is None else watch
+		)
+		# A response cut off because it was no longer needed is not worth reusing
+		cancelled = self.cancel is not None and self.cancel.is_set()
+		if isinstance(completion_result, Ok) and not (stopped_early and cancelled):
+			self.cache.put(
+				self._key(messages, stopped_early=stopped_early),
+				completion_result.unwrap(),
+			)
+
+		return completion_result
+
+	def generate_code(
+		self, messages: ChatHistory, blocks: List[str] = [""]
+	) -> Result[Tuple[List[str], str], str]:
+		"""
+		Generate code like the wrapped genner, with a cached completion.
+
+		Args:
+			messages (ChatHistory): Chat history containing the conversation context
+			blocks (List[str]): XML tag names to extract content from before processing into code
+
+		Returns:
+			Result[Tuple[List[str], str], str]:
+				Ok(Tuple[List[str], str]): Tuple containing:
+					- List[str]: Processed code blocks, None if no code could be extracted
+					- str: Raw response from the model
+				Err(str): Error message if generation failed
+		"""
+		code_watcher = StreamingCodeExtractor(
+			self.extract_code, blocks, cancel=self.cancel
+		)
+		completion_result = self.ch_completion(messages, until=code_watcher.feed)
+		if err := completion_result.err():
+			return Err(
+				f"CachedGenner.generate_code: completion_result.is_err(): \n{err}"
+			)
+
+		raw_response = completion_result.unwrap()
+		extract_code_result = self.extract_code(raw_response, blocks)
+		if extract_code_result.is_err():
+			return Ok((None, raw_response))  # type: ignore
+
+		return Ok((extract_code_result.unwrap(), raw_response))
+
+	def generate_list(
+		self, messages: ChatHistory, blocks: List[str] = [""]
+	) -> Result[Tuple[List[List[str]], str], str]:
+		"""
+		Generate lists like the wrapped genner, with a cached completion.
+
+		Args:
+			messages (ChatHistory): Chat history containing the conversation context
+			blocks (List[str]): XML tag names to extract content from before processing into lists
+
+		Returns:
+			Result[Tuple[List[List[str]], str], str]:
+				Ok(Tuple[List[List[str]], str]): Tuple containing:
+					- List[List[str]]: Processed lists of items
+					- str: Raw response from the model
+				Err(str): Error message if generation failed
+		"""
+		completion_result = self.ch_completion(messages)
+		if err := completion_result.err():
+			return Err(
+				f"CachedGenner.generate_list: completion_result.is_err(): \n{err}"
+			)
+
+		raw_response = completion_result.unwrap()
+		extract_list_result = self.extract_list(raw_response, blocks)
+		if err := extract_list_result.err():
+			return Err(
+				f"CachedGenner.generate_list: extract_list_result.is_err(): \n{err}"
+			)
+
+		return Ok((extract_list_result.unwrap(), raw_response))
+
+	def extract_code(
+		self, response: str, blocks: List[str] = []
+	) -> Result[List[str], str]:
+		return self.genner.extract_code(response, blocks)
+
+	def extract_list(
+		self, response: str, block_name: List[str] = []
+	) -> Result[List[List[str]], str]:
+		return self.genner.extract_list(response, block_name)
@@ -8,7 +8,7 @@ from src.config import ClaudeConfig
 from src.helper import extract_content
 from src.types import ChatHistory
 
-from .Base import Genner
+from .Base import Genner, StreamingCodeExtractor, TokenUsage
 
 
 class ClaudeGenner(Genner):
@@ -35,7 +35,9 @@ class ClaudeGenner(Genner):
 		self.config = config
 		self.stream_fn = stream_fn
 
-	def ch_completion(self, messages: ChatHistory) -> Result[str, str]:
+	def ch_completion(
+		self, messages: ChatHistory, until: Callable[[str], bool] | None = None
+	) -> Result[str, str]:
 		"""
 		Generate a completion using the Claude API.
 
@@ -45,6 +47,8 @@ class ClaudeGenner(Genner):
 
 		Args:
 			messages (ChatHistory): Chat history containing the conversation context
+			until (Callable[[str], bool] | None): Called with every token of the main content when streaming, the stream
+				being stopped as soon as it returns True, see `StreamingCodeExtractor`. Defaults to None.
 
 		Returns:
 			Result[str, str]:
@@ -53,7 +57,14 @@ class ClaudeGenner(Genner):
 		"""
 		system_message = messages.messages[0]
 		assert system_message.role == "system"
-		system = system_message.content
+		# The system prompt is the stable prefix of every request, cache it
+		system = [
+			{
+				"type": "text",
+				"text": system_message.content,
+				"cache_control": {"type": "ephemeral"},
+			}
+		]
 		ch = ChatHistory(messages.messages[1:])
 
 		final_response = ""
@@ -66,27 +77,42 @@ class ClaudeGenner(Genner):
 					model="claude-3-opus-20240229",
 					max_tokens=1024,
 					messages=ch.as_native(),  # type: ignore
-					system=system,
+					system=system,  # type: ignore
 				) as stream:
 					token_counts = 0
+					stopped_early = False
 					for chunk in stream:
 						if isinstance(chunk, TextEvent):
 							token = chunk.text
 							final_response += token
 							self.stream_fn(token)
 
+							if until is not None and until(token):
+								stopped_early = True
+								break
+
 							token_counts += 1
 							if token_counts >= self.config.max_tokens:
 								break
+
+					# Like the other backends, the usage of a stream stopped by `until` is not
+					# recorded: its final count of output tokens never arrives
+					if not stopped_early:
+						self.record_usage(
+							TokenUsage.from_anthropic(
+								stream.current_message_snapshot.usage
+							)
+						)
 			else:
 				response = self.client.messages.create(
 					model=self.config.model,  # e.g. "claude-3-opus-20240229"
 					messages=ch.as_native(),  # type: ignore
 					max_tokens=self.config.max_tokens,
-					system=system,
+					system=system,  # type: ignore
 				)
 
 				final_response = response.content[0].text  # type: ignore
+				self.record_usage(TokenUsage.from_anthropic(response.usage))
 
 			assert isinstance(final_response, str)
 		except AssertionError as e:
@@ -122,7 +148,10 @@ class ClaudeGenner(Genner):
 		raw_response = ""
 
 		try:
-			completion_result = self.ch_completion(messages)
+			code_watcher = StreamingCodeExtractor(
+				self.extract_code, blocks, cancel=self.cancel
+			)
+			completion_result = self.ch_completion(messages, until=code_watcher.feed)
 
 			if err := completion_result.err():
 				return (
@@ -1,5 +1,5 @@
 import re
-from typing import Callable, Generator, List, Tuple
+from typing import Any, Callable, Dict, Generator, List, Tuple
 
 import yaml
 from loguru import logger
@@ -12,7 +12,7 @@ from src.helper import extract_content
 from src.client.openrouter import OpenRouter
 from src.types import ChatHistory
 
-from .Base import Genner
+from .Base import Genner, StreamingCodeExtractor, TokenUsage
 
 
 class DeepseekGenner(Genner):
@@ -39,7 +39,12 @@ class DeepseekGenner(Genner):
 		self.config = config
 		self.stream_fn = stream_fn
 
-	def ch_completion(self, messages: ChatHistory) -> Result[str, str]:
+	def _on_usage(self, usage: Dict[str, Any]):
+		self.record_usage(TokenUsage.from_openai(usage))
+
+	def ch_completion(
+		self, messages: ChatHistory, until: Callable[[str], bool] | None = None
+	) -> Result[str, str]:
 		"""
 		Generate a completion using the Deepseek model.
 
@@ -49,6 +54,8 @@ class DeepseekGenner(Genner):
 
 		Args:
 			messages (ChatHistory): Chat history containing the conversation context
+			until (Callable[[str], bool] | None): Called with every token of the main content when streaming, the stream
+				being stopped as soon as it returns True, see `StreamingCodeExtractor`. Defaults to None.
 
 		Returns:
 			Result[str, str]:
@@ -69,12 +76,19 @@ class DeepseekGenner(Genner):
 							max_tokens=self.config.max_tokens,
 							temperature=self.config.temperature,
 							stream=True,
+							# DeepSeek caches the shared prefix of the prompts by itself,
+							# the last chunk reports how much of the prompt was a cache hit
+							stream_options={"include_usage": True},
 						)
 					)
 
 					token_counts = 0
 					for chunk in stream:
-						if chunk.choices[0].delta.content is not None:
+						if chunk.usage is not None:
+							self.record_usage(
+								TokenUsage.from_openai(chunk.usage.model_dump())
+							)
+						if chunk.choices and chunk.choices[0].delta.content is not None:
 							token = chunk.choices[0].delta.content
 
 							if not isinstance(token, str):
@@ -83,6 +97,10 @@ class DeepseekGenner(Genner):
 							final_response += token
 							self.stream_fn(token)
 
+							if until is not None and until(token):
+								stream.close()
+								break
+
 							token_counts += 1
 							if token_counts >= self.config.max_tokens:
 								break
@@ -95,6 +113,10 @@ class DeepseekGenner(Genner):
 						temperature=self.config.temperature,
 						stream=False,
 					)
+					if response.usage is not None:
+						self.record_usage(
+							TokenUsage.from_openai(response.usage.model_dump())
+						)
 
 					final_response = response.choices[0].message.content
 
@@ -108,6 +130,7 @@ class DeepseekGenner(Genner):
 						model=self.config.model,
 						max_tokens=self.config.max_tokens,
 						temperature=self.config.temperature,
+						on_usage=self._on_usage,
 					)
 
 					reasoning_entered = False
@@ -128,6 +151,10 @@ class DeepseekGenner(Genner):
 							final_response += token
 
 						self.stream_fn(token)
+
+						if token_type == "main" and until is not None and until(token):
+							stream_.close()
+							break
 					self.stream_fn("\n")
 				else:
 					final_response = self.client.create_chat_completion(
@@ -135,6 +162,7 @@ class DeepseekGenner(Genner):
 						model=self.config.model,
 						max_tokens=self.config.max_tokens,
 						temperature=self.config.temperature,
+						on_usage=self._on_usage,
 					)
 				assert isinstance(final_response, str)
 		except AssertionError as e:
@@ -170,7 +198,10 @@ class DeepseekGenner(Genner):
 		raw_response = ""
 
 		try:
-			completion_result = self.ch_completion(messages)
+			code_watcher = StreamingCodeExtractor(
+				self.extract_code, blocks, cancel=self.cancel
+			)
+			completion_result = self.ch_completion(messages, until=code_watcher.feed)
 
 			if err := completion_result.err():
 				return (
@@ -10,7 +10,7 @@ from src.config import OAIConfig
 from src.helper import extract_content
 from src.types import ChatHistory
 
-from .Base import Genner
+from .Base import Genner, StreamingCodeExtractor, TokenUsage
 
 
 class OAIGenner(Genner):
@@ -37,7 +37,9 @@ class OAIGenner(Genner):
 		self.config = config
 		self.stream_fn = stream_fn
 
-	def ch_completion(self, messages: ChatHistory) -> Result[str, str]:
+	def ch_completion(
+		self, messages: ChatHistory, until: Callable[[str], bool] | None = None
+	) -> Result[str, str]:
 		"""
 		Generate a completion using the OAI model.
 
@@ -47,6 +49,8 @@ class OAIGenner(Genner):
 
 		Args:
 			messages (ChatHistory): Chat history containing the conversation context
+			until (Callable[[str], bool] | None): Called with every token of the main content when streaming, the stream
+				being stopped as soon as it returns True, see `StreamingCodeExtractor`. Defaults to None.
 
 		Returns:
 			Result[str, str]:
@@ -64,6 +68,8 @@ class OAIGenner(Genner):
 					"max_completion_tokens": self.config.max_tokens,
 					"temperature": self.config.temperature,
 					"stream": True,
+					# The usage, with the prompt tokens read from the cache, comes in a last chunk without choices
+					"stream_options": {"include_usage": True},
 				}
 
 				if self.config.model == "o3-mini":
@@ -79,7 +85,11 @@ class OAIGenner(Genner):
 
 					token_counts = 0
 					for chunk in stream:
-						if chunk.choices[0].delta.content is not None:
+						if chunk.usage is not None:
+							self.record_usage(
+								TokenUsage.from_openai(chunk.usage.model_dump())
+							)
+						if chunk.choices and chunk.choices[0].delta.content is not None:
 							token = chunk.choices[0].delta.content
 
 							if not isinstance(token, str):
@@ -106,13 +116,26 @@ class OAIGenner(Genner):
 
 							self.stream_fn(token)
 
+							if (
+								until is not None
+								and main_entered
+								and self.config.thinking_delimiter not in token
+								and until(token)
+							):
+								stream.close()
+								break
+
 							token_counts += 1
 							if token_counts >= self.config.max_tokens:
 								break
 					self.stream_fn("\n")
 				else:
 					for chunk in stream:
-						if chunk.choices[0].delta.content is not None:
+						if chunk.usage is not None:
+							self.record_usage(
+								TokenUsage.from_openai(chunk.usage.model_dump())
+							)
+						if chunk.choices and chunk.choices[0].delta.content is not None:
 							token = chunk.choices[0].delta.content
 
 							if not isinstance(token, str):
@@ -120,6 +143,10 @@ class OAIGenner(Genner):
 
 							final_response += token
 							self.stream_fn(token)
+
+							if until is not None and until(token):
+								stream.close()
+								break
 			else:
 				kwargs = {
 					"model": self.config.model,
@@ -133,6 +160,10 @@ class OAIGenner(Genner):
 					kwargs.pop("temperature")
 
 				response = self.client.chat.completions.create(**kwargs)
+				if response.usage is not None:
+					self.record_usage(
+						TokenUsage.from_openai(response.usage.model_dump())
+					)
 
 				final_response: str = response.choices[0].message.content
 				final_response = final_response.split(self.config.thinking_delimiter)[
@@ -173,7 +204,10 @@ class OAIGenner(Genner):
 		raw_response = ""
 
 		try:
-			completion_result = self.ch_completion(messages)
+			code_watcher = StreamingCodeExtractor(
+				self.extract_code, blocks, cancel=self.cancel
+			)
+			completion_result = self.ch_completion(messages, until=code_watcher.feed)
 
 			if err := completion_result.err():
 				return (
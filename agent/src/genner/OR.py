@@ -1,14 +1,14 @@
 import re
-from typing import Callable, List, Tuple
+from typing import Any, Callable, Dict, List, Tuple
 
 import yaml
 from result import Err, Ok, Result
-from src.client.openrouter import OpenRouter
+from src.client.openrouter import AsyncOpenRouter, OpenRouter
 from src.config import OpenRouterConfig
 from src.helper import extract_content
 from src.types import ChatHistory
 
-from .Base import Genner
+from .Base import Genner, StreamingCodeExtractor, TokenUsage, cacheable_messages
 
 
 class OpenRouterGenner(Genner):
@@ -17,6 +17,7 @@ class OpenRouterGenner(Genner):
 		client: OpenRouter,
 		config: OpenRouterConfig,
 		stream_fn: Callable[[str], None] | None,
+		async_client: AsyncOpenRouter | None = None,
 	):
 		"""
 		Initialize the Claude-based generator.
@@ -29,13 +30,29 @@ class OpenRouterGenner(Genner):
 			config (ClaudeConfig): Configuration for the Claude model
 			stream_fn (Callable[[str], None] | None): Function to call with streamed tokens,
 				or None to disable streaming
+			async_client (AsyncOpenRouter | None): Client of the asynchronous methods, which
+				run the synchronous ones on worker threads if None. Defaults to None.
 		"""
 		super().__init__(f"openrouter-{config.model}", True if stream_fn else False)
 		self.client = client
 		self.config = config
 		self.stream_fn = stream_fn
+		self.async_client = async_client
 
-	def ch_completion(self, messages: ChatHistory) -> Result[str, str]:
+	def _native_messages(self, messages: ChatHistory) -> List[Dict[str, Any]]:
+		# Anthropic and Gemini models need an explicit cache breakpoint, the other
+		# providers of OpenRouter cache the shared prefix of the prompts by themselves
+		if self.config.model.startswith(("anthropic/", "google/")):
+			return cacheable_messages(messages)
+
+		return messages.as_native()  # type: ignore
+
+	def _on_usage(self, usage: Dict[str, Any]):
+		self.record_usage(TokenUsage.from_openai(usage))
+
+	def ch_completion(
+		self, messages: ChatHistory, until: Callable[[str], bool] | None = None
+	) -> Result[str, str]:
 		"""
 		Generate a completion using the Claude API.
 
@@ -45,6 +62,8 @@ class OpenRouterGenner(Genner):
 
 		Args:
 			messages (ChatHistory): Chat history containing the conversation context
+			until (Callable[[str], bool] | None): Called with every token of the main content when streaming, the stream
+				being stopped as soon as it returns True, see `StreamingCodeExtractor`. Defaults to None.
 
 		Returns:
 			Ok(str): The generated text if successful
@@ -57,10 +76,11 @@ class OpenRouterGenner(Genner):
 				assert self.stream_fn is not None
 
 				stream_ = self.client.create_chat_completion_stream(
-					messages=messages.as_native(),
+					messages=self._native_messages(messages),
 					model=self.config.model,
 					max_tokens=self.config.max_tokens,
 					temperature=self.config.temperature,
+					on_usage=self._on_usage,
 				)
 
 				reasoning_entered = False
@@ -79,16 +99,21 @@ class OpenRouterGenner(Genner):
 
 					self.stream_fn(token)
 
+					if token_type == "main" and until is not None and until(token):
+						stream_.close()
+						break
+
 					token_counts += 1
 					if token_counts >= self.config.max_tokens:
 						break
 				self.stream_fn("\n")
 			else:
 				final_response = self.client.create_chat_completion(
-					messages=messages.as_native(),
+					messages=self._native_messages(messages),
 					model=self.config.model,
 					max_tokens=self.config.max_tokens,
 					temperature=self.config.temperature,
+					on_usage=self._on_usage,
 				)
 			assert isinstance(final_response, str)
 		except AssertionError as e:
@@ -102,6 +127,99 @@ class OpenRouterGenner(Genner):
 
 		return Ok(final_response)
 
+	async def ach_completion(self, messages: ChatHistory) -> Result[str, str]:
+		"""
+		Generate a completion asynchronously, without streaming, using the asynchronous OpenRouter client.
+
+		Args:
+			messages (ChatHistory): Chat history containing the conversation context
+
+		Returns:
+			Ok(str): The generated text if successful
+			Err(str): Error message if the API call fails
+		"""
+		if self.async_client is None:
+			return await super().ach_completion(messages)
+
+		try:
+			final_response = await self.async_client.create_chat_completion(
+				messages=self._native_messages(messages),
+				model=self.config.model,
+				max_tokens=self.config.max_tokens,
+				temperature=self.config.temperature,
+				on_usage=self._on_usage,
+			)
+		except Exception as e:
+			return Err(
+				f"OpenRouterGenner.{self.config.model}.ach_completion: An unexpected error while generating occurred: \n{e}"
+			)
+
+		return Ok(final_response)
+
+	async def agenerate_code(
+		self, messages: ChatHistory, blocks: List[str] = [""]
+	) -> Result[Tuple[List[str], str], str]:
+		"""
+		Generate code asynchronously, see `generate_code` and `ach_completion`.
+
+		Args:
+			messages (ChatHistory): Chat history containing the conversation context
+			blocks (List[str]): XML tag names to extract content from before processing into code
+
+		Returns:
+			Ok[processed_code, raw_response] | Err[error_message]
+		"""
+		if self.async_client is None:
+			return await super().agenerate_code(messages, blocks)
+
+		completion_result = await self.ach_completion(messages)
+		if err := completion_result.err():
+			return Err(
+				f"OpenrouterGenner.{self.config.name}.agenerate_code: completion_result.is_err(): \n{err}"
+			)
+
+		raw_response = completion_result.unwrap()
+		extract_code_result = self.extract_code(raw_response, blocks)
+		if extract_code_result.is_err():
+			return Ok((None, raw_response))  # type: ignore
+
+		return Ok((extract_code_result.unwrap(), raw_response))
+
+	async def agenerate_list(
+		self, messages: ChatHistory, blocks: List[str] = [""]
+	) -> Result[Tuple[List[List[str]], str], str]:
+		"""
+		Generate lists asynchronously, see `generate_list` and `ach_completion`.
+
+		Args:
+			messages (ChatHistory): Chat history containing the conversation context
+			blocks (List[str]): XML tag names to extract content from before processing into lists
+
+		Returns:
+			Result[Tuple[List[List[str]], str], str]:
+				Ok(Tuple[List[List[str]], str]): Tuple containing:
+					- List[List[str]]: Processed lists of items
+					- str: Raw response from the model
+				Err(str): Error message if generation failed
+		"""
+		if self.async_client is None:
+			return await super().agenerate_list(messages, blocks)
+
+		completion_result = await self.ach_completion(messages)
+		if err := completion_result.err():
+			return Err(
+				f"OpenRouterGenner.{self.config.name}.agenerate_list: completion_result.is_err(): \n{err}"
+			)
+
+		raw_response = completion_result.unwrap()
+		extract_list_result = self.extract_list(raw_response, blocks)
+		if err := extract_list_result.err():
+			return Err(
+				f"OpenRouterGenner.{self.config.name}.agenerate_list: extract_list_result.is_err(): \n{err}"
+			)
+
+		return Ok((extract_list_result.unwrap(), raw_response))
+
 	def generate_code(
 		self, messages: ChatHistory, blocks: List[str] = [""]
 	) -> Result[Tuple[List[str], str], str]:
@@ -122,7 +240,10 @@ class OpenRouterGenner(Genner):
 		raw_response = ""
 
 		try:
-			completion_result = self.ch_completion(messages)
+			code_watcher = StreamingCodeExtractor(
+				self.extract_code, blocks, cancel=self.cancel
+			)
+			completion_result = self.ch_completion(messages, until=code_watcher.feed)
 
 			if err := completion_result.err():
 				return (
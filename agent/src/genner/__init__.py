@@ -3,7 +3,7 @@ from typing import Callable
 from anthropic import Anthropic
 from openai import OpenAI
 
-from src.client.openrouter import OpenRouter
+from src.client.openrouter import AsyncOpenRouter, OpenRouter
 from src.config import (
 	ClaudeConfig,
 	DeepseekConfig,
@@ -54,6 +54,7 @@ def get_genner(
 	deepseek_local_client: OpenAI | None = None,
 	anthropic_client: Anthropic | None = None,
 	or_client: OpenRouter | None = None,
+	async_or_client: AsyncOpenRouter | None = None,
 	llama_client: OpenAI | None = None,
 	deepseek_config: DeepseekConfig = DeepseekConfig(),
 	claude_config: ClaudeConfig = ClaudeConfig(),
@@ -70,6 +71,7 @@ def get_genner(
 		deepseek_deepseek_client (OpenAI): OpenAI client but endpoint are pointed towards deepseek endpoint for deepseek-r1.
 		deepseek_or_client (OpenAI): OpenAI client but endpoint are pointed towards openrouter endpoint for deepseek-r1.
 		deepseek_local_client (OpenAI): OpenAI client but endpoint are pointed towards local endpoint for deepseek-r1.
+		async_or_client (AsyncOpenRouter): OpenRouter client of the asynchronous methods of the OpenRouter genners.
 		deepseek_config (DeepseekConfig, optional): The configuration for the Deepseek backend. Defaults to DeepseekConfig().
 		qwen_config (QwenConfig, optional): The configuration for the Qwen backend. Defaults to QwenConfig().
 
@@ -137,7 +139,7 @@ def get_genner(
 				stream_fn=stream_fn,
 			)
 
-		return OpenRouterGenner(or_client, openai_config, stream_fn)
+		return OpenRouterGenner(or_client, openai_config, stream_fn, async_or_client)
 	elif backend == "deepseek_v3_or":
 		deepseek_config.model = "deepseek/deepseek-chat"
 		deepseek_config.max_tokens = 32768
@@ -158,7 +160,7 @@ def get_genner(
 				"Using backend 'gemini', OpenRouter client is not provided."
 			)
 
-		return OpenRouterGenner(or_client, gemini_config, stream_fn)
+		return OpenRouterGenner(or_client, gemini_config, stream_fn, async_or_client)
 	elif backend == "llama":
 		llama_config.name = "NousResearch/Meta-Llama-3-8B"
 		llama_config.model = "NousResearch/Meta-Llama-3-8B"
@@ -174,7 +176,7 @@ def get_genner(
 		if not or_client:
 			raise Exception("Using backend 'qwq', OpenRouter client is not provided.")
 
-		return OpenRouterGenner(or_client, qwq_config, stream_fn)
+		return OpenRouterGenner(or_client, qwq_config, stream_fn, async_or_client)
 	elif backend == "mock":
 		return MockGenner()
 	raise BackendException(
@@ -0,0 +1,191 @@
+import ast
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Set
+
+# Calls that can never succeed in the executor or that would hang a run
+# until its timeout, e.g. waiting for a stdin that is never written to
+FORBIDDEN_CALLS = {
+	"input",
+	"breakpoint",
+	"pdb.set_trace",
+	"os.fork",
+	"os.kill",
+	"os.killpg",
+}
+
+# Exceptions that, when caught around an import, mean the code handles the module being missing
+_IMPORT_ERROR_NAMES = {
+	"ImportError",
+	"ModuleNotFoundError",
+	"Exception",
+	"BaseException",
+}
+
+# Run in the executor to list the top-level modules it can import
+LIST_MODULES_SCRIPT = """
+import importlib.metadata, json, pkgutil, sys
+names = {module.name for module in pkgutil.iter_modules()}
+names |= set(sys.builtin_module_names) | set(sys.stdlib_module_names)
+names |= set(importlib.metadata.packages_distributions())
+print(json.dumps(sorted(names)))
+"""
+
+
+@dataclass
+class PreflightError:
+	"""
+	Problem found in code before running it.
+
+	Attributes:
+	    kind (str): One of "syntax", "import" or "forbidden_call"
+	    message (str): Human readable description of the problem
+	    line (int | None): Line of the code the problem is on, if known
+	"""
+
+	kind: str
+	message: str
+	line: int | None = None
+
+	def __str__(self) -> str:
+		if self.line is None:
+			return f"[{self.kind}] {self.message}"
+
+		return f"[{self.kind}] line {self.line}: {self.message}"
+
+
+def _dotted_name(node: ast.expr) -> str | None:
+	if isinstance(node, ast.Name):
+		return node.id
+	if isinstance(node, ast.Attribute):
+		prefix = _dotted_name(node.value)
+		if prefix is not None:
+			return f"{prefix}.{node.attr}"
+
+	return None
+
+
+def _handles_import_error(node: ast.Try | ast.TryStar) -> bool:
+	for handler in node.handlers:
+		if handler.type is None:
+			return True
+
+		types = (
+			handler.type.elts if isinstance(handler.type, ast.Tuple) else [handler.type]
+		)
+		if any(_dotted_name(t) in _IMPORT_ERROR_NAMES for t in types):
+			return True
+
+	return False
+
+
+class _Checker(ast.NodeVisitor):
+	def __init__(self, installed_modules: Set[str] | None, forbidden_calls: Set[str]):
+		self.installed_modules = installed_modules
+		self.forbidden_calls = forbidden_calls
+		self.errors: List[PreflightError] = []
+		# Local name -> fully qualified name, e.g. `sp` -> `subprocess` or `kill` -> `os.kill`
+		self.aliases: Dict[str, str] = {}
+		self._guarded_depth = 0
+
+	def _check_module(self, module: str, line: int):
+		top_level = module.split(".")[0]
+		if (
+			self.installed_modules is None
+			or self._guarded_depth > 0
+			or top_level in self.installed_modules
+		):
+			return
+
+		self.errors.append(
+			PreflightError(
+				kind="import",
+				message=f"No module named '{top_level}' is installed in the executor",
+				line=line,
+			)
+		)
+
+	def visit_Try(self, node: ast.Try | ast.TryStar):
+		guarded = _handles_import_error(node)
+
+		self._guarded_depth += guarded
+		for statement in node.body:
+			self.visit(statement)
+		self._guarded_depth -= guarded
+
+		for statement in [*node.handlers, *node.orelse, *node.finalbody]:
+			self.visit(statement)
+
+	# `try: ... except* ImportError: ...` guards its imports the same way
+	visit_TryStar = visit_Try
+
+	def visit_Import(self, node: ast.Import):
+		for alias in node.names:
+			self._check_module(alias.name, node.lineno)
+			if alias.asname is not None:
+				self.aliases[alias.asname] = alias.name
+			else:
+				top_level = alias.name.split(".")[0]
+				self.aliases[top_level] = top_level
+
+	def visit_ImportFrom(self, node: ast.ImportFrom):
+		if node.level > 0 or node.module is None:
+			return
+
+		self._check_module(node.module, node.lineno)
+		for alias in node.names:
+			self.aliases[alias.asname or alias.name] = f"{node.module}.{alias.name}"
+
+	def visit_Call(self, node: ast.Call):
+		name = _dotted_name(node.func)
+		if name is not None:
+			head, _, rest = name.partition(".")
+			resolved = self.aliases.get(head, head)
+			qualified = f"{resolved}.{rest}" if rest else resolved
+
+			if qualified in self.forbidden_calls:
+				self.errors.append(
+					PreflightError(
+						kind="forbidden_call",
+						message=f"Calling `{qualified}` is not allowed in generated code",
+						line=node.lineno,
+					)
+				)
+
+		self.generic_visit(node)
+
+
+def check_code(
+	code: str,
+	installed_modules: Iterable[str] | None = None,
+	forbidden_calls: Iterable[str] = FORBIDDEN_CALLS,
+) -> List[PreflightError]:
+	"""
+	Statically check code before sending it to the executor.
+
+	The code is parsed, its imports are resolved against the modules installed
+	in the executor and its calls are scanned for forbidden functions. Imports
+	inside a `try` that catches `ImportError` are not checked, as the code
+	handles them being missing.
+
+	Args:
+	    code (str): The Python code to check
+	    installed_modules (Iterable[str] | None, optional): Top-level modules importable in the executor. Defaults to None, which skips the import check.
+	    forbidden_calls (Iterable[str], optional): Fully qualified names of the functions that must not be called. Defaults to FORBIDDEN_CALLS.
+
+	Returns:
+	    List[PreflightError]: The problems found, empty if the code looks runnable
+	"""
+	try:
+		tree = ast.parse(code)
+	except SyntaxError as e:
+		return [PreflightError(kind="syntax", message=str(e.msg), line=e.lineno)]
+
+	checker = _Checker(
+		installed_modules=set(installed_modules)
+		if installed_modules is not None
+		else None,
+		forbidden_calls=set(forbidden_calls),
+	)
+	checker.visit(tree)
+
+	return checker.errors
@@ -0,0 +1,257 @@
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, List
+
+from loguru import logger
+
+from src.db import DBInterface
+
+DEFAULT_SESSION_INTERVAL_SECONDS = 900
+
+
+@dataclass
+class ScheduledSession:
+	"""
+	Agent session hosted by the scheduler.
+
+	Attributes:
+	    session_id (str): ID of the session
+	    agent_id (str): ID of the agent of the session
+	    cycle (Callable[[], None]): Runs one cycle of the agent, reusing its objects between calls
+	    interval_seconds (float): Time waited between the end of a cycle and the start of the next one
+	    db (DBInterface | None): Database the session is read from before every cycle, to pick up its status and interval
+	    fixed_interval (bool): Whether `interval_seconds` was given explicitly, in which case the database does not override it
+	    max_cycles (int | None): Number of cycles after which the session is done, None to run until it is stopped
+	    cycles (int): Number of cycles run so far
+	    next_run_at (float): Monotonic time at which the next cycle is due
+	    running (bool): Whether a cycle of the session is running
+	"""
+
+	session_id: str
+	agent_id: str
+	cycle: Callable[[], None]
+	interval_seconds: float
+	db: DBInterface | None = None
+	fixed_interval: bool = False
+	max_cycles: int | None = None
+	cycles: int = 0
+	next_run_at: float = 0.0
+	running: bool = False
+
+
+class SessionScheduler:
+	"""
+	Long-running scheduler hosting many agent sessions in one process.
+
+	Every session runs its cycles on its own interval, taken by default from
+	the `session_interval` column of `sup_agent_sessions`. Cycles run on a
+	bounded worker pool and a session never runs two cycles at once. A session
+	whose status becomes "stopping" or "stopped" is removed before its next
+	cycle, and `stop` (also called on SIGINT and SIGTERM) lets the running
+	cycles finish without starting new ones.
+
+	    >>> scheduler = SessionScheduler(max_workers=8)
+	    >>> scheduler.add_session("session", "agent", cycle_fn, db=db)
+	    >>> scheduler.run()
+	"""
+
+	def __init__(
+		self,
+		max_workers: int = 4,
+		default_interval_seconds: float = DEFAULT_SESSION_INTERVAL_SECONDS,
+	):
+		"""
+		Initialize the scheduler.
+
+		Args:
+		    max_workers (int, optional): Maximum number of cycles running at once. Defaults to 4.
+		    default_interval_seconds (float, optional): Interval of the sessions without one in the database. Defaults to 900.
+		"""
+		self.max_workers = max_workers
+		self.default_interval_seconds = default_interval_seconds
+		self.sessions: Dict[str, ScheduledSession] = {}
+
+		self._condition = threading.Condition()
+		self._stopping = False
+
+	def add_session(
+		self,
+		session_id: str,
+		agent_id: str,
+		cycle: Callable[[], None],
+		db: DBInterface | None = None,
+		interval_seconds: float | None = None,
+		max_cycles: int | None = None,
+	):
+		"""
+		Host a session, its first cycle being due right away.
+
+		Args:
+		    session_id (str): ID of the session
+		    agent_id (str): ID of the agent of the session
+		    cycle (Callable[[], None]): Runs one cycle of the agent
+		    db (DBInterface | None, optional): Database to read the status and interval of the session from. Defaults to None.
+		    interval_seconds (float | None, optional): Interval between cycles. Defaults to None, which uses the `session_interval` of the session in `db`.
+		    max_cycles (int | None, optional): Number of cycles to run. Defaults to None, which runs until the session is stopped.
+		"""
+		session = ScheduledSession(
+			session_id=session_id,
+			agent_id=agent_id,
+			cycle=cycle,
+			interval_seconds=interval_seconds
+			if interval_seconds is not None
+			else self.default_interval_seconds,
+			db=db,
+			fixed_interval=interval_seconds is not None,
+			max_cycles=max_cycles,
+			next_run_at=time.monotonic(),
+		)
+
+		with self._condition:
+			self.sessions[session_id] = session
+			self._condition.notify_all()
+
+		logger.info(f"Scheduled session {session_id} of agent {agent_id}")
+
+	def remove_session(self, session_id: str):
+		"""
+		Stop hosting a session. Its running cycle, if any, is left to finish.
+
+		Args:
+		    session_id (str): ID of the session
+		"""
+		with self._condition:
+			if self.sessions.pop(session_id, None) is not None:
+				logger.info(f"Removed session {session_id} from the scheduler")
+			self._condition.notify_all()
+
+	def stop(self):
+		"""
+		Stop starting new cycles. `run` returns once the running cycles have finished.
+		"""
+		with self._condition:
+			if not self._stopping:
+				logger.info("Stopping the scheduler, waiting for the running cycles...")
+			self._stopping = True
+			self._condition.notify_all()
+
+	def install_signal_handlers(self):
+		"""
+		Stop the scheduler gracefully on SIGINT and SIGTERM.
+
+		Must be called from the main thread.
+		"""
+
+		def handler(signum, frame):
+			self.stop()
+
+		signal.signal(signal.SIGINT, handler)
+		signal.signal(signal.SIGTERM, handler)
+
+	def run(self):
+		"""
+		Run the cycles of the sessions as they become due, until the scheduler is stopped or no session is left.
+		"""
+		executor = ThreadPoolExecutor(
+			max_workers=self.max_workers, thread_name_prefix="agent-session"
+		)
+
+		try:
+			with self._condition:
+				while not self._stopping:
+					if not self.sessions:
+						logger.info("No session left to run")
+						break
+
+					now = time.monotonic()
+					due: List[ScheduledSession] = [
+						session
+						for session in self.sessions.values()
+						if not session.running and session.next_run_at <= now
+					]
+					for session in due:
+						session.running = True
+						executor.submit(self._run_cycle, session)
+
+					idle = [
+						session
+						for session in self.sessions.values()
+						if not session.running
+					]
+					timeout = (
+						max(0.0, min(session.next_run_at for session in idle) - now)
+						if idle
+						else None
+					)
+					self._condition.wait(timeout=timeout)
+		finally:
+			executor.shutdown(wait=True)
+
+		logger.info("Scheduler stopped")
+
+	def _refresh(self, session: ScheduledSession) -> bool:
+		# Picks up the status and interval of the session, returning whether it should keep running
+		if session.db is None:
+			return True
+
+		try:
+			row = session.db.get_agent_session(session.session_id)
+		except Exception as e:
+			logger.warning(
+				f"Failed fetching session {session.session_id}, keeping its settings, err: \n{e}"
+			)
+			return True
+
+		if row is None:
+			return True
+
+		status = row.get("status")
+		if status in ("stopping", "stopped"):
+			logger.info(
+				f"Session {session.session_id} is {status}, not running it anymore"
+			)
+			if status == "stopping":
+				session.db.update_agent_session(
+					session.session_id, session.agent_id, "stopped"
+				)
+			return False
+
+		if not session.fixed_interval and row.get("session_interval"):
+			session.interval_seconds = float(row["session_interval"])
+
+		return True
+
+	def _run_cycle(self, session: ScheduledSession):
+		keep = self._refresh(session)
+
+		if keep:
+			logger.info(
+				f"Starting cycle {session.cycles + 1} of session {session.session_id}"
+			)
+			try:
+				session.cycle()
+			except Exception as e:
+				logger.exception(
+					f"Cycle {session.cycles + 1} of session {session.session_id} failed, err: \n{e}"
+				)
+			session.cycles += 1
+
+		if session.max_cycles is not None and session.cycles >= session.max_cycles:
+			logger.info(
+				f"Session {session.session_id} ran its {session.cycles} cycle(s)"
+			)
+			keep = False
+
+		with self._condition:
+			session.running = False
+			if not keep:
+				self.sessions.pop(session.session_id, None)
+			elif not self._stopping:
+				session.next_run_at = time.monotonic() + session.interval_seconds
+				logger.info(
+					f"Waiting for {session.interval_seconds:.0f} seconds before starting a new cycle of session {session.session_id}..."
+				)
+			self._condition.notify_all()
@@ -1,10 +1,38 @@
 from functools import partial
-from typing import Callable, List, Optional
+from typing import Awaitable, Callable, List, Optional
 
 from src.genner.Base import Genner
 from src.types import ChatHistory, Message
 
 
+def _summary_chat_history(talking_points: List[str], template: str) -> ChatHistory:
+	# Validates the talking points and builds the summarization prompt
+	if not talking_points:
+		raise ValueError("talking_points cannot be empty")
+
+	if not all(isinstance(point, str) for point in talking_points):
+		raise ValueError("All talking points must be strings")
+
+	# Format talking points with bullet points for better readability
+	talking_points_formatted = "\n• " + "\n• ".join(
+		point.strip() for point in talking_points if point.strip()
+	)
+
+	# Create the chat history with the formatted prompt
+	return ChatHistory(
+		[
+			Message(
+				role="system",
+				content=template,
+			),
+			Message(
+				role="user",
+				content=talking_points_formatted,
+			),
+		]
+	)
+
+
 def summarize(
 	genner: "Genner",
 	talking_points: List[str],
@@ -27,35 +55,52 @@ def summarize(
 	    SummarizerError: If the summarization fails after max_retries attempts
 	    ValueError: If talking_points is empty or contains invalid data
 	"""
-	if not talking_points:
-		raise ValueError("talking_points cannot be empty")
+	chat_history = _summary_chat_history(talking_points, template)
 
-	if not all(isinstance(point, str) for point in talking_points):
-		raise ValueError("All talking points must be strings")
+	# Attempt generation with retries
+	for attempt in range(max_retries):
+		try:
+			response = genner.ch_completion(chat_history).unwrap()
+			if response and isinstance(response, str):
+				return response.strip()
+		except Exception as e:
+			if attempt == max_retries - 1:
+				raise Exception(
+					f"Failed to generate summary after {max_retries} attempts"
+				) from e
+			continue
 
-	# Format talking points with bullet points for better readability
-	talking_points_formatted = "\n• " + "\n• ".join(
-		point.strip() for point in talking_points if point.strip()
-	)
+	raise Exception("Failed to generate valid summary")
 
-	# Create the chat history with the formatted prompt
-	chat_history = ChatHistory(
-		[
-			Message(
-				role="system",
-				content=template,
-			),
-			Message(
-				role="user",
-				content=talking_points_formatted,
-			),
-		]
-	)
+
+async def asummarize(
+	genner: "Genner",
+	talking_points: List[str],
+	template: str = "You are a summarizer agent. You are to summarize anything below in 1 single sentence or more.",
+	max_retries: int = 3,
+) -> str:
+	"""
+	Asynchronous `summarize`, generating with `Genner.ach_completion` so several summaries can be generated concurrently.
+
+	Args:
+	    genner: An instance of the Genner class that handles text generation
+	    talking_points: A list of strings containing the points to be summarized
+	    template: Optional template string for formatting the prompt
+	    max_retries: Maximum number of retry attempts for failed generations
+
+	Returns:
+	    str: A summarized version of the input talking points
+
+	Raises:
+	    SummarizerError: If the summarization fails after max_retries attempts
+	    ValueError: If talking_points is empty or contains invalid data
+	"""
+	chat_history = _summary_chat_history(talking_points, template)
 
 	# Attempt generation with retries
 	for attempt in range(max_retries):
 		try:
-			response = genner.ch_completion(chat_history).unwrap()
+			response = (await genner.ach_completion(chat_history)).unwrap()
 			if response and isinstance(response, str):
 				return response.strip()
 		except Exception as e:
@@ -95,3 +140,32 @@ def get_summarizer(
 		else "Please summarize the following points:\n{to_summarize}",
 		max_retries=max_retries,
 	)
+
+
+def get_async_summarizer(
+	genner: "Genner", custom_template: Optional[str] = None, max_retries: int = 3
+) -> Callable[[List[str]], Awaitable[str]]:
+	"""
+	Create a partial function for asynchronous summarization, the counterpart of `get_summarizer`.
+
+	Args:
+	    genner: An instance of the Genner class
+	    custom_template: Optional custom template for the summary prompt
+	    max_retries: Maximum number of retry attempts for failed generations
+
+	Returns:
+	    Callable: A function that takes a list of strings and returns an awaitable summary
+
+	Example:
+	    >>> summarizer = get_async_summarizer(genner)
+	    >>> summaries = run_concurrently(summarizer(["Point 1"]), summarizer(["Point 2"]))
+	"""
+
+	return partial(
+		asummarize,
+		genner,
+		template=custom_template
+		if custom_template
+		else "Please summarize the following points:\n{to_summarize}",
+		max_retries=max_retries,
+	)
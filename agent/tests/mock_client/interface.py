@@ -77,6 +77,21 @@ class RAGInterface:
 		"""
 		...
 
+	def relevant_strategy_raw_v4_batch(
+		self, queries: List[str], top_k: int = 1
+	) -> List[List[Tuple[StrategyData, float]]]:
+		"""
+		Retrieve strategies relevant to each of the given queries in a single request.
+
+		Args:
+		    queries (List[str]): The search queries to find relevant strategies for
+		    top_k (int): Number of strategies to retrieve per query
+
+		Returns:
+		    List[List[Tuple[StrategyData, float]]]: Relevant strategy data objects and their distances, per query
+		"""
+		...
+
 	def relevant_strategy_raw(self, query: str) -> List[StrategyData]:
 		"""
 		Retrieve a list of relevant strategies for a given query.
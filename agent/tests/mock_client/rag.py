@@ -128,3 +128,14 @@ class MockRAGClient:
 				0.89,
 			)
 		]
+
+	def relevant_strategy_raw_v4_batch(
+		self, queries: List[str], top_k: int = 1
+	) -> List[List[Tuple[StrategyData, float]]]:
+		logger.info(
+			f"Mock relevant_strategy_raw_v4_batch called with {len(queries)} queries"
+		)
+		return [
+			self.relevant_strategy_raw_v4(query) if query.strip() else []
+			for query in queries
+		]
@@ -1,5 +1,5 @@
 from result import Ok
-from typing import List, Tuple
+from typing import Callable, List, Tuple
 from src.types import ChatHistory
 from src.genner import Genner  # adjust this import if necessary
 from result import Result
@@ -9,10 +9,25 @@ class MockGenner(Genner):
 	def __init__(self, identifier: str = "mock", do_stream: bool = False):
 		super().__init__(identifier, do_stream)
 
-	def ch_completion(self, messages: ChatHistory) -> Result[str, str]:
+	def ch_completion(
+		self, messages: ChatHistory, until: Callable[[str], bool] | None = None
+	) -> Result[str, str]:
 		mock_response = "This is a mocked completion response."
 		return Ok(mock_response)
 
+	async def ach_completion(self, messages: ChatHistory) -> Result[str, str]:
+		return self.ch_completion(messages)
+
+	async def agenerate_code(
+		self, messages: ChatHistory, blocks: List[str] = [""]
+	) -> Result[Tuple[List[str], str], str]:
+		return self.generate_code(messages, blocks)
+
+	async def agenerate_list(
+		self, messages: ChatHistory, blocks: List[str] = [""]
+	) -> Result[Tuple[List[List[str]], str], str]:
+		return self.generate_list(messages, blocks)
+
 	def generate_code(
 		self, messages: ChatHistory, blocks: List[str] = [""]
 	) -> Result[Tuple[List[str], str], str]:
@@ -0,0 +1,41 @@
+import time
+
+from src.code_archive import CodeArchive
+
+
+def test_archive_rotates_the_oldest_scripts_over_budget(tmp_path):
+	archive = CodeArchive(tmp_path, max_bytes=250, compress=False)
+	# 100 bytes each, of which only the two most recent fit in the budget
+	entries = [
+		archive.add(f"print({i})\n" + "#" * 91, "trader_research_code")
+		for i in range(4)
+	]
+
+	assert archive.read(entries[0].code_id) is None
+	assert archive.read(entries[1].code_id) is None
+	assert archive.read(entries[3].code_id) is not None
+	assert [entry.code_id for entry in archive.find()] == [
+		entries[3].code_id,
+		entries[2].code_id,
+	]
+	assert archive._total_bytes == 200
+	archive.close()
+
+	reopened = CodeArchive(tmp_path, max_bytes=250, compress=False)
+	assert reopened._total_bytes == 200
+	reopened.close()
+
+
+def test_archive_removes_expired_scripts_and_their_empty_folders(tmp_path, monkeypatch):
+	archive = CodeArchive(tmp_path, max_age_seconds=3600)
+
+	now = time.time()
+	monkeypatch.setattr("src.code_archive.time.time", lambda: now - 3 * 24 * 3600)
+	expired = archive.add("print('old')", "trader_research_code")
+	monkeypatch.setattr("src.code_archive.time.time", lambda: now)
+	latest = archive.add("print('new')", "trader_research_code")
+
+	assert archive.read(expired.code_id) is None
+	assert not (tmp_path / expired.path).parent.exists()
+	assert archive.read(latest.code_id) == "print('new')"
+	archive.close()
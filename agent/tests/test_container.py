@@ -0,0 +1,326 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import docker.errors
+import pytest
+
+from src.container import (
+	ContainerManager,
+	ContainerPool,
+	ExecutionResultCache,
+	OutputBuffer,
+)
+
+
+class FakeContainer:
+	def __init__(self, name: str):
+		self.name = name
+		self.status = "created"
+		self.removed = False
+
+	def start(self):
+		self.status = "running"
+
+	def reload(self):
+		pass
+
+	def exec_run(self, cmd):
+		return SimpleNamespace(exit_code=0 if self.status == "running" else 1)
+
+	def remove(self, force: bool = False):
+		self.removed = True
+
+
+class FakeContainers:
+	def __init__(self):
+		self.created = []
+		self.by_name = {}
+
+	def create(self, image, name, **kwargs):
+		container = FakeContainer(name)
+		self.created.append(container)
+		self.by_name[name] = container
+		return container
+
+	def get(self, name):
+		if name not in self.by_name:
+			raise docker.errors.NotFound(f"No such container: {name}")
+		return self.by_name[name]
+
+
+class FakeDockerClient:
+	def __init__(self):
+		self.containers = FakeContainers()
+
+
+class FakeExecApi:
+	"""Low-level API streaming `chunks` as the output of a run, until the run is killed."""
+
+	def __init__(self, chunks, exit_code: int = 0, hang: bool = False):
+		self.chunks = chunks
+		self.exit_code = exit_code
+		self.hang = hang
+		self.killed = threading.Event()
+
+	def exec_create(self, container_id, cmd, environment=None):
+		return {"Id": "exec-id"}
+
+	def exec_start(self, exec_id, stream: bool = False, demux: bool = False):
+		for chunk in self.chunks:
+			if self.killed.is_set():
+				return
+			yield chunk, None
+		if self.hang:
+			self.killed.wait(timeout=5)
+
+	def exec_inspect(self, exec_id):
+		return {"ExitCode": 137 if self.killed.is_set() else self.exit_code}
+
+
+class FakeExecContainer:
+	def __init__(self, api: FakeExecApi):
+		self.id = "exec-container-id"
+		self.name = "exec-container"
+		self.client = SimpleNamespace(api=api)
+		self.kill_commands = []
+
+	def put_archive(self, path, data):
+		return True
+
+	def exec_run(self, cmd):
+		# Only `_kill_run` execs outside of the low-level API
+		self.kill_commands.append(cmd)
+		self.client.api.killed.set()
+		return SimpleNamespace(exit_code=0, output=b"")
+
+
+class FakePool:
+	def __init__(self, container: FakeExecContainer):
+		self.container = container
+		self.recycled = []
+
+	def checkout(self, timeout=None):
+		return self.container
+
+	def release(self, container, recycle: bool = False):
+		self.recycled.append(recycle)
+
+
+def make_manager(tmp_path, container: FakeExecContainer, **kwargs) -> ContainerManager:
+	return ContainerManager(
+		client=None,  # type: ignore
+		container_identifier="unused",
+		host_cache_folder=tmp_path,
+		in_con_env={},
+		pool=FakePool(container),  # type: ignore
+		preflight=False,
+		**kwargs,
+	)
+
+
+def test_result_cache_entries_expire(monkeypatch):
+	now = [1000.0]
+	monkeypatch.setattr("src.container.time.monotonic", lambda: now[0])
+
+	cache = ExecutionResultCache(ttl_seconds=60)
+	key = ExecutionResultCache.key("print(1)", {"A": "1"}, "trader_research_code")
+	cache.put(key, "1\n")
+
+	now[0] += 59
+	assert cache.get(key) == "1\n"
+
+	now[0] += 2
+	assert cache.get(key) is None
+
+
+def test_result_cache_evicts_the_least_recently_used_entry():
+	cache = ExecutionResultCache(ttl_seconds=60, max_entries=2)
+	cache.put("a", "output a")
+	cache.put("b", "output b")
+
+	assert cache.get("a") == "output a"
+	cache.put("c", "output c")
+
+	assert cache.get("b") is None
+	assert cache.get("a") == "output a"
+	assert cache.get("c") == "output c"
+
+
+def test_result_cache_keys_depend_on_code_environment_and_postfix():
+	key = ExecutionResultCache.key(
+		"print(1)", {"A": "1", "B": "2"}, "trader_research_code"
+	)
+
+	assert key == ExecutionResultCache.key(
+		"print(1)", {"B": "2", "A": "1"}, "trader_research_code"
+	)
+	assert key != ExecutionResultCache.key(
+		"print(2)", {"A": "1", "B": "2"}, "trader_research_code"
+	)
+	assert key != ExecutionResultCache.key(
+		"print(1)", {"A": "1"}, "trader_research_code"
+	)
+	assert key != ExecutionResultCache.key(
+		"print(1)", {"A": "1", "B": "2"}, "trader_address_research"
+	)
+
+
+def test_pool_checks_out_idle_containers_and_takes_them_back():
+	client = FakeDockerClient()
+	pool = ContainerPool(client, size=2, name_prefix="test-pool")  # type: ignore
+
+	first = pool.checkout()
+	second = pool.checkout()
+	assert {first.name, second.name} == {"test-pool-0", "test-pool-1"}
+	with pytest.raises(TimeoutError):
+		pool.checkout(timeout=0.01)
+
+	pool.release(first)
+	assert pool.checkout(timeout=0.01) is first
+	assert len(client.containers.created) == 2
+
+
+def test_pool_recycles_a_container_after_max_runs():
+	client = FakeDockerClient()
+	pool = ContainerPool(client, size=1, max_runs=2, name_prefix="test-pool")  # type: ignore
+	original = pool.checkout()
+
+	pool.release(original)
+	assert pool.checkout() is original
+
+	pool.release(original)
+	replacement = pool.checkout()
+	assert replacement is not original
+	assert replacement.name == original.name
+	assert original.removed
+
+
+def test_pool_recycles_a_container_whose_run_did_not_finish_cleanly():
+	client = FakeDockerClient()
+	pool = ContainerPool(client, size=1, name_prefix="test-pool")  # type: ignore
+	original = pool.checkout()
+
+	pool.release(original, recycle=True)
+
+	assert pool.checkout() is not original
+	assert original.removed
+
+
+def test_pool_replaces_a_dead_container_on_checkout():
+	client = FakeDockerClient()
+	pool = ContainerPool(client, size=1, name_prefix="test-pool")  # type: ignore
+	original = pool.checkout()
+	pool.release(original)
+
+	original.status = "exited"
+	replacement = pool.checkout()
+
+	assert replacement is not original
+	assert replacement.status == "running"
+	assert original.removed
+
+
+def test_output_buffer_keeps_the_head_and_the_tail():
+	buffer = OutputBuffer(head_bytes=4, tail_bytes=4)
+	for i in range(100):
+		buffer.write(f"{i % 10}".encode())
+
+	assert buffer.total_bytes == 100
+	assert buffer.getvalue() == "0123\n... [92 bytes of output truncated] ...\n6789"
+
+
+def test_output_buffer_is_not_truncated_when_it_fits():
+	buffer = OutputBuffer(head_bytes=4, tail_bytes=4)
+	buffer.write(b"abc")
+	buffer.write(b"defgh")
+
+	assert buffer.getvalue() == "abcdefgh"
+
+
+def test_run_output_is_streamed_and_truncated(tmp_path):
+	api = FakeExecApi([b"x" * 50, b"middle", b"y" * 50])
+	streamed = []
+	manager = make_manager(
+		tmp_path,
+		FakeExecContainer(api),
+		stream_fn=streamed.append,
+		max_output_bytes=20,
+	)
+
+	result, stats = manager.run_code_in_con_with_stats(
+		"print('x')", "trader_research_code"
+	)
+
+	output, _ = result.unwrap()
+	assert "".join(streamed) == "x" * 50 + "middle" + "y" * 50
+	assert output == "x" * 10 + "\n... [86 bytes of output truncated] ...\n" + "y" * 10
+	assert stats.output_bytes == 106
+	assert stats.exit_code == 0
+
+
+def test_run_stops_early_on_a_fatal_pattern(tmp_path):
+	api = FakeExecApi(
+		[b"starting\n", b"Error: Insufficient fu", b"nds\n", b"never printed\n"]
+	)
+	container = FakeExecContainer(api)
+	manager = make_manager(
+		tmp_path,
+		container,
+		stream_fn=lambda text: None,
+		fatal_patterns=[r"Insufficient funds"],
+	)
+
+	result, stats = manager.run_code_in_con_with_stats(
+		"print('x')", "trader_trading_code"
+	)
+
+	assert result.is_err()
+	assert "stopped on fatal output `Insufficient funds`" in result.unwrap_err()
+	assert "never printed" not in result.unwrap_err()
+	assert len(container.kill_commands) == 1
+	assert not stats.timed_out
+	# The run was stopped on purpose, the container is still in a known state
+	assert manager.pool.recycled == [False]  # type: ignore
+
+
+def test_watchdog_kills_the_process_group_of_a_run_that_hangs(tmp_path):
+	api = FakeExecApi([b"working\n"], hang=True)
+	container = FakeExecContainer(api)
+	manager = make_manager(
+		tmp_path, container, stream_fn=lambda text: None, timeout_seconds=0.05
+	)
+
+	result, stats = manager.run_code_in_con_with_stats(
+		"while True: pass", "trader_research_code"
+	)
+
+	assert stats.timed_out
+	assert stats.elapsed_seconds < 5
+	assert result.is_err()
+	assert "Execution timed out" in result.unwrap_err()
+	assert "working" in result.unwrap_err()
+	# Only the process group of this run is killed, through its pid file
+	(kill_command,) = container.kill_commands
+	assert "kill -9 -$(cat /tmp/temp_script_" in kill_command[-1]
+	# The run was interrupted at an unknown point, so its container is replaced
+	assert manager.pool.recycled == [True]  # type: ignore
+
+
+def test_watchdog_is_cancelled_when_the_run_finishes(tmp_path):
+	api = FakeExecApi([b"done\n"])
+	container = FakeExecContainer(api)
+	manager = make_manager(
+		tmp_path, container, stream_fn=lambda text: None, timeout_seconds=0.05
+	)
+
+	result, stats = manager.run_code_in_con_with_stats(
+		"print('done')", "trader_research_code"
+	)
+	# Give a watchdog that was left running the time to fire
+	time.sleep(0.1)
+
+	assert result.unwrap()[0] == "done\n"
+	assert not stats.timed_out
+	assert container.kill_commands == []
+	assert manager.pool.recycled == [False]  # type: ignore
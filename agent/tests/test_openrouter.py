@@ -0,0 +1,106 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+
+from src.client.openrouter import AsyncOpenRouter, retry_delay
+
+
+def test_retry_delay_draws_up_to_an_exponential_cap(monkeypatch):
+	bounds = []
+	monkeypatch.setattr(
+		"src.client.openrouter.random.uniform",
+		lambda low, high: bounds.append((low, high)) or high,
+	)
+
+	delays = [retry_delay(attempt, max_seconds=30.0) for attempt in range(7)]
+
+	assert bounds == [
+		(0, 1.0),
+		(0, 2.0),
+		(0, 4.0),
+		(0, 8.0),
+		(0, 16.0),
+		(0, 30.0),
+		(0, 30.0),
+	]
+	assert delays == [high for _, high in bounds]
+
+
+def test_retry_delay_is_jittered():
+	delays = {retry_delay(3) for _ in range(50)}
+
+	assert all(0 <= delay <= 8.0 for delay in delays)
+	assert len(delays) > 1
+
+
+def test_retry_delay_honours_retry_after():
+	assert retry_delay(0, retry_after="12") == 12.0
+	assert retry_delay(5, retry_after="0") == 0.0
+	assert retry_delay(0, retry_after="120", max_seconds=30.0) == 30.0
+
+	retry_at = datetime.now(timezone.utc) + timedelta(seconds=20)
+	delay = retry_delay(0, retry_after=format_datetime(retry_at, usegmt=True))
+	assert 18.0 <= delay <= 20.0
+
+	retry_at = datetime.now(timezone.utc) - timedelta(seconds=20)
+	assert retry_delay(0, retry_after=format_datetime(retry_at, usegmt=True)) == 0.0
+
+	# An unreadable header falls back to the backoff
+	assert 0 <= retry_delay(0, retry_after="soon") <= 1.0
+
+
+@pytest.fixture
+def client():
+	return AsyncOpenRouter(api_key="key", providers=["DeepSeek", "Together"])
+
+
+def test_parse_stream_line_reads_tokens_and_usage(client):
+	usages = []
+
+	assert client._parse_stream_line(
+		'data: {"choices": [{"delta": {"content": "Hello"}}]}', usages.append
+	) == (False, ("Hello", "main"))
+	assert client._parse_stream_line(
+		'data: {"choices": [{"delta": {"reasoning": "Think</s>"}}]}', usages.append
+	) == (False, ("Think", "reasoning"))
+	assert client._parse_stream_line(
+		'data: {"choices": [], "usage": {"prompt_tokens": 3}}', usages.append
+	) == (False, None)
+	assert usages == [{"prompt_tokens": 3}]
+
+
+def test_parse_stream_line_skips_comments_and_stops_on_done(client):
+	assert client._parse_stream_line(": OPENROUTER PROCESSING") == (False, None)
+	assert client._parse_stream_line("") == (False, None)
+	assert client._parse_stream_line("data: {not json") == (False, None)
+	assert client._parse_stream_line("data: [DONE]") == (True, None)
+
+
+def test_parse_stream_line_drops_reasoning_when_not_included():
+	client = AsyncOpenRouter(api_key="key", include_reasoning=False)
+
+	assert client._parse_stream_line(
+		'data: {"choices": [{"delta": {"reasoning": "Think"}}]}'
+	) == (False, None)
+
+
+def test_requests_are_bounded_per_requested_provider(client):
+	async def semaphores():
+		default = client._prepare_payload(messages=[])
+		requested = client._prepare_payload(messages=[], providers=["Fireworks"])
+		assert requested["provider"] == {"order": ["Fireworks"]}
+
+		return (
+			client._semaphore(default),
+			client._semaphore(requested),
+			client._semaphore(
+				client._prepare_payload(messages=[], providers=["Fireworks"])
+			),
+		)
+
+	default, requested, requested_again = asyncio.run(semaphores())
+
+	assert default is not requested
+	assert requested is requested_again
@@ -0,0 +1,81 @@
+from src.preflight import check_code
+
+INSTALLED_MODULES = {"os", "json", "pdb", "subprocess", "requests"}
+
+
+def test_syntax_error_is_reported_with_its_line():
+	errors = check_code("import json\n\ndef main(:\n\tpass\n", INSTALLED_MODULES)
+
+	assert len(errors) == 1
+	assert errors[0].kind == "syntax"
+	assert errors[0].line == 3
+
+
+def test_missing_import_is_reported():
+	code = "import json\nimport web3.auto\nfrom pandas import DataFrame\n"
+
+	errors = check_code(code, INSTALLED_MODULES)
+
+	assert [(error.kind, error.line) for error in errors] == [
+		("import", 2),
+		("import", 3),
+	]
+	assert "'web3'" in errors[0].message
+	assert "'pandas'" in errors[1].message
+
+
+def test_imports_are_not_checked_without_installed_modules():
+	assert check_code("import web3\n") == []
+
+
+def test_import_guarded_by_import_error_is_not_reported():
+	code = (
+		"try:\n"
+		"\timport web3\n"
+		"except ImportError:\n"
+		"\tweb3 = None\n"
+		"try:\n"
+		"\tfrom pandas import DataFrame\n"
+		"except (ValueError, ModuleNotFoundError):\n"
+		"\tDataFrame = None\n"
+	)
+
+	assert check_code(code, INSTALLED_MODULES) == []
+
+
+def test_import_in_a_try_that_does_not_catch_import_error_is_reported():
+	code = "try:\n\timport web3\nexcept ValueError:\n\tpass\n"
+
+	errors = check_code(code, INSTALLED_MODULES)
+
+	assert [(error.kind, error.line) for error in errors] == [("import", 2)]
+
+
+def test_forbidden_calls_are_found_through_aliases():
+	code = (
+		"import os as operating_system\n"
+		"from os import kill as stop\n"
+		"from pdb import set_trace\n"
+		"operating_system.fork()\n"
+		"stop(1, 9)\n"
+		"set_trace()\n"
+		"value = input()\n"
+	)
+
+	errors = check_code(code, INSTALLED_MODULES)
+
+	assert [(error.kind, error.line) for error in errors] == [
+		("forbidden_call", 4),
+		("forbidden_call", 5),
+		("forbidden_call", 6),
+		("forbidden_call", 7),
+	]
+	assert "`os.fork`" in errors[0].message
+	assert "`os.kill`" in errors[1].message
+	assert "`pdb.set_trace`" in errors[2].message
+
+
+def test_allowed_calls_are_not_reported():
+	code = "import os\nimport subprocess as sp\nos.getenv('HOME')\nsp.run(['ls'])\n"
+
+	assert check_code(code, INSTALLED_MODULES) == []
@@ -0,0 +1,129 @@
+import threading
+from typing import List
+
+from result import Ok
+
+from src.genner.Cached import CachedGenner, ResponseCache
+from src.types import ChatHistory, Message
+from tests.mock_genner.MockGenner import MockGenner
+
+
+class StreamingGenner(MockGenner):
+	def __init__(self, tokens: List[str]):
+		super().__init__(do_stream=True)
+		self.tokens = tokens
+		self.requests = 0
+
+	def ch_completion(self, messages, until=None):
+		self.requests += 1
+		response = ""
+		for token in self.tokens:
+			response += token
+			if until is not None and until(token):
+				break
+
+		return Ok(response)
+
+
+def request(content: str) -> ChatHistory:
+	return ChatHistory(Message(role="user", content=content))
+
+
+def test_responses_expire_after_their_ttl(tmp_path, monkeypatch):
+	now = [1000.0]
+	monkeypatch.setattr("src.genner.Cached.time.time", lambda: now[0])
+
+	cache = ResponseCache(tmp_path / "cache.sqlite3", ttl_seconds=60)
+	cache.put("key", "response")
+
+	now[0] += 59
+	assert cache.get("key") == "response"
+
+	now[0] += 2
+	assert cache.get("key") is None
+	cache.close()
+
+
+def test_least_recently_used_responses_are_evicted(tmp_path, monkeypatch):
+	now = [1000.0]
+	monkeypatch.setattr("src.genner.Cached.time.time", lambda: now[0])
+
+	cache = ResponseCache(tmp_path / "cache.sqlite3", max_entries=2)
+	for key in ["a", "b"]:
+		now[0] += 1
+		cache.put(key, f"response {key}")
+
+	now[0] += 1
+	assert cache.get("a") == "response a"
+	now[0] += 1
+	cache.put("c", "response c")
+
+	assert cache.get("b") is None
+	assert cache.get("a") == "response a"
+	assert cache.get("c") == "response c"
+	cache.close()
+
+
+def test_replay_mode_fails_on_a_miss(tmp_path):
+	cache = ResponseCache(tmp_path / "cache.sqlite3")
+	genner = MockGenner()
+	CachedGenner(genner, cache).ch_completion(request("cached"))
+
+	replaying = CachedGenner(genner, cache, replay_only=True)
+	assert replaying.ch_completion(request("cached")) == Ok(
+		"This is a mocked completion response."
+	)
+	completion_result = replaying.ch_completion(request("not cached"))
+	assert completion_result.is_err()
+	assert "replay mode" in str(completion_result.err())
+	cache.close()
+
+
+def test_cut_off_responses_are_only_reused_with_until(tmp_path):
+	cache = ResponseCache(tmp_path / "cache.sqlite3")
+	wrapped = StreamingGenner(["```python\n", "print(1)\n", "```", "\nSome prose"])
+	genner = CachedGenner(wrapped, cache)
+
+	def until(token: str) -> bool:
+		return token == "```"
+
+	assert genner.ch_completion(request("code"), until=until) == Ok(
+		"```python\nprint(1)\n```"
+	)
+	assert genner.ch_completion(request("code"), until=until) == Ok(
+		"```python\nprint(1)\n```"
+	)
+	assert wrapped.requests == 1
+
+	# A plain completion gets the full response, which requests with `until` reuse too
+	assert genner.ch_completion(request("code")) == Ok(
+		"```python\nprint(1)\n```\nSome prose"
+	)
+	assert wrapped.requests == 2
+	assert genner.ch_completion(request("prose")) == Ok(
+		"```python\nprint(1)\n```\nSome prose"
+	)
+	assert genner.ch_completion(request("prose"), until=until) == Ok(
+		"```python\nprint(1)\n```\nSome prose"
+	)
+	assert wrapped.requests == 3
+	cache.close()
+
+
+def test_cancelled_responses_are_not_cached(tmp_path):
+	cache = ResponseCache(tmp_path / "cache.sqlite3")
+	wrapped = StreamingGenner(["```python\n", "print(1)\n", "```"])
+	cancel = threading.Event()
+	genner = CachedGenner(wrapped, cache).variant(cancel=cancel)
+	assert isinstance(genner, CachedGenner)
+
+	cancel.set()
+	assert genner.ch_completion(request("code"), until=lambda token: True) == Ok(
+		"```python\n"
+	)
+	assert genner.ch_completion(request("code"), until=lambda token: True) == Ok(
+		"```python\n"
+	)
+	assert isinstance(genner.genner, StreamingGenner)
+	assert genner.genner.requests == 2
+	cache.close()
@@ -0,0 +1,28 @@
+import asyncio
+
+from src.genner.Base import run_concurrently, shutdown_event_loop
+
+
+def test_calls_share_one_background_loop():
+	async def running_loop(delay: float):
+		await asyncio.sleep(delay)
+		return asyncio.get_running_loop()
+
+	first = run_concurrently(running_loop(0.02), running_loop(0.01))
+	second = run_concurrently(running_loop(0))
+
+	assert first[0] is first[1] is second[0]
+	assert not first[0].is_closed()
+
+	shutdown_event_loop()
+	assert first[0].is_closed()
+	assert run_concurrently(running_loop(0))[0] is not first[0]
+	shutdown_event_loop()
+
+
+def test_results_keep_the_order_of_the_awaitables():
+	async def value(x: int):
+		await asyncio.sleep(0.01 * (3 - x))
+		return x
+
+	assert run_concurrently(value(1), value(2), value(3)) == [1, 2, 3]
@@ -0,0 +1,147 @@
+import threading
+import time
+
+from src.scheduler import SessionScheduler
+
+
+class FakeDB:
+	def __init__(self, row):
+		self.row = row
+		self.updates = []
+
+	def get_agent_session(self, session_id):
+		return self.row
+
+	def update_agent_session(self, session_id, agent_id, status):
+		self.updates.append((session_id, agent_id, status))
+		return True
+
+
+def run_in_thread(scheduler: SessionScheduler) -> threading.Thread:
+	thread = threading.Thread(target=scheduler.run, daemon=True)
+	thread.start()
+
+	return thread
+
+
+def test_cycles_of_a_session_never_overlap():
+	scheduler = SessionScheduler(max_workers=4)
+	lock = threading.Lock()
+	running = [0]
+	max_running = [0]
+
+	def cycle():
+		with lock:
+			running[0] += 1
+			max_running[0] = max(max_running[0], running[0])
+		time.sleep(0.02)
+		with lock:
+			running[0] -= 1
+
+	scheduler.add_session("session", "agent", cycle, interval_seconds=0, max_cycles=5)
+	thread = run_in_thread(scheduler)
+	thread.join(timeout=5)
+
+	assert not thread.is_alive()
+	assert max_running[0] == 1
+
+
+def test_session_is_removed_after_max_cycles():
+	scheduler = SessionScheduler()
+	cycles = []
+
+	scheduler.add_session(
+		"session", "agent", lambda: cycles.append(1), interval_seconds=0, max_cycles=3
+	)
+	thread = run_in_thread(scheduler)
+	thread.join(timeout=5)
+
+	assert not thread.is_alive()
+	assert len(cycles) == 3
+	assert scheduler.sessions == {}
+
+
+def test_stopping_session_is_marked_stopped_and_removed():
+	scheduler = SessionScheduler()
+	db = FakeDB({"status": "running"})
+	cycles = []
+
+	def cycle():
+		cycles.append(1)
+		if len(cycles) == 2:
+			db.row = {"status": "stopping"}
+
+	scheduler.add_session("session", "agent", cycle, db=db, interval_seconds=0)  # type: ignore
+	thread = run_in_thread(scheduler)
+	thread.join(timeout=5)
+
+	assert not thread.is_alive()
+	assert len(cycles) == 2
+	assert db.updates == [("session", "agent", "stopped")]
+	assert scheduler.sessions == {}
+
+
+def test_session_interval_is_read_from_the_database():
+	scheduler = SessionScheduler()
+	db = FakeDB({"status": "running", "session_interval": 0.01})
+
+	scheduler.add_session("session", "agent", lambda: None, db=db, max_cycles=2)  # type: ignore
+	session = scheduler.sessions["session"]
+	assert session.interval_seconds == 900
+
+	thread = run_in_thread(scheduler)
+	thread.join(timeout=5)
+
+	assert not thread.is_alive()
+	assert session.interval_seconds == 0.01
+
+
+def test_explicit_interval_ignores_the_database_interval():
+	scheduler = SessionScheduler()
+	db = FakeDB({"status": "running", "session_interval": 3600})
+
+	scheduler.add_session(
+		"session",
+		"agent",
+		lambda: None,
+		db=db,  # type: ignore
+		interval_seconds=0,
+		max_cycles=3,
+	)
+	session = scheduler.sessions["session"]
+	thread = run_in_thread(scheduler)
+	thread.join(timeout=5)
+
+	# With the database interval, the second cycle would be an hour away
+	assert not thread.is_alive()
+	assert session.cycles == 3
+	assert session.interval_seconds == 0
+
+
+def test_stop_lets_the_running_cycles_finish():
+	scheduler = SessionScheduler()
+	started = threading.Event()
+	release = threading.Event()
+	finished = []
+
+	def cycle():
+		started.set()
+		release.wait(timeout=5)
+		finished.append(1)
+
+	scheduler.add_session("session", "agent", cycle, interval_seconds=0)
+	thread = run_in_thread(scheduler)
+	assert started.wait(timeout=5)
+
+	scheduler.stop()
+	thread.join(timeout=0.1)
+	# `run` waits for the running cycle instead of abandoning it
+	assert thread.is_alive()
+
+	release.set()
+	thread.join(timeout=5)
+
+	assert not thread.is_alive()
+	# No new cycle was started once stopping, even with a zero interval
+	assert finished == [1]
+	assert scheduler.sessions["session"].cycles == 1
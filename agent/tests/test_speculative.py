@@ -0,0 +1,134 @@
+import threading
+import time
+from typing import List
+
+from result import Err, Ok
+
+from src.flows.speculative import run_candidates
+from src.genner.Base import StreamingCodeExtractor
+from src.types import ChatHistory
+from tests.mock_genner.MockGenner import MockGenner
+
+
+def generate_first_code(genner):
+	code_result = genner.generate_code(ChatHistory())
+	return code_result.map(lambda result: result[0][0]), ChatHistory()
+
+
+class SlowStreamingGenner(MockGenner):
+	def __init__(self, tokens: int, delay: float):
+		super().__init__(do_stream=True)
+		self.stream_fn = lambda token: None
+		self.tokens = tokens
+		self.delay = delay
+		self.streamed: List[str] = []
+		self.finished = threading.Semaphore(0)
+
+	def ch_completion(self, messages, until=None):
+		response = ""
+		for _ in range(self.tokens):
+			time.sleep(self.delay)
+			response += "x"
+			self.streamed.append("x")
+			if self.do_stream and until is not None and until("x"):
+				break
+
+		self.finished.release()
+		return Ok(response)
+
+	def generate_code(self, messages, blocks=[""]):
+		watcher = StreamingCodeExtractor(
+			lambda response, blocks: Err("no code yet"), blocks, cancel=self.cancel
+		)
+		response = self.ch_completion(messages, until=watcher.feed).unwrap()
+		return Ok(([response], response))
+
+
+def test_single_candidate_runs_on_the_current_thread():
+	thread_names = []
+
+	def execute(code: str):
+		thread_names.append(threading.current_thread().name)
+		return Err("failed")
+
+	winner, failed = run_candidates(
+		MockGenner(), generate_first_code, execute, candidates=1
+	)
+
+	assert winner is None
+	assert [candidate.result for candidate in failed] == [Err("failed")]
+	assert thread_names == [threading.current_thread().name]
+
+
+def test_first_successful_candidate_wins():
+	attempts = []
+
+	def execute(code: str):
+		attempts.append(code)
+		if len(attempts) == 2:
+			return Ok(("output", code))
+		return Err(f"failed {len(attempts)}")
+
+	winner, failed = run_candidates(
+		MockGenner(), generate_first_code, execute, candidates=3
+	)
+
+	assert winner is not None
+	assert winner.result == Ok(("output", "print('Hello, world!')"))
+	assert all(isinstance(candidate.result, Err) for candidate in failed)
+	assert winner.index not in {candidate.index for candidate in failed}
+
+
+def test_all_failed_candidates_are_returned():
+	attempts = []
+
+	def execute(code: str):
+		attempts.append(code)
+		return Err(f"failed {len(attempts)}")
+
+	winner, failed = run_candidates(
+		MockGenner(), generate_first_code, execute, candidates=3
+	)
+
+	assert winner is None
+	assert sorted(candidate.index for candidate in failed) == [0, 1, 2]
+	assert sorted(str(candidate.result.err()) for candidate in failed) == [
+		"failed 1",
+		"failed 2",
+		"failed 3",
+	]
+
+
+def test_crashed_candidates_are_returned_as_failed():
+	def generate(genner):
+		raise RuntimeError("boom")
+
+	winner, failed = run_candidates(
+		MockGenner(), generate, lambda code: Ok(("output", code)), candidates=2
+	)
+
+	assert winner is None
+	assert len(failed) == 2
+	assert all("boom" in str(candidate.result.err()) for candidate in failed)
+
+
+def test_losing_generations_are_cancelled():
+	genner = SlowStreamingGenner(tokens=100, delay=0.01)
+	won = threading.Lock()
+
+	def generate(candidate_genner):
+		if won.acquire(blocking=False):
+			return Ok("winning code"), ChatHistory()
+		return generate_first_code(candidate_genner)
+
+	winner, _ = run_candidates(
+		genner, generate, lambda code: Ok(("output", code)), candidates=3
+	)
+
+	assert winner is not None
+	assert winner.code == "winning code"
+
+	# Both losers stop streaming at their next token instead of generating 100
+	for _ in range(2):
+		assert genner.finished.acquire(timeout=5)
+	assert len(genner.streamed) < 20
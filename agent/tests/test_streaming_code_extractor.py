@@ -0,0 +1,47 @@
+import threading
+from typing import List
+
+from src.genner.Base import StreamingCodeExtractor
+from src.genner.OR import OpenRouterGenner
+
+
+def feed_all(watcher: StreamingCodeExtractor, tokens: List[str]) -> List[bool]:
+	return [watcher.feed(token) for token in tokens]
+
+
+def test_closing_fence_split_across_chunks():
+	watcher = StreamingCodeExtractor(OpenRouterGenner.extract_code)
+	tokens = ["Here it is:\n`", "``python\nprint(1)\n", "`", "`", "`", "\nIt prints 1."]
+
+	assert feed_all(watcher, tokens[:4]) == [False, False, False, False]
+	assert watcher.code is None
+	assert watcher.feed(tokens[4]) is True
+	assert watcher.code == ["print(1)\n"]
+	assert watcher.response == "Here it is:\n```python\nprint(1)\n```"
+
+
+def test_code_wrapped_in_a_block_stops_at_the_closing_tag():
+	watcher = StreamingCodeExtractor(OpenRouterGenner.extract_code, ["Code"])
+	tokens = ["<Code>\n", "```python\nprint(2)\n```", "\n</Co", "de", ">", "\nDone."]
+
+	# The fence is closed before the block, which is only complete on its closing tag
+	assert feed_all(watcher, tokens[:4]) == [False, False, False, False]
+	assert watcher.feed(tokens[4]) is True
+	assert watcher.code == ["print(2)\n"]
+
+
+def test_response_without_code_is_never_complete():
+	watcher = StreamingCodeExtractor(OpenRouterGenner.extract_code)
+
+	assert feed_all(watcher, ["Use `print`", " to print.", "```"]) == [False] * 3
+	assert watcher.code is None
+
+
+def test_cancelled_stream_stops_without_code():
+	cancel = threading.Event()
+	watcher = StreamingCodeExtractor(OpenRouterGenner.extract_code, cancel=cancel)
+
+	assert watcher.feed("```python\n") is False
+	cancel.set()
+	assert watcher.feed("print(3)") is True
+	assert watcher.code is None
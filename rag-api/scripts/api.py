@@ -8,8 +8,21 @@ from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from loguru import logger
 
-from src.fetch import get_data_raw, get_data_raw_v3, get_data_raw_v4
-from src.store import save_result as save_result, save_result_v4
+from src.embeddings import embedding_cache
+from src.fetch import (
+	aget_data_raw_v4,
+	aget_data_raw_v4_batch,
+	get_data_raw,
+	get_data_raw_v3,
+)
+from src.registry import index_registry
+from src.workers import run_blocking
+from src.store import (
+	ResultV4,
+	save_result as save_result,
+	save_result_batch_v4,
+	save_result_v4,
+)
 
 
 class SaveResultParams(BaseModel):
@@ -43,6 +56,14 @@ async def health_check():
 	return {"status": "healthy"}
 
 
+@app.get("/stats")
+async def stats():
+	return {
+		"index_registry": index_registry.stats(),
+		"embedding_cache": embedding_cache.stats(),
+	}
+
+
 def now():
 	return datetime.now().isoformat()
 
@@ -86,7 +107,8 @@ async def get_relevant_document_raw(
 		top_k = params.top_k
 		threshold = params.threshold
 
-		data = get_data_raw(
+		data = await run_blocking(
+			get_data_raw,
 			query=query,
 			agent_id=agent_id,
 			session_id=session_id,
@@ -160,7 +182,8 @@ async def get_relevant_document_raw_v2(
 		_ = params.session_id
 		top_k = params.top_k
 
-		data = get_data_raw_v3(
+		data = await run_blocking(
+			get_data_raw_v3,
 			query=query,
 			agent_id=agent_id,
 			top_k=top_k,
@@ -233,7 +256,7 @@ async def get_relevant_document_raw_v4(
 		_ = params.session_id
 		top_k = params.top_k
 
-		data = get_data_raw_v4(  # noqa: F821
+		data = await aget_data_raw_v4(
 			notification_query=notification_query,
 			agent_id=agent_id,
 			top_k=top_k,
@@ -278,6 +301,57 @@ async def get_relevant_document_raw_v4(
 		)
 
 
+@app.post("/relevant_strategy_raw_v4/batch")
+async def get_relevant_document_raw_v4_batch(
+	request: Request, params: List[GetRelevantStrategyRawParamsV4]
+) -> TypicalResponse[List[List[RelevantStrategyDataV4]]]:
+	try:
+		data = await aget_data_raw_v4_batch(
+			[(query.query, query.agent_id, query.top_k) for query in params]
+		)
+
+		message = "Relevant strategy found"
+
+		if all(len(docs_and_scores) == 0 for docs_and_scores in data):
+			message = "No relevant strategy found"
+
+		return TypicalResponse[List[List[RelevantStrategyDataV4]]](
+			status="success",
+			data=[
+				[
+					RelevantStrategyDataV4(
+						page_content=doc.page_content,
+						metadata=RelevantStrategyDataV4.RelevantStrategyMetadata(
+							reference_id=doc.metadata["reference_id"],
+							strategy_data=doc.metadata["strategy_data"],
+							created_at=doc.metadata["created_at"],
+							distance=distance,
+						),
+					)
+					for doc, distance in docs_and_scores
+				]
+				for docs_and_scores in data
+			],
+			message=message,
+		)
+	except Exception as e:
+		logger.error(
+			"Error on `/relevant_strategy_raw_v4/batch`, \n"  #
+			f"`params`: \n{params}\n"
+			f"`e`: \n{e}",
+		)
+		raise HTTPException(
+			detail={
+				"status": "error",
+				"message":  #
+				"Error on `/relevant_strategy_raw_v4/batch`, \n"  #
+				f"`params`: \n{params}\n"
+				f"`e`: \n{e}",
+			},
+			status_code=500,
+		)
+
+
 @app.post("/save_result")
 async def store_execution_result(request: Request, params: SaveResultParams):
 	try:
@@ -288,7 +362,8 @@ async def store_execution_result(request: Request, params: SaveResultParams):
 		reference_id = params.reference_id
 		created_at = params.created_at
 
-		output = save_result(
+		output = await run_blocking(
+			save_result,
 			strategy=strategy,
 			reference_id=reference_id,
 			strategy_data=strategy_data,
@@ -318,7 +393,8 @@ async def store_execution_result(request: Request, params: SaveResultParams):
 @app.post("/save_result_v4")
 async def store_execution_result_v4(request: Request, params: SaveResultParamsV4):
 	try:
-		output = save_result_v4(
+		output = await run_blocking(
+			save_result_v4,
 			notification_key=params.notification_key,
 			strategy_id=params.reference_id,
 			strategy_data=params.strategy_data,
@@ -347,17 +423,19 @@ async def store_execution_result_v4(request: Request, params: SaveResultParamsV4
 @app.post("/save_result_batch")
 async def store_execution_result_batch(params: List[SaveResultParams]):
 	try:
-		outputs = []
-		for item in params:
-			output = save_result(
-				strategy=item.strategy,
-				reference_id=item.reference_id,
-				strategy_data=item.strategy_data,
-				agent_id=item.agent_id,
-				session_id=item.session_id,
-				created_at=item.created_at,
-			)
-			outputs.append(output)
+		outputs = await run_blocking(
+			lambda: [
+				save_result(
+					strategy=item.strategy,
+					reference_id=item.reference_id,
+					strategy_data=item.strategy_data,
+					agent_id=item.agent_id,
+					session_id=item.session_id,
+					created_at=item.created_at,
+				)
+				for item in params
+			]
+		)
 
 		return TypicalResponse(
 			status="success",
@@ -380,16 +458,19 @@ async def store_execution_result_batch(params: List[SaveResultParams]):
 @app.post("/save_result_batch_v4")
 async def store_execution_result_batch_v4(params: List[SaveResultParamsV4]):
 	try:
-		outputs = []
-		for item in params:
-			output = save_result_v4(
-				notification_key=item.notification_key,
-				strategy_id=item.reference_id,
-				strategy_data=item.strategy_data,
-				agent_id=item.agent_id,
-				created_at=item.created_at,
-			)
-			outputs.append(output)
+		outputs = await run_blocking(
+			save_result_batch_v4,
+			[
+				ResultV4(
+					notification_key=item.notification_key,
+					strategy_id=item.reference_id,
+					strategy_data=item.strategy_data,
+					agent_id=item.agent_id,
+					created_at=item.created_at,
+				)
+				for item in params
+			],
+		)
 
 		return TypicalResponse(
 			status="success",
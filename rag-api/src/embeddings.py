@@ -0,0 +1,238 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from typing import Dict, List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from src.workers import run_blocking
+
+RAG_EMBEDDING_CACHE_PATH = os.getenv(
+	"RAG_EMBEDDING_CACHE_PATH", "pkl/embeddings.sqlite3"
+)
+
+
+class EmbeddingCache:
+	"""
+	Persistent content-addressed store of embedding vectors.
+
+	Vectors are stored as float32 blobs in SQLite under the hash of the model,
+	the dimensions and the embedded text, so the same text is only ever sent to
+	the embedding API once per model.
+	"""
+
+	def __init__(self, db_path: str):
+		"""
+		Initialize the cache, creating the SQLite database if needed.
+
+		Args:
+			db_path (str): Path of the SQLite database file
+		"""
+		os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+
+		self._lock = threading.Lock()
+		self._conn = sqlite3.connect(db_path, check_same_thread=False)
+		self._conn.executescript(
+			"""
+			PRAGMA journal_mode=WAL;
+			CREATE TABLE IF NOT EXISTS embeddings (
+				key BLOB PRIMARY KEY,
+				vector BLOB NOT NULL
+			) WITHOUT ROWID;
+			"""
+		)
+		self._conn.commit()
+
+		self.hits = 0
+		self.misses = 0
+
+	@staticmethod
+	def key(model: str, dimensions: int, text: str) -> bytes:
+		return hashlib.sha256(f"{model}\x00{dimensions}\x00{text}".encode()).digest()
+
+	def get_many(self, keys: List[bytes]) -> Dict[bytes, List[float]]:
+		"""
+		Get the cached vectors of the given keys, counting hits and misses.
+
+		Args:
+			keys (List[bytes]): Keys made with `EmbeddingCache.key`
+
+		Returns:
+			Dict[bytes, List[float]]: The vectors that were found, by key
+		"""
+		found: Dict[bytes, List[float]] = {}
+		unique_keys = list(dict.fromkeys(keys))
+
+		with self._lock:
+			# Stay well below SQLite's limit on the number of bound parameters
+			for start in range(0, len(unique_keys), 500):
+				chunk = unique_keys[start : start + 500]
+				placeholders = ", ".join("?" for _ in chunk)
+				rows = self._conn.execute(
+					f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+					chunk,
+				).fetchall()
+				for key, vector in rows:
+					found[key] = np.frombuffer(vector, dtype=np.float32).tolist()
+
+			self.hits += sum(1 for key in keys if key in found)
+			self.misses += sum(1 for key in keys if key not in found)
+
+		return found
+
+	def put_many(self, vectors: Dict[bytes, List[float]]):
+		"""
+		Store vectors in the cache.
+
+		Args:
+			vectors (Dict[bytes, List[float]]): The vectors to store, by key
+		"""
+		rows = [
+			(key, np.asarray(vector, dtype=np.float32).tobytes())
+			for key, vector in vectors.items()
+		]
+
+		with self._lock, self._conn:
+			self._conn.executemany(
+				"INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows
+			)
+
+	def stats(self) -> Dict[str, int]:
+		"""
+		Get the counters of the cache.
+
+		Returns:
+			Dict[str, int]: Number of hits and misses since the process started
+		"""
+		with self._lock:
+			return {"hits": self.hits, "misses": self.misses}
+
+
+class CachedEmbeddings(Embeddings):
+	"""
+	Embeddings wrapper that serves repeated texts from an `EmbeddingCache`.
+
+	Only the texts missing from the cache are sent to the wrapped embeddings,
+	in a single batched request, so both ingestion and queries of already seen
+	texts cost no network round-trip.
+	"""
+
+	def __init__(
+		self, embeddings: Embeddings, model: str, dimensions: int, cache: EmbeddingCache
+	):
+		"""
+		Initialize the wrapper.
+
+		Args:
+			embeddings (Embeddings): The embeddings that compute the vectors on a miss
+			model (str): Name of the embedding model, part of the cache key
+			dimensions (int): Dimensions of the vectors, part of the cache key
+			cache (EmbeddingCache): The cache to read and write the vectors from
+		"""
+		self.embeddings = embeddings
+		self.model = model
+		self.dimensions = dimensions
+		self.cache = cache
+
+	def embed_documents(self, texts: List[str]) -> List[List[float]]:
+		keys = [EmbeddingCache.key(self.model, self.dimensions, text) for text in texts]
+		found = self.cache.get_many(keys)
+
+		missing = {key: text for key, text in zip(keys, texts) if key not in found}
+		if missing:
+			vectors = self.embeddings.embed_documents(list(missing.values()))
+			# Round to float32 so that hits and misses return the exact same vectors
+			computed = {
+				key: np.asarray(vector, dtype=np.float32).tolist()
+				for key, vector in zip(missing.keys(), vectors)
+			}
+			self.cache.put_many(computed)
+			found.update(computed)
+
+		return [found[key] for key in keys]
+
+	def embed_query(self, text: str) -> List[float]:
+		return self.embed_documents([text])[0]
+
+	async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+		keys = [EmbeddingCache.key(self.model, self.dimensions, text) for text in texts]
+		# The cache is backed by SQLite, keep its reads and writes off the event loop
+		found = await run_blocking(self.cache.get_many, keys)
+
+		missing = {key: text for key, text in zip(keys, texts) if key not in found}
+		if missing:
+			vectors = await self.embeddings.aembed_documents(list(missing.values()))
+			computed = {
+				key: np.asarray(vector, dtype=np.float32).tolist()
+				for key, vector in zip(missing.keys(), vectors)
+			}
+			await run_blocking(self.cache.put_many, computed)
+			found.update(computed)
+
+		return [found[key] for key in keys]
+
+	async def aembed_query(self, text: str) -> List[float]:
+		return (await self.aembed_documents([text]))[0]
+
+
+class HashingEmbeddings(Embeddings):
+	"""
+	CPU-local embeddings made by hashing word and character n-gram features.
+
+	Every feature is hashed into one of `dimensions` buckets with a sign taken
+	from the same hash, and the resulting vector is L2-normalized like the
+	OpenAI embeddings are. The vectors are deterministic across processes and
+	machines, which makes this provider suitable for offline test rigs, CI and
+	load tests; it is not meant to match the retrieval quality of a real model.
+	"""
+
+	def __init__(self, dimensions: int = 1536, char_ngram: int = 3):
+		"""
+		Initialize the provider.
+
+		Args:
+			dimensions (int): Dimensions of the produced vectors
+			char_ngram (int): Length of the character n-grams hashed next to the words
+		"""
+		self.dimensions = dimensions
+		self.char_ngram = char_ngram
+
+	def _features(self, text: str) -> List[str]:
+		words = re.findall(r"\w+", text.lower())
+		features = [f"w:{word}" for word in words]
+
+		for word in words:
+			padded = f" {word} "
+			features.extend(
+				f"c:{padded[i : i + self.char_ngram]}"
+				for i in range(max(len(padded) - self.char_ngram + 1, 1))
+			)
+
+		return features
+
+	def _embed(self, text: str) -> np.ndarray:
+		vector = np.zeros(self.dimensions, dtype=np.float32)
+
+		for feature in self._features(text):
+			digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+			value = int.from_bytes(digest, "little")
+			sign = 1.0 if value & 1 else -1.0
+			vector[(value >> 1) % self.dimensions] += sign
+
+		norm = np.linalg.norm(vector)
+		if norm > 0:
+			vector /= norm
+
+		return vector
+
+	def embed_documents(self, texts: List[str]) -> List[List[float]]:
+		return [self._embed(text).tolist() for text in texts]
+
+	def embed_query(self, text: str) -> List[float]:
+		return self._embed(text).tolist()
+
+
+embedding_cache = EmbeddingCache(RAG_EMBEDDING_CACHE_PATH)
@@ -1,19 +1,39 @@
-from glob import glob
 import os
-from typing import List, Tuple
+from typing import Callable, Dict, List, Tuple, TypeVar
+
+import numpy as np
 
 from dotenv import load_dotenv
 from langchain_community.vectorstores.faiss import FAISS
 from langchain_core.documents import Document
 from loguru import logger
 
-from src.store import get_embeddings
+from src.registry import index_registry
+from src.store import get_embeddings, load_agent_index, load_agent_index_v4
+from src.workers import run_blocking
 
 load_dotenv()
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 THRESHOLD = 0.7
 
+T = TypeVar("T")
+
+
+def search_v4(agent_id: str, search: Callable[..., T], *args, **kwargs) -> T:
+	"""
+	Run a search of the v4 KB of an agent under its search lock, so it never overlaps an in-place ingestion.
+
+	Args:
+		agent_id (str): Identifier of the agent
+		search (Callable[..., T]): The search, called with `args` and `kwargs`
+
+	Returns:
+		T: The result of the search
+	"""
+	with index_registry.search_lock("v4", agent_id).reading():
+		return search(*args, **kwargs)
+
 
 def convert_threshold(threshold_0_to_1: float) -> float:
 	"""
@@ -122,92 +142,173 @@ def get_data_raw_v3(
 ) -> List[Tuple[Document, float]]:
 	"""
 	Backward compatible KBs getter that let's us search multiple KBs based on only the `agent_id`.
-	This should scan the `pkl/` folder and only get any KBs file that has that `agent_id`, not caring about the previously added `session_id`.
+	The session KBs of the agent are compacted into one consolidated index (see `compact_agent_index`),
+	which is kept in the `index_registry` so query latency does not grow with the number of sessions.
 	"""
-	pattern = f"pkl/{agent_id}*.pkl"
-	matching_files = glob(pattern)
+	vectorstore = index_registry.get(
+		"agents", agent_id, lambda: load_agent_index(agent_id)
+	)
 
-	if not matching_files:
+	if vectorstore is None:
 		logger.error(
-			"No vector database has exists for {agent_id} yet. Please insert atleast one strategy"
+			f"No vector database has exists for {agent_id} yet. Please insert atleast one strategy"
 		)
 		return []
 
-	logger.info(f"`len(matching_files)` = {len(matching_files)}")
+	# Always get top_k results
+	return get_context_from_kb_with_top_k(vectorstore, query, top_k)
 
-	base_name = os.path.basename(matching_files[0]).replace(".pkl", "")
-	logger.info(f"Initializing vectorstore with `base_name` = {base_name}")
 
-	vectorstore = FAISS.load_local(
-		"pkl/",
-		get_embeddings(),
-		base_name,
-		allow_dangerous_deserialization=True,
-		distance_strategy="COSINE",
+def get_data_raw_v4(
+	notification_query: str,
+	agent_id: str,
+	top_k: int,
+) -> List[Tuple[Document, float]]:
+	"""
+	KBs getter that searches the KB of an agent based on only the `agent_id`, not caring about the `session_id`.
+	The vectorstore is kept in the `index_registry` so warm queries never touch the disk.
+	"""
+	vectorstore = index_registry.get(
+		"v4", agent_id, lambda: load_agent_index_v4(agent_id)
 	)
 
-	for file_path in matching_files[1:]:
-		base_name = os.path.basename(file_path).replace(".pkl", "")
-		logger.info(
-			f"Merging the initialized vectorstore with `base_name` = {base_name}"
-		)
-
-		additional_index = FAISS.load_local(
-			"pkl/",
-			get_embeddings(),
-			base_name,
-			allow_dangerous_deserialization=True,
-			distance_strategy="COSINE",
+	if vectorstore is None:
+		logger.error(
+			f"No vector database has exists for {agent_id} yet. Please insert atleast one strategy"
 		)
-		vectorstore.merge_from(additional_index)
+		return []
 
 	# Always get top_k results
-	return get_context_from_kb_with_top_k(vectorstore, query, top_k)
+	return search_v4(
+		agent_id,
+		get_context_from_kb_with_top_k,
+		vectorstore,
+		notification_query,
+		top_k,
+	)
 
 
-def get_data_raw_v4(
+async def aget_data_raw_v4(
 	notification_query: str,
 	agent_id: str,
 	top_k: int,
 ) -> List[Tuple[Document, float]]:
 	"""
-	Backward compatible KBs getter that let's us search multiple KBs based on only the `agent_id`.
-	This should scan the `pkl/` folder and only get any KBs file that has that `agent_id`, not caring about the previously added `session_id`.
+	Async version of `get_data_raw_v4`.
+
+	The query is embedded with an async request on the event loop while the
+	vectorstore loading and the search run on the bounded worker pool, so
+	concurrent queries neither block the event loop nor each other.
 	"""
-	pattern = f"pkl/v4/{agent_id}*.pkl"
-	matching_files = glob(pattern)
+	embedding = await get_embeddings().aembed_query(notification_query)
+
+	vectorstore = await run_blocking(
+		index_registry.get, "v4", agent_id, lambda: load_agent_index_v4(agent_id)
+	)
 
-	if not matching_files:
+	if vectorstore is None:
 		logger.error(
 			f"No vector database has exists for {agent_id} yet. Please insert atleast one strategy"
 		)
 		return []
 
-	base_name = os.path.basename(matching_files[0]).replace(".pkl", "")
-	logger.info(f"Initializing vectorstore with `base_name` = {base_name}")
+	results_with_scores = await run_blocking(
+		search_v4,
+		agent_id,
+		vectorstore.similarity_search_with_score_by_vector,
+		embedding,
+		k=top_k,
+	)
+	logger.info(f"`len(results_with_scores)`: {len(results_with_scores)}")
 
-	vectorstore = FAISS.load_local(
-		"pkl/v4/",
-		get_embeddings(),
-		base_name,
-		allow_dangerous_deserialization=True,
-		distance_strategy="COSINE",
+	return results_with_scores
+
+
+def search_many(
+	vectorstore: FAISS, embeddings: List[List[float]], top_ks: List[int]
+) -> List[List[Tuple[Document, float]]]:
+	"""
+	Search a vectorstore for many query vectors with a single matrix search.
+
+	Args:
+		vectorstore (FAISS): The vectorstore to search
+		embeddings (List[List[float]]): One query vector per query
+		top_ks (List[int]): Number of results wanted for every query
+
+	Returns:
+		List[List[Tuple[Document, float]]]: The documents and their distances, one list per query
+	"""
+	scores, indices = vectorstore.index.search(
+		np.asarray(embeddings, dtype=np.float32), max(top_ks)
 	)
 
-	for file_path in matching_files[1:]:
-		base_name = os.path.basename(file_path).replace(".pkl", "")
-		logger.info(
-			f"Merging the initialized vectorstore with `base_name` = {base_name}"
+	results = []
+	for row, top_k in enumerate(top_ks):
+		docs_and_scores = []
+		for score, position in zip(scores[row][:top_k], indices[row][:top_k]):
+			if position == -1:
+				# FAISS pads with -1 when the index has fewer than `k` vectors
+				continue
+
+			doc = vectorstore.docstore.search(
+				vectorstore.index_to_docstore_id[position]
+			)
+			assert isinstance(doc, Document)
+			docs_and_scores.append((doc, float(score)))
+
+		results.append(docs_and_scores)
+
+	return results
+
+
+async def aget_data_raw_v4_batch(
+	queries: List[Tuple[str, str, int]],
+) -> List[List[Tuple[Document, float]]]:
+	"""
+	Batched version of `aget_data_raw_v4`.
+
+	Every query is embedded in one batched embedding request, then the queries
+	of each agent are answered with one matrix search of that agent's KB.
+
+	Args:
+		queries (List[Tuple[str, str, int]]): `(notification_query, agent_id, top_k)` tuples
+
+	Returns:
+		List[List[Tuple[Document, float]]]: The documents and their distances, one list per query,
+			in the same order as `queries`
+	"""
+	results: List[List[Tuple[Document, float]]] = [[] for _ in queries]
+	if not queries:
+		return results
+
+	embeddings = await get_embeddings().aembed_documents(
+		[notification_query for notification_query, _, _ in queries]
+	)
+
+	positions_by_agent_id: Dict[str, List[int]] = {}
+	for position, (_, agent_id, _) in enumerate(queries):
+		positions_by_agent_id.setdefault(agent_id, []).append(position)
+
+	for agent_id, positions in positions_by_agent_id.items():
+		vectorstore = await run_blocking(
+			index_registry.get, "v4", agent_id, lambda: load_agent_index_v4(agent_id)
 		)
 
-		additional_index = FAISS.load_local(
-			"pkl/v4/",
-			get_embeddings(),
-			base_name,
-			allow_dangerous_deserialization=True,
-			distance_strategy="COSINE",
+		if vectorstore is None:
+			logger.error(
+				f"No vector database has exists for {agent_id} yet. Please insert atleast one strategy"
+			)
+			continue
+
+		agent_results = await run_blocking(
+			search_v4,
+			agent_id,
+			search_many,
+			vectorstore,
+			[embeddings[position] for position in positions],
+			[queries[position][2] for position in positions],
 		)
-		vectorstore.merge_from(additional_index)
+		for position, docs_and_scores in zip(positions, agent_results):
+			results[position] = docs_and_scores
 
-	# Always get top_k results
-	return get_context_from_kb_with_top_k(vectorstore, notification_query, top_k)
+	return results
@@ -0,0 +1,137 @@
+import os
+import sqlite3
+import threading
+from typing import Iterable, List, Set
+
+RAG_REFERENCE_ID_DB_PATH = os.getenv(
+	"RAG_REFERENCE_ID_DB_PATH", "pkl/reference_ids.sqlite3"
+)
+
+
+class ReferenceIdIndex:
+	"""
+	SQLite sidecar holding the set of `reference_id`s stored in every KB.
+
+	Checking whether a strategy has already been ingested only needs this set,
+	so it is kept next to the vectorstores and answered with an indexed lookup
+	instead of deserializing the whole FAISS index. KBs are identified by their
+	folder (`namespace`, e.g. "pkl/v4") and their `kb_id`.
+	"""
+
+	def __init__(self, db_path: str):
+		"""
+		Initialize the index, creating the SQLite database if needed.
+
+		Args:
+			db_path (str): Path of the SQLite database file
+		"""
+		os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+
+		self._lock = threading.Lock()
+		self._conn = sqlite3.connect(db_path, check_same_thread=False)
+		self._conn.executescript(
+			"""
+			PRAGMA journal_mode=WAL;
+			CREATE TABLE IF NOT EXISTS kbs (
+				namespace TEXT NOT NULL,
+				kb_id TEXT NOT NULL,
+				PRIMARY KEY (namespace, kb_id)
+			) WITHOUT ROWID;
+			CREATE TABLE IF NOT EXISTS reference_ids (
+				namespace TEXT NOT NULL,
+				kb_id TEXT NOT NULL,
+				reference_id TEXT NOT NULL,
+				PRIMARY KEY (namespace, kb_id, reference_id)
+			) WITHOUT ROWID;
+			"""
+		)
+		self._conn.commit()
+
+	def is_tracked(self, namespace: str, kb_id: str) -> bool:
+		"""
+		Check whether the ids of a KB have been recorded in the index.
+
+		Returns:
+			bool: True if the KB is tracked, False if it still has to be seeded
+		"""
+		with self._lock:
+			row = self._conn.execute(
+				"SELECT 1 FROM kbs WHERE namespace = ? AND kb_id = ?",
+				(namespace, kb_id),
+			).fetchone()
+
+		return row is not None
+
+	def existing(
+		self, namespace: str, kb_id: str, reference_ids: Iterable[str]
+	) -> Set[str]:
+		"""
+		Get which of the given reference ids are already stored in a KB.
+
+		Args:
+			namespace (str): Folder of the KB, e.g. "pkl/v4"
+			kb_id (str): Identifier of the KB
+			reference_ids (Iterable[str]): The reference ids to look up
+
+		Returns:
+			Set[str]: The subset of `reference_ids` that are already stored
+		"""
+		found: Set[str] = set()
+		reference_ids = list(reference_ids)
+
+		with self._lock:
+			# Stay well below SQLite's limit on the number of bound parameters
+			for start in range(0, len(reference_ids), 500):
+				chunk = reference_ids[start : start + 500]
+				placeholders = ", ".join("?" for _ in chunk)
+				rows = self._conn.execute(
+					"SELECT reference_id FROM reference_ids "
+					f"WHERE namespace = ? AND kb_id = ? AND reference_id IN ({placeholders})",
+					(namespace, kb_id, *chunk),
+				).fetchall()
+				found.update(row[0] for row in rows)
+
+		return found
+
+	def add(self, namespace: str, kb_id: str, reference_ids: Iterable[str]):
+		"""
+		Record reference ids as stored in a KB, marking the KB as tracked.
+
+		Args:
+			namespace (str): Folder of the KB, e.g. "pkl/v4"
+			kb_id (str): Identifier of the KB
+			reference_ids (Iterable[str]): The reference ids that have been stored
+		"""
+		rows: List[tuple] = [
+			(namespace, kb_id, reference_id) for reference_id in reference_ids
+		]
+
+		with self._lock, self._conn:
+			self._conn.execute(
+				"INSERT OR IGNORE INTO kbs (namespace, kb_id) VALUES (?, ?)",
+				(namespace, kb_id),
+			)
+			self._conn.executemany(
+				"INSERT OR IGNORE INTO reference_ids (namespace, kb_id, reference_id) VALUES (?, ?, ?)",
+				rows,
+			)
+
+	def forget(self, namespace: str, kb_id: str):
+		"""
+		Drop every recorded id of a KB, e.g. after its files have been removed.
+
+		Args:
+			namespace (str): Folder of the KB, e.g. "pkl/v4"
+			kb_id (str): Identifier of the KB
+		"""
+		with self._lock, self._conn:
+			self._conn.execute(
+				"DELETE FROM kbs WHERE namespace = ? AND kb_id = ?", (namespace, kb_id)
+			)
+			self._conn.execute(
+				"DELETE FROM reference_ids WHERE namespace = ? AND kb_id = ?",
+				(namespace, kb_id),
+			)
+
+
+reference_id_index = ReferenceIdIndex(RAG_REFERENCE_ID_DB_PATH)
@@ -0,0 +1,500 @@
+import json
+import os
+import pickle
+import struct
+import threading
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, List, Tuple
+
+import faiss
+import numpy as np
+from langchain_community.docstore.base import Docstore
+from langchain_community.vectorstores.faiss import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from loguru import logger
+
+INDEX_FILE = "index.faiss"
+DOCUMENTS_FILE = "documents.jsonl"
+OFFSETS_FILE = "offsets.u64"
+MANIFEST_FILE = "manifest.json"
+# Layout of the KBs written by earlier versions, converted on first access
+VECTORS_FILE = "vectors.f32"
+
+_migration_lock = threading.Lock()
+
+# Layout of a KB folder `{folder}/{kb_id}/`:
+# - `index.faiss`: a `faiss.IndexFlatL2` in the native faiss format, i.e. a
+#   fixed-size header followed by one row of `dimensions` float32 per document,
+#   memory-mapped with `faiss.IO_FLAG_MMAP_IFC`
+# - `documents.jsonl`: one `{"id", "page_content", "metadata"}` record per document, in the same order
+# - `offsets.u64`: the end offset of every record of `documents.jsonl`, so a record is read without parsing the others
+# - `manifest.json`: `{"dimensions", "count", "documents_bytes"}`, the committed size of the files above
+#
+# The rows of the three data files are append-only. Bytes past what the
+# manifest records are from an interrupted append and are ignored by readers
+# and truncated by the next append, so a KB is never read half-written. The
+# count in the header of `index.faiss` is only raised once the manifest is
+# written, so a loaded index never has more vectors than committed documents.
+
+# Offsets of the `ntotal` and code size fields in the header of a flat L2 index
+_HEADER_NTOTAL_OFFSET = 8
+_HEADER_CODES_SIZE_OFFSET = 37
+_HEADER_BYTES = 45
+
+
+def kb_folder(folder: str, kb_id: str) -> str:
+	return os.path.join(folder, kb_id)
+
+
+def read_manifest(folder: str, kb_id: str) -> Dict[str, int] | None:
+	"""
+	Read the manifest of a KB, migrating a legacy pickled KB first if needed.
+
+	Returns:
+		Dict[str, int] | None: The manifest, or None if the KB does not exist
+	"""
+	migrate_legacy_kb(folder, kb_id)
+
+	return _read_manifest_file(folder, kb_id)
+
+
+def _read_manifest_file(folder: str, kb_id: str) -> Dict[str, int] | None:
+	manifest_path = os.path.join(kb_folder(folder, kb_id), MANIFEST_FILE)
+	if not os.path.exists(manifest_path):
+		return None
+
+	with open(manifest_path) as f:
+		return json.load(f)
+
+
+def write_manifest(folder: str, kb_id: str, manifest: Dict[str, int]):
+	manifest_path = os.path.join(kb_folder(folder, kb_id), MANIFEST_FILE)
+	temp_path = f"{manifest_path}.tmp"
+
+	with open(temp_path, "w") as f:
+		json.dump(manifest, f)
+		f.flush()
+		os.fsync(f.fileno())
+
+	os.replace(temp_path, manifest_path)
+
+
+def kb_exists(folder: str, kb_id: str) -> bool:
+	return read_manifest(folder, kb_id) is not None
+
+
+def _index_header(dimensions: int, count: int) -> bytes:
+	header = bytearray(faiss.serialize_index(faiss.IndexFlatL2(dimensions)).tobytes())
+	assert len(header) == _HEADER_BYTES, "Unexpected faiss flat index header"
+
+	struct.pack_into("<q", header, _HEADER_NTOTAL_OFFSET, count)
+	struct.pack_into("<Q", header, _HEADER_CODES_SIZE_OFFSET, count * dimensions)
+
+	return bytes(header)
+
+
+def _index_count(index_path: str) -> int:
+	with open(index_path, "rb") as f:
+		header = f.read(_HEADER_BYTES)
+
+	return struct.unpack_from("<q", header, _HEADER_NTOTAL_OFFSET)[0]
+
+
+def read_vectors(folder: str, kb_id: str, manifest: Dict[str, int]) -> np.ndarray:
+	"""
+	Memory-map the committed vectors of a KB.
+
+	Returns:
+		np.ndarray: A read-only `(count, dimensions)` float32 array backed by the file
+	"""
+	if manifest["count"] == 0:
+		return np.zeros((0, manifest["dimensions"]), dtype=np.float32)
+
+	return np.memmap(
+		os.path.join(kb_folder(folder, kb_id), INDEX_FILE),
+		dtype=np.float32,
+		mode="r",
+		offset=_HEADER_BYTES,
+		shape=(manifest["count"], manifest["dimensions"]),
+	)
+
+
+def read_documents(
+	folder: str, kb_id: str, manifest: Dict[str, int]
+) -> List[Dict[str, Any]]:
+	"""
+	Read the committed document records of a KB.
+
+	Returns:
+		List[Dict[str, Any]]: `{"id", "page_content", "metadata"}` records, in vector order
+	"""
+	with open(os.path.join(kb_folder(folder, kb_id), DOCUMENTS_FILE), "rb") as f:
+		raw = f.read(manifest["documents_bytes"])
+
+	return [json.loads(line) for line in raw.splitlines() if line]
+
+
+def read_kb_ids(folder: str, kb_id: str) -> List[str]:
+	"""
+	Read the document ids of a KB without loading its vectors.
+
+	Returns:
+		List[str]: The ids, empty if the KB does not exist
+	"""
+	manifest = read_manifest(folder, kb_id)
+	if manifest is None:
+		return []
+
+	return [record["id"] for record in read_documents(folder, kb_id, manifest)]
+
+
+class KBDocstore(Docstore):
+	"""
+	Docstore of a loaded KB, reading the documents from `documents.jsonl` when they are searched.
+
+	The documents are keyed by their position in the KB, see `KBPositions`. The
+	docstore is read-only, so adding texts to the vectorstore fails with a
+	`ValueError` before touching its mapped index; appends go through
+	`append_kb` and `refresh_kb` instead.
+	"""
+
+	def __init__(self, documents_path: str, offsets: np.ndarray):
+		"""
+		Args:
+			documents_path (str): Path of `documents.jsonl`
+			offsets (np.ndarray): End offset of every committed record
+		"""
+		self.documents_path = documents_path
+		self.offsets = offsets
+
+	def search(self, search: str | int) -> str | Document:
+		try:
+			position = int(search)
+		except ValueError:
+			return f"ID {search} not found."
+		if not 0 <= position < len(self.offsets):
+			return f"ID {search} not found."
+
+		start = int(self.offsets[position - 1]) if position > 0 else 0
+		with open(self.documents_path, "rb") as f:
+			f.seek(start)
+			record = json.loads(f.read(int(self.offsets[position]) - start))
+
+		return Document(
+			id=record["id"],
+			page_content=record["page_content"],
+			metadata=record["metadata"],
+		)
+
+
+class KBPositions(Mapping):
+	"""
+	`index_to_docstore_id` of a loaded KB, mapping the positions of its documents to themselves.
+	"""
+
+	def __init__(self, count: int):
+		self.count = count
+
+	def __getitem__(self, position: int) -> int:
+		position = int(position)
+		if 0 <= position < self.count:
+			return position
+
+		raise KeyError(position)
+
+	def __iter__(self) -> Iterator[int]:
+		return iter(range(self.count))
+
+	def __len__(self) -> int:
+		return self.count
+
+
+def _map_kb(
+	folder: str, kb_id: str, index: Any, manifest: Dict[str, int]
+) -> Tuple[Any, np.ndarray]:
+	# Maps the committed rows of a KB given its index, read before its manifest
+	path = kb_folder(folder, kb_id)
+
+	if index.ntotal < manifest["count"]:
+		# An append committed its rows but was interrupted before raising the
+		# count of the index. A mapped index cannot grow, read the rows instead.
+		index = faiss.IndexFlatL2(manifest["dimensions"])
+		index.add(np.ascontiguousarray(read_vectors(folder, kb_id, manifest)))
+
+	offsets = (
+		np.memmap(
+			os.path.join(path, OFFSETS_FILE),
+			dtype=np.uint64,
+			mode="r",
+			shape=(manifest["count"],),
+		)
+		if manifest["count"]
+		else np.zeros(0, dtype=np.uint64)
+	)
+
+	return index, offsets
+
+
+def _read_index(folder: str, kb_id: str) -> Any:
+	# The codes of a flat index are only mapped, not copied, with `IO_FLAG_MMAP_IFC`;
+	# `IO_FLAG_MMAP` only maps the inverted lists of IVF indexes
+	return faiss.read_index(
+		os.path.join(kb_folder(folder, kb_id), INDEX_FILE), faiss.IO_FLAG_MMAP_IFC
+	)
+
+
+def load_kb(folder: str, kb_id: str, embeddings: Embeddings) -> FAISS | None:
+	"""
+	Load a KB into a FAISS vectorstore.
+
+	The vectors are memory-mapped with `faiss.IO_FLAG_MMAP_IFC` and the documents
+	are read from disk when a search returns them, so loading a KB reads a few
+	headers regardless of its size. A mapped index cannot be added to: documents
+	appended to the KB are picked up with `refresh_kb`.
+
+	Args:
+		folder (str): Folder holding the KBs, e.g. "pkl/v4"
+		kb_id (str): Identifier of the KB
+		embeddings (Embeddings): Embeddings used by the vectorstore to embed queries
+
+	Returns:
+		FAISS | None: The vectorstore, or None if the KB does not exist
+	"""
+	migrate_legacy_kb(folder, kb_id)
+
+	# Read the index before the manifest: an append raises the count of the
+	# index last, so the index never has more vectors than the manifest commits
+	if not os.path.exists(os.path.join(kb_folder(folder, kb_id), INDEX_FILE)):
+		return None
+	index = _read_index(folder, kb_id)
+
+	manifest = _read_manifest_file(folder, kb_id)
+	if manifest is None:
+		return None
+
+	index, offsets = _map_kb(folder, kb_id, index, manifest)
+
+	return FAISS(
+		embedding_function=embeddings,
+		index=index,
+		docstore=KBDocstore(
+			os.path.join(kb_folder(folder, kb_id), DOCUMENTS_FILE), offsets
+		),
+		index_to_docstore_id=KBPositions(manifest["count"]),  # type: ignore
+		distance_strategy="COSINE",  # type: ignore
+	)
+
+
+def refresh_kb(vectorstore: FAISS, folder: str, kb_id: str):
+	"""
+	Map the documents appended to a KB since it was loaded into its vectorstore, in place.
+
+	The index and the offsets are mapped again from the files, which only reads
+	their headers; no vector is copied. Must not run concurrently with a search
+	of the vectorstore nor with an append to the KB.
+
+	Args:
+		vectorstore (FAISS): A vectorstore returned by `load_kb`
+		folder (str): Folder holding the KBs, e.g. "pkl/v4"
+		kb_id (str): Identifier of the KB
+	"""
+	index = _read_index(folder, kb_id)
+	manifest = _read_manifest_file(folder, kb_id)
+	assert manifest is not None, f"`kb_id` = {kb_id} does not exist"
+
+	index, offsets = _map_kb(folder, kb_id, index, manifest)
+
+	assert isinstance(vectorstore.docstore, KBDocstore)
+	assert isinstance(vectorstore.index_to_docstore_id, KBPositions)
+	vectorstore.index = index
+	vectorstore.docstore.offsets = offsets
+	vectorstore.index_to_docstore_id.count = manifest["count"]
+
+
+def append_kb(
+	folder: str,
+	kb_id: str,
+	text_embeddings: List[Tuple[str, List[float]]],
+	metadatas: List[Dict[str, Any]],
+	ids: List[str],
+):
+	"""
+	Append documents and their vectors to a KB, creating it if needed.
+
+	Only the new rows are written; the manifest is swapped in last, so readers
+	see either all of the appended documents or none of them.
+
+	Args:
+		folder (str): Folder holding the KBs, e.g. "pkl/v4"
+		kb_id (str): Identifier of the KB
+		text_embeddings (List[Tuple[str, List[float]]]): Texts and their vectors
+		metadatas (List[Dict[str, Any]]): Metadata of every document
+		ids (List[str]): Id of every document
+
+	Raises:
+		ValueError: If the vectors do not match the dimensions of the KB
+	"""
+	migrate_legacy_kb(folder, kb_id)
+	_append_rows(folder, kb_id, text_embeddings, metadatas, ids)
+
+
+def _append_rows(
+	folder: str,
+	kb_id: str,
+	text_embeddings: List[Tuple[str, List[float]]],
+	metadatas: List[Dict[str, Any]],
+	ids: List[str],
+):
+	vectors = np.asarray(
+		[vector for _, vector in text_embeddings], dtype=np.float32
+	).reshape(len(text_embeddings), -1)
+
+	manifest = _read_manifest_file(folder, kb_id)
+	if manifest is None:
+		os.makedirs(kb_folder(folder, kb_id), exist_ok=True)
+		manifest = {"dimensions": vectors.shape[1], "count": 0, "documents_bytes": 0}
+
+	if vectors.shape[1] != manifest["dimensions"]:
+		raise ValueError(
+			f"Vectors of {vectors.shape[1]} dimensions cannot be added to `kb_id` = {kb_id} of {manifest['dimensions']} dimensions"
+		)
+
+	records = [
+		json.dumps({"id": doc_id, "page_content": text, "metadata": metadata}).encode()
+		+ b"\n"
+		for (text, _), metadata, doc_id in zip(text_embeddings, metadatas, ids)
+	]
+	offsets = manifest["documents_bytes"] + np.cumsum(
+		[len(record) for record in records], dtype=np.uint64
+	)
+
+	index_path = os.path.join(kb_folder(folder, kb_id), INDEX_FILE)
+	documents_path = os.path.join(kb_folder(folder, kb_id), DOCUMENTS_FILE)
+	offsets_path = os.path.join(kb_folder(folder, kb_id), OFFSETS_FILE)
+
+	if not os.path.exists(index_path):
+		with open(index_path, "wb") as f:
+			f.write(_index_header(manifest["dimensions"], 0))
+
+	for path, committed_bytes, data in [
+		(
+			index_path,
+			_HEADER_BYTES + manifest["count"] * manifest["dimensions"] * 4,
+			vectors.tobytes(),
+		),
+		(documents_path, manifest["documents_bytes"], b"".join(records)),
+		(offsets_path, manifest["count"] * 8, offsets.tobytes()),
+	]:
+		with open(path, "ab") as f:
+			f.truncate(committed_bytes)
+			f.write(data)
+			f.flush()
+			os.fsync(f.fileno())
+
+	manifest = {
+		"dimensions": manifest["dimensions"],
+		"count": manifest["count"] + len(ids),
+		"documents_bytes": int(offsets[-1]),
+	}
+	write_manifest(folder, kb_id, manifest)
+	_write_index_count(index_path, manifest)
+
+
+def _write_index_count(index_path: str, manifest: Dict[str, int]):
+	# Raises the count in the header of the index to the committed rows
+	with open(index_path, "r+b") as f:
+		f.write(_index_header(manifest["dimensions"], manifest["count"]))
+		f.flush()
+		os.fsync(f.fileno())
+
+
+def _migrate_raw_vectors(folder: str, kb_id: str):
+	"""
+	Convert a KB with raw `vectors.f32` vectors to an `index.faiss` index and an `offsets.u64` sidecar.
+	"""
+	path = kb_folder(folder, kb_id)
+	vectors_path = os.path.join(path, VECTORS_FILE)
+	manifest = _read_manifest_file(folder, kb_id)
+
+	if manifest is None or not os.path.exists(vectors_path):
+		return
+
+	logger.info(
+		f"Converting the vectors of `kb_id` = {kb_id} in {folder} to a faiss index"
+	)
+
+	with open(os.path.join(path, DOCUMENTS_FILE), "rb") as f:
+		raw = f.read(manifest["documents_bytes"])
+	offsets = np.cumsum(
+		[len(line) for line in raw.splitlines(keepends=True)], dtype=np.uint64
+	)
+
+	with open(os.path.join(path, OFFSETS_FILE), "wb") as f:
+		f.write(offsets.tobytes())
+		f.flush()
+		os.fsync(f.fileno())
+
+	temp_path = os.path.join(path, f"{INDEX_FILE}.tmp")
+	with open(vectors_path, "rb") as source, open(temp_path, "wb") as f:
+		f.write(_index_header(manifest["dimensions"], manifest["count"]))
+		f.write(source.read(manifest["count"] * manifest["dimensions"] * 4))
+		f.flush()
+		os.fsync(f.fileno())
+
+	os.replace(temp_path, os.path.join(path, INDEX_FILE))
+	os.remove(vectors_path)
+
+
+def migrate_legacy_kb(folder: str, kb_id: str):
+	"""
+	Convert a KB saved with `FAISS.save_local` (`{kb_id}.faiss` + `{kb_id}.pkl`) to the folder layout.
+
+	The legacy files are renamed with a `.migrated` suffix once the KB has been
+	converted, so the pickle is deserialized at most once. A KB folder with raw
+	`vectors.f32` vectors is converted to an `index.faiss` index as well.
+
+	Args:
+		folder (str): Folder holding the KBs, e.g. "pkl/v4"
+		kb_id (str): Identifier of the KB
+	"""
+	faiss_path = os.path.join(folder, f"{kb_id}.faiss")
+	pkl_path = os.path.join(folder, f"{kb_id}.pkl")
+
+	if os.path.exists(os.path.join(kb_folder(folder, kb_id), VECTORS_FILE)):
+		with _migration_lock:
+			_migrate_raw_vectors(folder, kb_id)
+
+	if not os.path.exists(pkl_path):
+		return
+
+	with _migration_lock:
+		# Another request may have migrated the KB while waiting for the lock
+		if (
+			not os.path.exists(pkl_path)
+			or _read_manifest_file(folder, kb_id) is not None
+		):
+			return
+
+		logger.info(f"Migrating pickled KB `kb_id` = {kb_id} in {folder}")
+
+		index = faiss.read_index(faiss_path)
+		with open(pkl_path, "rb") as f:
+			docstore, index_to_docstore_id = pickle.load(f)
+
+		vectors = index.reconstruct_n(0, index.ntotal) if index.ntotal else []
+
+		text_embeddings = []
+		metadatas = []
+		ids = []
+		for position, doc_id in sorted(index_to_docstore_id.items()):
+			doc = docstore.search(doc_id)
+			text_embeddings.append((doc.page_content, vectors[position]))
+			metadatas.append(doc.metadata)
+			ids.append(doc_id)
+
+		if ids:
+			_append_rows(folder, kb_id, text_embeddings, metadatas, ids)
+
+		os.replace(faiss_path, f"{faiss_path}.migrated")
+		os.replace(pkl_path, f"{pkl_path}.migrated")
@@ -0,0 +1,348 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from langchain_community.vectorstores.faiss import FAISS
+from loguru import logger
+
+from src.kbstore import KBDocstore
+
+RAG_INDEX_CACHE_MAX_ENTRIES = int(os.getenv("RAG_INDEX_CACHE_MAX_ENTRIES", "256"))
+RAG_INDEX_CACHE_MAX_MB = int(os.getenv("RAG_INDEX_CACHE_MAX_MB", "1024"))
+
+
+def estimate_vectorstore_bytes(vectorstore: FAISS) -> int:
+	"""
+	Roughly estimate how much memory a loaded vectorstore occupies.
+
+	The estimate counts the raw float32 vectors held by the FAISS index plus the
+	text of every document held in memory, which dominates for our strategy data.
+	The documents of a `KBDocstore` stay on disk, only its offsets are counted;
+	its mapped vectors are counted as they end up in the page cache once searched.
+
+	Args:
+		vectorstore (FAISS): The loaded vectorstore
+
+	Returns:
+		int: Estimated size in bytes
+	"""
+	vector_bytes = vectorstore.index.ntotal * vectorstore.index.d * 4
+
+	if isinstance(vectorstore.docstore, KBDocstore):
+		return vector_bytes + vectorstore.docstore.offsets.nbytes
+
+	text_bytes = 0
+	for doc_id in vectorstore.index_to_docstore_id.values():
+		doc = vectorstore.docstore.search(doc_id)
+		if isinstance(doc, str):
+			continue
+		text_bytes += estimate_document_bytes(doc.page_content, doc.metadata)
+
+	return vector_bytes + text_bytes
+
+
+def estimate_document_bytes(page_content: str, metadata: Dict[str, Any]) -> int:
+	"""
+	Roughly estimate how much memory the text and metadata of a document occupy.
+
+	Returns:
+		int: Estimated size in bytes
+	"""
+	return len(page_content) + sum(len(str(value)) for value in metadata.values())
+
+
+class ReadWriteLock:
+	"""
+	Lock letting either many readers or one writer in.
+
+	Waiting writers go first, so a steady stream of searches cannot starve an
+	ingestion.
+	"""
+
+	def __init__(self):
+		self._condition = threading.Condition()
+		self._readers = 0
+		self._writing = False
+		self._waiting_writers = 0
+
+	@contextmanager
+	def reading(self) -> Iterator[None]:
+		with self._condition:
+			while self._writing or self._waiting_writers:
+				self._condition.wait()
+			self._readers += 1
+
+		try:
+			yield
+		finally:
+			with self._condition:
+				self._readers -= 1
+				if self._readers == 0:
+					self._condition.notify_all()
+
+	@contextmanager
+	def writing(self) -> Iterator[None]:
+		with self._condition:
+			self._waiting_writers += 1
+			while self._writing or self._readers:
+				self._condition.wait()
+			self._waiting_writers -= 1
+			self._writing = True
+
+		try:
+			yield
+		finally:
+			with self._condition:
+				self._writing = False
+				self._condition.notify_all()
+
+
+class IndexRegistry:
+	"""
+	Process-wide LRU cache of loaded FAISS vectorstores.
+
+	Stores are keyed by `(namespace, kb_id)` so that the different KB layouts
+	(`pkl/agents/` and `pkl/v4/`) never collide. The registry is bounded both by the
+	number of entries and by the estimated memory footprint of the stores; the
+	least recently used stores are evicted first when either budget is exceeded.
+	"""
+
+	def __init__(self, max_entries: int, max_bytes: int):
+		"""
+		Initialize the registry with its budgets.
+
+		Args:
+			max_entries (int): Maximum number of vectorstores to keep loaded
+			max_bytes (int): Maximum estimated memory for all loaded vectorstores
+		"""
+		self.max_entries = max_entries
+		self.max_bytes = max_bytes
+
+		self._lock = threading.RLock()
+		self._stores: OrderedDict[str, FAISS] = OrderedDict()
+		self._sizes: Dict[str, int] = {}
+		self._total_bytes = 0
+		self._load_locks: Dict[str, threading.Lock] = {}
+		self._search_locks: Dict[str, ReadWriteLock] = {}
+		# Bumped on every put or invalidation, so that a load that raced with a
+		# write does not cache the version it read from before the write
+		self._versions: Dict[str, int] = {}
+
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	@staticmethod
+	def _key(namespace: str, kb_id: str) -> str:
+		return f"{namespace}:{kb_id}"
+
+	def get(
+		self,
+		namespace: str,
+		kb_id: str,
+		loader: Callable[[], Optional[FAISS]],
+	) -> Optional[FAISS]:
+		"""
+		Get a vectorstore from the registry, loading it on a miss.
+
+		Args:
+			namespace (str): KB layout the `kb_id` belongs to, e.g. "v4"
+			kb_id (str): Identifier of the KB
+			loader (Callable[[], Optional[FAISS]]): Function that loads the vectorstore from disk,
+				returning None if there is nothing to load
+
+		Returns:
+			Optional[FAISS]: The loaded vectorstore, or None if the loader found nothing
+		"""
+		key = self._key(namespace, kb_id)
+
+		with self._lock:
+			if key in self._stores:
+				self._stores.move_to_end(key)
+				self.hits += 1
+				return self._stores[key]
+
+			load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+		# Load outside of the registry lock so that a slow load only blocks
+		# lookups of the same KB; concurrent misses of one KB load it once.
+		with load_lock:
+			with self._lock:
+				if key in self._stores:
+					self._stores.move_to_end(key)
+					self.hits += 1
+					return self._stores[key]
+
+				self.misses += 1
+				version = self._versions.get(key, 0)
+
+			try:
+				vectorstore = loader()
+
+				with self._lock:
+					if (
+						vectorstore is not None
+						and self._versions.get(key, 0) == version
+					):
+						self._put(key, vectorstore)
+			finally:
+				with self._lock:
+					self._load_locks.pop(key, None)
+
+			return vectorstore
+
+	def peek(self, namespace: str, kb_id: str) -> Optional[FAISS]:
+		"""
+		Get a vectorstore only if it is already loaded, without loading it or counting a hit.
+
+		Returns:
+			Optional[FAISS]: The loaded vectorstore, or None if it is not in the registry
+		"""
+		with self._lock:
+			return self._stores.get(self._key(namespace, kb_id))
+
+	def search_lock(self, namespace: str, kb_id: str) -> ReadWriteLock:
+		"""
+		Get the lock searches of a vectorstore hold for reading, see `extend`.
+
+		Args:
+			namespace (str): KB layout the `kb_id` belongs to, e.g. "v4"
+			kb_id (str): Identifier of the KB
+
+		Returns:
+			ReadWriteLock: The lock of the KB
+		"""
+		with self._lock:
+			return self._search_locks.setdefault(
+				self._key(namespace, kb_id), ReadWriteLock()
+			)
+
+	def extend(
+		self,
+		namespace: str,
+		kb_id: str,
+		add: Callable[[FAISS], None],
+		added_bytes: int,
+	) -> bool:
+		"""
+		Add documents to a loaded vectorstore in place.
+
+		`add` runs under the write lock of `search_lock`, so no search of the
+		vectorstore runs meanwhile. Only the estimated size of the new documents
+		is added to the budget, the rest of the vectorstore is not walked again.
+
+		Args:
+			namespace (str): KB layout the `kb_id` belongs to, e.g. "v4"
+			kb_id (str): Identifier of the KB
+			add (Callable[[FAISS], None]): Adds the documents to the vectorstore
+			added_bytes (int): Estimated size of the added documents
+
+		Returns:
+			bool: Whether the vectorstore was loaded, if not nothing was added
+		"""
+		key = self._key(namespace, kb_id)
+
+		with self._lock:
+			vectorstore = self._stores.get(key)
+		if vectorstore is None:
+			return False
+
+		with self.search_lock(namespace, kb_id).writing():
+			add(vectorstore)
+
+		with self._lock:
+			if self._stores.get(key) is vectorstore:
+				self._sizes[key] += added_bytes
+				self._total_bytes += added_bytes
+				self._evict()
+
+		return True
+
+	def put(self, namespace: str, kb_id: str, vectorstore: FAISS):
+		"""
+		Insert or replace a vectorstore in the registry.
+
+		Args:
+			namespace (str): KB layout the `kb_id` belongs to, e.g. "v4"
+			kb_id (str): Identifier of the KB
+			vectorstore (FAISS): The vectorstore to keep in memory
+		"""
+		key = self._key(namespace, kb_id)
+
+		with self._lock:
+			self._versions[key] = self._versions.get(key, 0) + 1
+			self._put(key, vectorstore)
+
+	def _put(self, key: str, vectorstore: FAISS):
+		self._drop(key)
+
+		size = estimate_vectorstore_bytes(vectorstore)
+		self._stores[key] = vectorstore
+		self._sizes[key] = size
+		self._total_bytes += size
+
+		self._evict()
+
+	def _drop(self, key: str):
+		if key not in self._stores:
+			return
+
+		del self._stores[key]
+		self._total_bytes -= self._sizes.pop(key)
+
+	def _evict(self):
+		# Always keep the most recently inserted store, even if it alone is over budget
+		while len(self._stores) > 1 and (
+			len(self._stores) > self.max_entries or self._total_bytes > self.max_bytes
+		):
+			key, _ = self._stores.popitem(last=False)
+			self._total_bytes -= self._sizes.pop(key)
+			self.evictions += 1
+			logger.info(f"Evicted `{key}` from the index registry")
+
+	def invalidate(self, namespace: str, kb_id: str):
+		"""
+		Drop a cached vectorstore so that the next lookup reloads it from disk.
+
+		Args:
+			namespace (str): KB layout the `kb_id` belongs to, e.g. "v4"
+			kb_id (str): Identifier of the KB
+		"""
+		key = self._key(namespace, kb_id)
+
+		with self._lock:
+			self._versions[key] = self._versions.get(key, 0) + 1
+			self._drop(key)
+
+	def clear(self):
+		"""
+		Drop every cached vectorstore.
+		"""
+		with self._lock:
+			self._stores.clear()
+			self._sizes.clear()
+			self._total_bytes = 0
+
+	def stats(self) -> Dict[str, int]:
+		"""
+		Get the counters of the registry.
+
+		Returns:
+			Dict[str, int]: Number of entries, estimated bytes, hits, misses and evictions
+		"""
+		with self._lock:
+			return {
+				"entries": len(self._stores),
+				"bytes": self._total_bytes,
+				"hits": self.hits,
+				"misses": self.misses,
+				"evictions": self.evictions,
+			}
+
+
+index_registry = IndexRegistry(
+	max_entries=RAG_INDEX_CACHE_MAX_ENTRIES,
+	max_bytes=RAG_INDEX_CACHE_MAX_MB * 1024 * 1024,
+)
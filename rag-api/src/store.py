@@ -1,53 +1,359 @@
 import os
+import re
+import threading
+import uuid
 from datetime import datetime
+from typing import Dict, Iterable, List, Set, Tuple, TypedDict
 
 from langchain_community.docstore.document import Document
 from langchain_community.vectorstores.faiss import FAISS
+from langchain_core.embeddings import Embeddings
 from langchain_openai import OpenAIEmbeddings
 from loguru import logger
 
+from src.embeddings import CachedEmbeddings, HashingEmbeddings, embedding_cache
+from src.ids import reference_id_index
+from src.kbstore import append_kb, kb_exists, load_kb, read_kb_ids, refresh_kb
+from src.registry import index_registry
+
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+RAG_EMBEDDING_PROVIDER = os.getenv("RAG_EMBEDDING_PROVIDER", "openai")
+RAG_EMBEDDING_DIMENSIONS = int(os.getenv("RAG_EMBEDDING_DIMENSIONS", "1536"))
 PKL_PATH = "pkl/"
+AGENTS_PKL_PATH = "pkl/agents/"
+# Session ids are UUIDs or numbers, never containing `_`, which tells the
+# shards of agent `a` (`a_{session_id}.pkl`) from those of agent `a_b`
+SESSION_ID_PATTERN = r"[^_]+"
+V4_PKL_FOLDER = "pkl/v4"
 
 os.makedirs("pkl/", exist_ok=True)
 os.makedirs("pkl/v4", exist_ok=True)
+os.makedirs("pkl/agents", exist_ok=True)
+
+
+_embeddings: CachedEmbeddings | None = None
+
+
+def get_embedding_provider(provider: str, dimensions: int) -> Tuple[Embeddings, str]:
+	"""
+	Build the embedding provider selected by `RAG_EMBEDDING_PROVIDER`.
+
+	Args:
+		provider (str): Either "openai" or "hashing"
+		dimensions (int): Dimensions of the produced vectors
+
+	Returns:
+		Tuple[Embeddings, str]:
+			- The embeddings client
+			- The name of the model, used to key the embedding cache
 
+	Raises:
+		ValueError: If the provider is not supported
+	"""
+	if provider == "openai":
+		return (
+			OpenAIEmbeddings(
+				openai_api_key=OPENAI_API_KEY,  # type: ignore
+				request_timeout=120,  # type: ignore
+				model="text-embedding-3-small",
+				dimensions=dimensions,
+			),
+			"text-embedding-3-small",
+		)
+	if provider == "hashing":
+		return HashingEmbeddings(dimensions=dimensions), "hashing-v1"
 
-def get_embeddings():
-	return OpenAIEmbeddings(
-		openai_api_key=OPENAI_API_KEY,  # type: ignore
-		request_timeout=120,  # type: ignore
-		model="text-embedding-3-small",
-		dimensions=1536,
+	raise ValueError(
+		f"Unsupported embedding provider: {provider}. Supported providers: openai, hashing"
 	)
 
 
+def get_embeddings() -> CachedEmbeddings:
+	"""
+	Get the process-wide embeddings client, backed by the persistent `embedding_cache`.
+
+	KBs are only searchable with the provider they were ingested with, so switch
+	`RAG_EMBEDDING_PROVIDER` only on an empty `pkl/` folder.
+	"""
+	global _embeddings
+
+	if _embeddings is None:
+		embeddings, model = get_embedding_provider(
+			RAG_EMBEDDING_PROVIDER, RAG_EMBEDDING_DIMENSIONS
+		)
+		_embeddings = CachedEmbeddings(
+			embeddings,
+			model=model,
+			dimensions=RAG_EMBEDDING_DIMENSIONS,
+			cache=embedding_cache,
+		)
+
+	return _embeddings
+
+
+def _kb_exists(kb_id: str, pkl_folder: str) -> bool:
+	if os.path.normpath(pkl_folder) == V4_PKL_FOLDER:
+		return kb_exists(V4_PKL_FOLDER, kb_id)
+
+	return check_pkl_exists(kb_id, pkl_folder=pkl_folder)
+
+
+def _read_reference_ids(kb_id: str, pkl_folder: str) -> Iterable[str]:
+	if os.path.normpath(pkl_folder) == V4_PKL_FOLDER:
+		return read_kb_ids(V4_PKL_FOLDER, kb_id)
+
+	return load_vectorstore(pkl_folder, kb_id).index_to_docstore_id.values()
+
+
+def existing_reference_ids(
+	kb_id: str, reference_ids: Iterable[str], pkl_folder=PKL_PATH
+) -> Set[str]:
+	"""
+	Get which of the given reference ids are already stored in a KB.
+
+	The lookup goes through the `reference_id_index` sidecar. A KB that is not
+	tracked yet (created before the sidecar existed) is seeded from its
+	vectorstore once; a KB whose files are gone is forgotten.
+
+	Args:
+		kb_id (str): Identifier of the KB
+		reference_ids (Iterable[str]): The reference ids to look up
+		pkl_folder (str): Folder of the KB
+
+	Returns:
+		Set[str]: The subset of `reference_ids` that are already stored
+	"""
+	namespace = os.path.normpath(pkl_folder)
+
+	if not _kb_exists(kb_id, pkl_folder):
+		reference_id_index.forget(namespace, kb_id)
+		return set()
+
+	if not reference_id_index.is_tracked(namespace, kb_id):
+		logger.info(f"Seeding reference ids of `kb_id` = {kb_id} in {namespace}")
+		reference_id_index.add(namespace, kb_id, _read_reference_ids(kb_id, pkl_folder))
+
+	return reference_id_index.existing(namespace, kb_id, reference_ids)
+
+
 def check_if_reference_id_exists_in_kb(
 	kb_id: str, strategy_id: str, pkl_folder=PKL_PATH
 ):
+	return strategy_id in existing_reference_ids(kb_id, [strategy_id], pkl_folder)
+
+
+def check_pkl_exists(kb_id: str, pkl_folder=PKL_PATH):
 	pkl_folder = pkl_folder.rstrip("/")
-	pkl_path = f"{pkl_folder}/{kb_id}.pkl"
 
-	if os.path.exists(pkl_path):
-		vectorstore = FAISS.load_local(
+	return os.path.exists(f"{pkl_folder}/{kb_id}.pkl")
+
+
+_kb_locks: Dict[str, threading.RLock] = {}
+_kb_locks_lock = threading.Lock()
+
+
+def kb_lock(namespace: str, kb_id: str) -> threading.RLock:
+	"""
+	Get the write lock of a KB.
+
+	Every write to a KB holds its lock, so concurrent ingestions of the same KB
+	are serialized instead of overwriting each other's documents. The lock is
+	reentrant so that a write can load the KB it is holding the lock of.
+
+	Args:
+		namespace (str): Folder of the KB, e.g. "pkl/v4"
+		kb_id (str): Identifier of the KB
+
+	Returns:
+		threading.RLock: The lock of the KB
+	"""
+	with _kb_locks_lock:
+		return _kb_locks.setdefault(
+			f"{os.path.normpath(namespace)}:{kb_id}", threading.RLock()
+		)
+
+
+def load_vectorstore(pkl_folder: str, kb_id: str) -> FAISS:
+	# `{kb_id}.faiss` and `{kb_id}.pkl` are replaced one after the other by
+	# `save_vectorstore`, so read them under the lock to never get a mixed pair
+	with kb_lock(pkl_folder, kb_id):
+		return FAISS.load_local(
 			pkl_folder,
 			get_embeddings(),
 			kb_id,
 			allow_dangerous_deserialization=True,
 			distance_strategy="COSINE",
 		)
-		documents = vectorstore.index_to_docstore_id.values()
 
-		for doc_id in documents:
-			if doc_id == strategy_id:
-				return True
-	return False
 
+def save_vectorstore(vectorstore: FAISS, pkl_folder: str, kb_id: str):
+	"""
+	Save a vectorstore by writing temporary files and renaming them over the KB files.
 
-def check_pkl_exists(kb_id: str, pkl_folder=PKL_PATH):
+	A crash while saving leaves the previous version of the KB intact instead of
+	a truncated pickle. Callers must hold the `kb_lock` of the KB.
+	"""
 	pkl_folder = pkl_folder.rstrip("/")
+	temp_name = f"{kb_id}.tmp-{uuid.uuid4().hex}"
 
-	return os.path.exists(f"{pkl_folder}/{kb_id}.pkl")
+	vectorstore.save_local(pkl_folder, temp_name)
+
+	for extension in ["faiss", "pkl"]:
+		os.replace(
+			f"{pkl_folder}/{temp_name}.{extension}",
+			f"{pkl_folder}/{kb_id}.{extension}",
+		)
+
+
+def merge_new_documents(
+	target: FAISS | None, source: FAISS
+) -> Tuple[FAISS | None, int]:
+	"""
+	Copy the documents of `source` that are missing from `target` into `target`.
+
+	The vectors are reconstructed from the source index instead of being
+	re-embedded, so merging never makes an embedding request.
+
+	Args:
+		target (FAISS | None): The vectorstore to merge into, None to start a new one
+		source (FAISS): The vectorstore to merge from
+
+	Returns:
+		Tuple[FAISS | None, int]:
+			- The merged vectorstore, None if both were empty
+			- The number of documents that were added
+	"""
+	existing_ids = set(target.index_to_docstore_id.values()) if target else set()
+
+	new_positions = [
+		(position, doc_id)
+		for position, doc_id in source.index_to_docstore_id.items()
+		if doc_id not in existing_ids
+	]
+	if not new_positions:
+		return target, 0
+
+	vectors = source.index.reconstruct_n(0, source.index.ntotal)
+
+	text_embeddings = []
+	metadatas = []
+	ids = []
+	for position, doc_id in new_positions:
+		doc = source.docstore.search(doc_id)
+		assert isinstance(doc, Document)
+
+		text_embeddings.append((doc.page_content, vectors[position].tolist()))
+		metadatas.append(doc.metadata)
+		ids.append(doc_id)
+
+	if target is None:
+		target = FAISS.from_embeddings(
+			text_embeddings,
+			get_embeddings(),
+			metadatas=metadatas,
+			ids=ids,
+			distance_strategy="COSINE",
+		)
+	else:
+		target.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+
+	return target, len(ids)
+
+
+def agent_shard_names(agent_id: str) -> List[str]:
+	"""
+	List the session KBs of an agent in `pkl/`, named `{agent_id}_{session_id}.pkl`.
+
+	Returns:
+		List[str]: The KB ids of the shards, sorted
+	"""
+	if not os.path.isdir(PKL_PATH):
+		return []
+
+	pattern = re.compile(rf"{re.escape(agent_id)}_{SESSION_ID_PATTERN}\.pkl")
+
+	return sorted(
+		name.removesuffix(".pkl")
+		for name in os.listdir(PKL_PATH)
+		if pattern.fullmatch(name)
+	)
+
+
+def compact_agent_index(
+	agent_id: str, shards: List[FAISS] | None = None
+) -> FAISS | None:
+	"""
+	Merge session shards of an agent into its consolidated index in `pkl/agents/`.
+
+	Session KBs are stored as `pkl/{agent_id}_{session_id}.pkl`. Queries only
+	need the consolidated `pkl/agents/{agent_id}.pkl`, so the shards are merged
+	into it incrementally: `save_result` passes the shard it has just written,
+	and a missing consolidated index is backfilled from every shard on disk.
+
+	Args:
+		agent_id (str): Identifier of the agent
+		shards (List[FAISS] | None): In-memory shards to merge. If None, every
+			shard of `agent_shard_names` is loaded from disk.
+
+	Returns:
+		FAISS | None: The consolidated vectorstore, or None if the agent has no documents
+	"""
+	agents_folder = AGENTS_PKL_PATH.rstrip("/")
+
+	with kb_lock(agents_folder, agent_id):
+		if check_pkl_exists(agent_id, pkl_folder=agents_folder):
+			consolidated = load_vectorstore(agents_folder, agent_id)
+		else:
+			consolidated = None
+
+		if shards is None:
+			shard_names = agent_shard_names(agent_id)
+			logger.info(
+				f"Backfilling consolidated index of `agent_id` = {agent_id} from {len(shard_names)} shard(s)"
+			)
+			shards = [
+				load_vectorstore("pkl/", shard_name) for shard_name in shard_names
+			]
+
+		added = 0
+		for shard in shards:
+			consolidated, shard_added = merge_new_documents(consolidated, shard)
+			added += shard_added
+
+		if consolidated is not None and added > 0:
+			save_vectorstore(consolidated, agents_folder, agent_id)
+			index_registry.put("agents", agent_id, consolidated)
+			logger.info(
+				f"Merged {added} document(s) into the consolidated index of `agent_id` = {agent_id}"
+			)
+
+	return consolidated
+
+
+def load_agent_index(agent_id: str) -> FAISS | None:
+	"""
+	Load the consolidated index of an agent, backfilling it from its shards if needed.
+
+	Returns:
+		FAISS | None: The consolidated vectorstore, or None if the agent has no documents
+	"""
+	agents_folder = AGENTS_PKL_PATH.rstrip("/")
+
+	if check_pkl_exists(agent_id, pkl_folder=agents_folder):
+		return load_vectorstore(agents_folder, agent_id)
+
+	return compact_agent_index(agent_id)
+
+
+def load_agent_index_v4(agent_id: str) -> FAISS | None:
+	"""
+	Load the v4 index of an agent. v4 KBs are keyed by the `agent_id` alone, so
+	`pkl/v4/{agent_id}/` already is the consolidated index of the agent.
+
+	Returns:
+		FAISS | None: The vectorstore, or None if the agent has no documents yet
+	"""
+	return load_kb(V4_PKL_FOLDER, agent_id, get_embeddings())
 
 
 def save_result(
@@ -61,47 +367,51 @@ def save_result(
 	kb_id = f"{agent_id}_{session_id}"
 	text = f"Strategy: {strategy}\n"
 
-	is_exist = check_pkl_exists(kb_id)
+	with kb_lock("pkl", kb_id):
+		is_exist = check_pkl_exists(kb_id)
 
-	if check_if_reference_id_exists_in_kb(reference_id, kb_id) and is_exist:
-		print("Document already exists")
-		return "Document already exists"
+		if check_if_reference_id_exists_in_kb(kb_id=kb_id, strategy_id=reference_id):
+			print("Document already exists")
+			return "Document already exists"
 
-	document = Document(
-		page_content=text,
-		metadata={
-			"reference_id": reference_id,
-			"strategy_data": strategy_data,
-			"created_at": created_at,
-		},
-	)
+		document = Document(
+			page_content=text,
+			metadata={
+				"reference_id": reference_id,
+				"strategy_data": strategy_data,
+				"created_at": created_at,
+			},
+		)
 
-	documents = [document]
-	for doc in documents:
-		doc.id = str(reference_id)
+		documents = [document]
+		for doc in documents:
+			doc.id = str(reference_id)
 
-	embeddings = get_embeddings()
+		if is_exist:
+			vectorstore = load_vectorstore("pkl/", kb_id)
+			vectorstore.add_documents(documents)
+		else:
+			vectorstore = FAISS.from_documents(
+				documents, get_embeddings(), distance_strategy="COSINE"
+			)
 
-	if is_exist:
-		vectorstore = FAISS.load_local(
-			"pkl/",
-			embeddings,
-			kb_id,
-			allow_dangerous_deserialization=True,
-			distance_strategy="COSINE",
-		)
-		vectorstore.add_documents(documents)
-	else:
-		vectorstore = FAISS.from_documents(
-			documents, embeddings, distance_strategy="COSINE"
-		)
+		save_vectorstore(vectorstore, "pkl/", kb_id)
+		reference_id_index.add("pkl", kb_id, [str(reference_id)])
 
-	vectorstore.save_local("pkl/", kb_id)
+	compact_agent_index(agent_id, shards=[vectorstore])
 
 	print("Document ingested successfully")
 	return "Document ingested successfully"
 
 
+class ResultV4(TypedDict):
+	notification_key: str
+	strategy_data: str
+	strategy_id: str
+	agent_id: str
+	created_at: str
+
+
 def save_result_v4(
 	notification_key: str,
 	strategy_data: str,
@@ -112,52 +422,119 @@ def save_result_v4(
 	"""
 	This function is for future made KBs so that it doesnt have to be bounded to the session_id
 	"""
+	return save_result_batch_v4(
+		[
+			ResultV4(
+				notification_key=notification_key,
+				strategy_data=strategy_data,
+				strategy_id=strategy_id,
+				agent_id=agent_id,
+				created_at=created_at,
+			)
+		]
+	)[0]
+
+
+def save_result_batch_v4(results: List[ResultV4]) -> List[str]:
+	"""
+	Ingest many strategies into their v4 KBs at once.
 
-	kb_id = f"{agent_id}"
-	text = f"Notification: {notification_key}"
+	Results are grouped by `kb_id`. For each KB the existing ids are read once,
+	every new notification is embedded in a single batched embedding request,
+	and the new rows are appended to the KB files once.
 
-	is_exist = check_pkl_exists(kb_id, pkl_folder="./pkl/v4")
+	Args:
+		results (List[ResultV4]): The strategies to ingest
 
-	if (
-		check_if_reference_id_exists_in_kb(
-			kb_id=kb_id, strategy_id=strategy_id, pkl_folder="./pkl/v4"
-		)
-		and is_exist
-	):
-		logger.info(
-			f"Strategy with the `strategy_id` of {strategy_id} has already been before ingested for `kb_id` of {kb_id}"
-		)
-		return f"Strategy with the `strategy_id` of {strategy_id} has already been before ingested for `kb_id` of {kb_id}"
-
-	document = Document(
-		page_content=text,
-		metadata={
-			"reference_id": strategy_id,
-			"strategy_data": strategy_data,
-			"created_at": created_at,
-		},
-	)
-	document.id = str(strategy_id)
+	Returns:
+		List[str]: One output message per result, in the same order as `results`
+	"""
+	outputs: List[str] = [""] * len(results)
 
-	embeddings = get_embeddings()
+	positions_by_kb_id: Dict[str, List[int]] = {}
+	for position, result in enumerate(results):
+		positions_by_kb_id.setdefault(f"{result['agent_id']}", []).append(position)
 
-	if is_exist:
-		vectorstore = FAISS.load_local(
-			"pkl/v4/",
-			embeddings,
+	for kb_id, positions in positions_by_kb_id.items():
+		stored_ids = existing_reference_ids(
 			kb_id,
-			allow_dangerous_deserialization=True,
-			distance_strategy="COSINE",
-		)
-		vectorstore.add_documents([document])
-	else:
-		vectorstore = FAISS.from_documents(
-			[document], embeddings, distance_strategy="COSINE"
+			[str(results[position]["strategy_id"]) for position in positions],
+			pkl_folder=V4_PKL_FOLDER,
 		)
 
-	vectorstore.save_local("pkl/v4/", kb_id)
+		new_positions = []
+		for position in positions:
+			strategy_id = str(results[position]["strategy_id"])
+
+			if strategy_id in stored_ids:
+				logger.info(
+					f"Strategy with the `strategy_id` of {strategy_id} has already been before ingested for `kb_id` of {kb_id}"
+				)
+				outputs[position] = (
+					f"Strategy with the `strategy_id` of {strategy_id} has already been before ingested for `kb_id` of {kb_id}"
+				)
+				continue
+
+			stored_ids.add(strategy_id)
+			new_positions.append(position)
+
+		if not new_positions:
+			continue
+
+		texts = [
+			f"Notification: {results[position]['notification_key']}"
+			for position in new_positions
+		]
+		metadatas = [
+			{
+				"reference_id": results[position]["strategy_id"],
+				"strategy_data": results[position]["strategy_data"],
+				"created_at": results[position]["created_at"],
+			}
+			for position in new_positions
+		]
+		ids = [str(results[position]["strategy_id"]) for position in new_positions]
+
+		embeddings = get_embeddings()
+		text_embeddings = list(zip(texts, embeddings.embed_documents(texts)))
+
+		with kb_lock(V4_PKL_FOLDER, kb_id):
+			# Another request may have ingested some of the ids while embedding
+			stored_ids = existing_reference_ids(kb_id, ids, pkl_folder=V4_PKL_FOLDER)
+			keep = [i for i, doc_id in enumerate(ids) if doc_id not in stored_ids]
+
+			for i, doc_id in enumerate(ids):
+				if doc_id in stored_ids:
+					outputs[new_positions[i]] = (
+						f"Strategy with the `strategy_id` of {doc_id} has already been before ingested for `kb_id` of {kb_id}"
+					)
+
+			new_positions = [new_positions[i] for i in keep]
+			text_embeddings = [text_embeddings[i] for i in keep]
+			metadatas = [metadatas[i] for i in keep]
+			ids = [ids[i] for i in keep]
+
+			if not ids:
+				continue
+
+			append_kb(V4_PKL_FOLDER, kb_id, text_embeddings, metadatas, ids)
+			reference_id_index.add(V4_PKL_FOLDER, kb_id, ids)
+
+			# Map the appended rows into a warm vectorstore instead of reloading it
+			added = index_registry.extend(
+				"v4",
+				kb_id,
+				lambda vectorstore: refresh_kb(vectorstore, V4_PKL_FOLDER, kb_id),
+				added_bytes=sum(len(vector) * 4 + 8 for _, vector in text_embeddings),
+			)
+			if not added:
+				index_registry.invalidate("v4", kb_id)
+
+		for position in new_positions:
+			outputs[position] = "Document ingested successfully"
 
-	logger.info(
-		f"Document ingested successfully for `agent_id`: {agent_id}, `strategy_id`: {strategy_id}"
-	)
-	return "Document ingested successfully"
+		logger.info(
+			f"{len(new_positions)} document(s) ingested successfully for `agent_id`: {kb_id}"
+		)
+
+	return outputs
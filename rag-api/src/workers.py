@@ -0,0 +1,30 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, TypeVar
+
+RAG_WORKERS = int(os.getenv("RAG_WORKERS", str(os.cpu_count() or 4)))
+
+T = TypeVar("T")
+
+# FAISS searches and SQLite lookups release the GIL, so a thread pool lets
+# concurrent requests use every core while keeping the event loop free.
+executor = ThreadPoolExecutor(max_workers=RAG_WORKERS, thread_name_prefix="rag-worker")
+
+
+async def run_blocking(fn: Callable[..., T], *args, **kwargs) -> T:
+	"""
+	Run a blocking function on the bounded worker pool without blocking the event loop.
+
+	Args:
+		fn (Callable[..., T]): The blocking function
+		*args: Positional arguments of `fn`
+		**kwargs: Keyword arguments of `fn`
+
+	Returns:
+		T: The return value of `fn`
+	"""
+	loop = asyncio.get_running_loop()
+
+	return await loop.run_in_executor(executor, partial(fn, *args, **kwargs))
@@ -0,0 +1,307 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+def test_save_and_retrieve_with_hashing_embeddings(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	monkeypatch.setenv("RAG_EMBEDDING_PROVIDER", "hashing")
+	monkeypatch.setenv("RAG_EMBEDDING_DIMENSIONS", "256")
+
+	from scripts.api import app
+
+	client = TestClient(app)
+
+	items = [
+		{
+			"notification_key": notification_key,
+			"strategy_data": f"strategy for {notification_key}",
+			"reference_id": reference_id,
+			"agent_id": "test_agent_id",
+			"session_id": "test_session_id",
+			"created_at": "2023-10-01T00:00:00Z",
+		}
+		for notification_key, reference_id in [
+			("Bitcoin breaks all time high", "strategy_1"),
+			("Pizza prices rise in Italy", "strategy_2"),
+			("Bitcoin breaks all time high", "strategy_1"),
+		]
+	]
+
+	response = client.post("/save_result_batch_v4", json=items)
+	assert response.status_code == 200
+	outputs = response.json()["data"]["outputs"]
+	assert outputs[0] == "Document ingested successfully"
+	assert outputs[1] == "Document ingested successfully"
+	assert "already been before ingested" in outputs[2]
+
+	response = client.post(
+		"/relevant_strategy_raw_v4",
+		json={
+			"query": "Bitcoin reaches a new all time high",
+			"agent_id": "test_agent_id",
+			"session_id": "test_session_id",
+			"top_k": 2,
+		},
+	)
+	assert response.status_code == 200
+	data = response.json()["data"]
+	assert [doc["metadata"]["reference_id"] for doc in data] == [
+		"strategy_1",
+		"strategy_2",
+	]
+	assert os.path.exists("pkl/v4/test_agent_id/manifest.json")
+
+	response = client.post(
+		"/relevant_strategy_raw_v4/batch",
+		json=[
+			{
+				"query": "Bitcoin reaches a new all time high",
+				"agent_id": "test_agent_id",
+				"session_id": "test_session_id",
+				"top_k": 2,
+			},
+			{
+				"query": "Pizza prices in Italy",
+				"agent_id": "test_agent_id",
+				"session_id": "test_session_id",
+				"top_k": 1,
+			},
+			{
+				"query": "Bitcoin reaches a new all time high",
+				"agent_id": "unknown_agent_id",
+				"session_id": "test_session_id",
+				"top_k": 1,
+			},
+		],
+	)
+	assert response.status_code == 200
+	data = response.json()["data"]
+	assert [[doc["metadata"]["reference_id"] for doc in docs] for docs in data] == [
+		["strategy_1", "strategy_2"],
+		["strategy_2"],
+		[],
+	]
+	assert [doc["metadata"]["distance"] for doc in data[0]] == [
+		doc["metadata"]["distance"]
+		for doc in client.post(
+			"/relevant_strategy_raw_v4",
+			json={
+				"query": "Bitcoin reaches a new all time high",
+				"agent_id": "test_agent_id",
+				"session_id": "test_session_id",
+				"top_k": 2,
+			},
+		).json()["data"]
+	]
+
+
+def test_concurrent_saves_extend_a_warm_kb(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	monkeypatch.setenv("RAG_EMBEDDING_PROVIDER", "hashing")
+	monkeypatch.setenv("RAG_EMBEDDING_DIMENSIONS", "256")
+
+	from src.fetch import get_data_raw_v4
+	from src.kbstore import load_kb
+	from src.registry import index_registry
+	from src.store import V4_PKL_FOLDER, get_embeddings, save_result_v4
+
+	kb_id = "concurrent_agent_id"
+	index_registry.clear()
+
+	assert (
+		save_result_v4("Seed notification", "seed strategy", "seed", kb_id)
+		== "Document ingested successfully"
+	)
+	assert len(get_data_raw_v4("Seed notification", kb_id, 1)) == 1
+	warm = index_registry.peek("v4", kb_id)
+	assert warm is not None
+	bytes_before = index_registry.stats()["bytes"]
+
+	def save(i: int) -> str:
+		return save_result_v4(
+			f"Notification number {i}", f"strategy {i}", f"strategy_{i}", kb_id
+		)
+
+	def search(i: int) -> int:
+		return len(get_data_raw_v4(f"Notification number {i}", kb_id, 3))
+
+	with ThreadPoolExecutor(max_workers=8) as pool:
+		saves = [pool.submit(save, i) for i in range(32)]
+		searches = [pool.submit(search, i) for i in range(32)]
+
+		assert [future.result() for future in saves] == [
+			"Document ingested successfully"
+		] * 32
+		assert all(future.result() >= 1 for future in searches)
+
+	# The warm vectorstore was extended in place, not copied or reloaded
+	assert index_registry.peek("v4", kb_id) is warm
+	assert warm.index.ntotal == 33
+	assert index_registry.stats()["bytes"] > bytes_before
+
+	expected_ids = {"seed"} | {f"strategy_{i}" for i in range(32)}
+	reloaded = load_kb(V4_PKL_FOLDER, kb_id, get_embeddings())
+	assert reloaded is not None
+	for vectorstore in [warm, reloaded]:
+		assert {
+			vectorstore.docstore.search(doc_id).metadata["reference_id"]
+			for doc_id in vectorstore.index_to_docstore_id.values()
+		} == expected_ids
+
+	docs = get_data_raw_v4("Notification number 7", kb_id, 1)
+	assert docs[0][0].metadata["reference_id"] == "strategy_7"
+
+
+def mapped_files() -> set:
+	with open("/proc/self/maps") as f:
+		return {
+			line.split(maxsplit=5)[5].strip() for line in f if len(line.split()) > 5
+		}
+
+
+def test_kb_loads_are_memory_mapped_and_lazy(tmp_path):
+	import json
+
+	import numpy as np
+	from langchain_core.embeddings import FakeEmbeddings
+
+	from src.kbstore import (
+		INDEX_FILE,
+		VECTORS_FILE,
+		KBDocstore,
+		_index_header,
+		append_kb,
+		load_kb,
+		refresh_kb,
+	)
+
+	folder = str(tmp_path)
+	embeddings = FakeEmbeddings(size=4)
+	vectors = np.eye(4, dtype=np.float32).tolist()
+
+	append_kb(
+		folder,
+		"kb",
+		[(f"text {i}", vectors[i]) for i in range(3)],
+		[{"reference_id": f"id_{i}"} for i in range(3)],
+		[f"id_{i}" for i in range(3)],
+	)
+	# An append interrupted after its manifest, before raising the count of the index
+	with open(tmp_path / "kb" / INDEX_FILE, "r+b") as f:
+		f.write(_index_header(4, 2))
+
+	vectorstore = load_kb(folder, "kb", embeddings)
+	assert vectorstore is not None
+	assert isinstance(vectorstore.docstore, KBDocstore)
+	assert vectorstore.index.ntotal == 3
+	docs = vectorstore.similarity_search_with_score_by_vector(vectors[2], k=1)
+	assert docs[0][0].metadata == {"reference_id": "id_2"}
+
+	# A KB whose header is up to date is mapped from the file, not read into memory
+	index_path = str(tmp_path / "kb" / INDEX_FILE)
+	del vectorstore
+	assert index_path not in mapped_files()
+	vectorstore = load_kb(folder, "kb", embeddings)
+	assert vectorstore is not None
+	assert index_path not in mapped_files()  # Still repaired in memory
+	with open(index_path, "r+b") as f:
+		f.write(_index_header(4, 3))
+	vectorstore = load_kb(folder, "kb", embeddings)
+	assert vectorstore is not None
+	assert index_path in mapped_files()
+
+	# Appended documents are mapped into the loaded vectorstore
+	append_kb(
+		folder, "kb", [("text 3", vectors[3])], [{"reference_id": "id_3"}], ["id_3"]
+	)
+	refresh_kb(vectorstore, folder, "kb")
+	assert vectorstore.index.ntotal == 4
+	docs = vectorstore.similarity_search_with_score_by_vector(vectors[3], k=1)
+	assert docs[0][0].metadata == {"reference_id": "id_3"}
+	with pytest.raises(ValueError):
+		vectorstore.add_embeddings([("text 4", vectors[0])])
+
+	# KBs of the raw `vectors.f32` layout are converted on load
+	os.makedirs(tmp_path / "raw")
+	with open(tmp_path / "raw" / VECTORS_FILE, "wb") as f:
+		f.write(np.asarray(vectors[:2], dtype=np.float32).tobytes())
+	records = b"".join(
+		json.dumps(
+			{"id": f"id_{i}", "page_content": f"text {i}", "metadata": {"i": i}}
+		).encode()
+		+ b"\n"
+		for i in range(2)
+	)
+	with open(tmp_path / "raw" / "documents.jsonl", "wb") as f:
+		f.write(records)
+	with open(tmp_path / "raw" / "manifest.json", "w") as f:
+		json.dump({"dimensions": 4, "count": 2, "documents_bytes": len(records)}, f)
+
+	vectorstore = load_kb(folder, "raw", embeddings)
+	assert vectorstore is not None
+	assert not os.path.exists(tmp_path / "raw" / VECTORS_FILE)
+	docs = vectorstore.similarity_search_with_score_by_vector(vectors[1], k=2)
+	assert [doc.metadata["i"] for doc, _ in docs] == [1, 0]
+
+
+def test_agent_shards_do_not_include_other_agents(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	os.makedirs("pkl/agents")
+	for name in [
+		"a_1.pkl",
+		"a_5f0c8a1e-8d2b-4f7e-9a51-2f3c4d5e6f70.pkl",
+		"a_1.faiss",
+		"a_b_0.pkl",
+		"ab_2.pkl",
+		"agents/a.pkl",
+	]:
+		open(os.path.join("pkl", name), "w").close()
+
+	from src.store import agent_shard_names
+
+	assert agent_shard_names("a") == [
+		"a_1",
+		"a_5f0c8a1e-8d2b-4f7e-9a51-2f3c4d5e6f70",
+	]
+	assert agent_shard_names("a_b") == ["a_b_0"]
+
+
+def test_async_embeddings_use_the_cache_off_the_event_loop(tmp_path):
+	import asyncio
+	import threading
+
+	from src.embeddings import CachedEmbeddings, EmbeddingCache, HashingEmbeddings
+
+	class RecordingCache(EmbeddingCache):
+		def __init__(self, db_path: str):
+			super().__init__(db_path)
+			self.threads = []
+
+		def get_many(self, keys):
+			self.threads.append(threading.get_ident())
+			return super().get_many(keys)
+
+		def put_many(self, vectors):
+			self.threads.append(threading.get_ident())
+			return super().put_many(vectors)
+
+	cache = RecordingCache(str(tmp_path / "embeddings.sqlite3"))
+	embeddings = CachedEmbeddings(
+		HashingEmbeddings(dimensions=64), "hashing", 64, cache
+	)
+
+	async def embed_twice():
+		first = await embeddings.aembed_documents(["bitcoin", "pizza"])
+		second = await embeddings.aembed_documents(["bitcoin", "pizza"])
+		return threading.get_ident(), first, second
+
+	loop_thread, first, second = asyncio.run(embed_twice())
+
+	assert first == second
+	assert cache.stats() == {"hits": 2, "misses": 2}
+	# get, put on the miss, then get on the hit
+	assert len(cache.threads) == 3
+	assert loop_thread not in cache.threads